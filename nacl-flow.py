@@ -4,18 +4,19 @@
 """nacl-flow
 
 Usage:
-  nacl-flow.py (issues | i) [all]
-  nacl-flow.py (my-issues | mi) [all]
-  nacl-flow.py (close-issue | ci) ID
-  nacl-flow.py (reopen-issue | roi) ID
-  nacl-flow.py (projectmember | pm)
-  nacl-flow.py (mergerequests | mr) [all]
-  nacl-flow.py (mergedetails | md) MERGEREQUEST_ID
-  nacl-flow.py (test-merge | tm) MERGEREQUEST_ID
-  nacl-flow.py (accept-merge | am) MERGEREQUEST_ID
-  nacl-flow.py (start-patch | sp) ID
-  nacl-flow.py (commit-patch | cp) [ASSIGNEE] [TEXT]
-  nacl-flow.py (get-commit | gc) SHA
+  nacl-flow.py (issues | i) [all] [--no-cache]
+  nacl-flow.py (my-issues | mi) [all] [--no-cache]
+  nacl-flow.py (close-issue | ci) ID [--no-cache]
+  nacl-flow.py (reopen-issue | roi) ID [--no-cache]
+  nacl-flow.py (projectmember | pm) [--no-cache]
+  nacl-flow.py (mergerequests | mr) [all] [--no-cache]
+  nacl-flow.py (mergedetails | md) MERGEREQUEST_ID [--no-cache]
+  nacl-flow.py (test-merge | tm) MERGEREQUEST_ID [--no-cache]
+  nacl-flow.py (accept-merge | am) MERGEREQUEST_ID [--no-cache]
+  nacl-flow.py (start-patch | sp) ID [--no-cache]
+  nacl-flow.py (commit-patch | cp) [ASSIGNEE] [TEXT] [--no-cache]
+  nacl-flow.py (get-commit | gc) SHA [--no-cache]
+  nacl-flow.py (clear-cache | cc)
   nacl-flow.py (-h | --help)
   nacl-flow.py --version
 
@@ -32,13 +33,17 @@ Options:
   start-patch       Step 1 in resolving an issue: start a patch. NOTE: You have to provide the ID of the issue
   commit-patch      Step 2 open a mergerequest, ASSIGNEE = ID of a user, TEXT = MR text
   get-commit        Get infos of a commit and display them
+  clear-cache       Forget the cached ids of projects, groups, issues and mergerequests and the project details
+  --no-cache        Don't use the cached gitlab API responses
   -h --help         Show this screen.
   --version         Show version.
 
 """
 
 from nacl.flow import NaclFlow
+from nacl.flow import clear_cache
 from nacl.base import init_nacl
+from nacl.base import disable_http_cache
 from vendor.docopt import docopt
 import sys
 # This is a BAD hack to avoid SSLContext Warnings of urllib3 in python <2.7.9
@@ -55,6 +60,12 @@ if __name__ == '__main__':
 # Before we do anything else, we check, if nacl will possibly work.
 init_nacl()
 
+if arguments['--no-cache']:
+    disable_http_cache()
+
+if arguments['clear-cache'] or arguments['cc']:
+    clear_cache()
+
 if arguments['issues'] or arguments['i']:
     flow = NaclFlow()
     flow.get_all_issues(arguments['all'])
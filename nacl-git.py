@@ -4,26 +4,35 @@
 """nacl-git
 
 Usage:
-  nacl-git.py (list | l)
+  nacl-git.py (list | l) [--jobs=N] [--refresh] [--rescan]
   nacl-git.py (branch | b) [BRANCH]
   nacl-git.py (checkout | c) [BRANCH]
-  nacl-git.py mergeall
-  nacl-git.py (merge | m)
+  nacl-git.py mergeall [--jobs=N] [--refresh] [--rescan]
+  nacl-git.py (merge | m) [--refresh]
   nacl-git.py (prune | pr)
-  nacl-git.py (remote-diff | rd)
-  nacl-git.py (compare-remote | cr)
+  nacl-git.py (remote-diff | rd) [--refresh]
+  nacl-git.py (remote-diff | rd) --all [--jobs=N] [--refresh] [--rescan]
+  nacl-git.py (compare-remote | cr) [--rescan]
   nacl-git.py (-h | --help)
   nacl-git.py --version
 
 Options:
   list              List all salt related local respositories
+  -j N --jobs=N     Number of repositories checked or merged in parallel
+                    (default: twice the number of CPUs)
   branch            Show current branch. If BRANCH is provided it will create BRANCH with --track
   checkout          Checkout master or BRANCH
   mergeall          Merge all diverged branches of all pillars and modules
   merge             Merges remote into local branch (e.g. 'git merge --ff-only')
   prune             Removes staled remote refs
   remote-diff        Show diff between local and remote
+  --all             Fetch all repositories, show a diff stat of each and
+                    the full diffs on demand
   compare-remote    Are all remote git repos on our local filesystem?
+  --refresh         Fetch from origin even if the last fetch is younger
+                    than fetch_ttl seconds (see ~/.nacl, default: 60)
+  --rescan          Search the salt roots for repositories again instead
+                    of using the cached repository index
   -h --help         Show this screen.
   --version         Show version.
 
@@ -38,6 +47,7 @@ from nacl.git import merge_all_repositories
 from nacl.git import merge_single_repository
 from nacl.git import remote_prune
 from nacl.git import remote_diff
+from nacl.git import remote_diff_all
 from nacl.git import compare_remote
 from nacl.base import init_nacl
 from vendor.docopt import docopt
@@ -59,7 +69,9 @@ init_nacl()
 
 # list all git repositories
 if arguments['list'] or arguments['l']:
-    list_salt_git_repositories()
+    list_salt_git_repositories(jobs=arguments['--jobs'],
+                               refresh=arguments['--refresh'],
+                               rescan=arguments['--rescan'])
 
 if arguments['branch'] or arguments['b']:
     change_or_create_branch(arguments['BRANCH'])
@@ -68,16 +80,23 @@ if arguments['checkout'] or arguments['c']:
     checkout_branch(arguments['BRANCH'])
 
 if arguments['mergeall']:
-    merge_all_repositories()
+    merge_all_repositories(refresh=arguments['--refresh'],
+                           rescan=arguments['--rescan'],
+                           jobs=arguments['--jobs'])
 
 if arguments['merge'] or arguments['m']:
-    merge_single_repository()
+    merge_single_repository(refresh=arguments['--refresh'])
 
 if arguments['prune'] or arguments['pr']:
     remote_prune()
 
 if arguments['remote-diff'] or arguments['rd']:
-    remote_diff()
+    if arguments['--all']:
+        remote_diff_all(refresh=arguments['--refresh'],
+                        rescan=arguments['--rescan'],
+                        jobs=arguments['--jobs'])
+    else:
+        remote_diff(refresh=arguments['--refresh'])
 
 if arguments['compare-remote'] or arguments['cr']:
-    compare_remote()
+    compare_remote(rescan=arguments['--rescan'])
@@ -8,16 +8,20 @@ My no means they are intended to be used in another context.
 
 Following modules are included:
     - base: Basic functions needed in different places
+    - cache: Persistent caches below ~/.cache/nacl
     - decorator: Especially logging is done with decorators
     - exceptions: Put custom exceptions here
     - fileutils: If it comes to FS operations like reading a file
     - flow: Contains everything for nacl-flow
     - git: Contains everything for nacl-git
+    - gitconfig: Reading the config of repositories directly from .git
     - gitapi: This SHOULD contain an abstraction layer for operations against
               gitlab or github servers. But it is a bloody mess yet and has
               nothing to do with what it was supposed to.
     - gitlabapi: Communication with an gitlab instance
     - helper: Some helper for colorizing output etc.
+    - httpcache: Revalidating cache of gitlab API responses
+    - refs: Reading branches and SHAs directly from .git
 
 Let's start refactoring.
 """
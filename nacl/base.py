@@ -7,47 +7,305 @@ Basic functions for the nacl package
 This module should contain some basic functions, needed
 within the nacl package.
 """
-import salt.config
 from nacl.decorator import log
+import vendor.yaml as yaml
+import glob
 import json
 import os
+import threading
+
+SALT_MASTER_CONFIG = '/etc/salt/master'
+
+# What the salt master uses, if the roots are not configured
+SALT_ROOT_DEFAULTS = {
+    'file_roots': {'base': ['/srv/salt', '/srv/spm/salt']},
+    'pillar_roots': {'base': ['/srv/pillar', '/srv/spm/pillar']}}
+
+# (path, mtime) of all salt master config files -> root dirs
+_salt_root_dirs_cache = {}
+
+_yaml_loader = None
+
+# Connections kept open per host by the shared HTTP session
+HTTP_POOL_SIZE = 10
 
 
 def get_salt_root_dirs():
-    """ return root of the salt pillars, states, formulas etc. as a list """
+    """
+    return root of the salt pillars, states, formulas etc. as a list
+
+    The roots are read from the master config files directly, which is
+    a lot faster than importing salt. The result is kept as long as none
+    of the files has changed.
+    """
+    config_files = get_salt_master_config_files()
+    stamp = get_config_stamp(config_files)
+
+    if stamp not in _salt_root_dirs_cache:
+        salt_master_config = read_salt_master_roots(config_files)
+        if salt_master_config is None:
+            salt_master_config = read_salt_master_roots_with_salt()
+
+        dir_list = []
+
+        # parsing file_roots
+        for env, values in salt_master_config['file_roots'].iteritems():
+            dir_list.extend(values)
+
+        # parsing pillar root
+        for env, values in salt_master_config['pillar_roots'].iteritems():
+            dir_list.extend(values)
+
+        _salt_root_dirs_cache.clear()
+        _salt_root_dirs_cache[stamp] = sorted(set(dir_list))
+
+    return list(_salt_root_dirs_cache[stamp])
+
+
+def get_salt_master_config_files():
+    """ The master config and master.d/*.conf in the order salt reads them """
+    master_d = os.path.join(os.path.dirname(SALT_MASTER_CONFIG), 'master.d')
+    return [SALT_MASTER_CONFIG] + \
+        sorted(glob.glob(os.path.join(master_d, '*.conf')))
+
+
+def get_config_stamp(config_files):
+    """ Return the files along with their mtime (None if missing) """
+    stamp = []
+    for config_file in config_files:
+        try:
+            stamp.append((config_file, os.stat(config_file).st_mtime))
+        except OSError:
+            stamp.append((config_file, None))
+    return tuple(stamp)
+
+
+def get_yaml_loader():
+    """
+    Return the fastest usable yaml loader
 
-    salt_master_config = salt.config.client_config('/etc/salt/master')
+    libyaml is only used if it works together with the vendored yaml
+    package. An installed PyYAML might provide a _yaml module which
+    does not.
+    """
+    global _yaml_loader
+
+    if _yaml_loader is None:
+        _yaml_loader = yaml.SafeLoader
+        if yaml.__with_libyaml__:
+            try:
+                yaml.load('foo: [bar]', Loader=yaml.CSafeLoader)
+                _yaml_loader = yaml.CSafeLoader
+            except Exception:
+                pass
+
+    return _yaml_loader
+
+
+def is_root_dict(value):
+    """ file_roots and pillar_roots map environments to lists of dirs """
+    return isinstance(value, dict) and \
+        all(isinstance(dirs, list) for dirs in value.values())
+
+
+def read_salt_master_roots(config_files):
+    """
+    Read file_roots and pillar_roots like the salt master does
+
+    The first file is the master config, the others are the files of
+    master.d. Settings of master.d are merged with each other and
+    replace those of the master config.
+    Returns None if the configuration needs salt itself to be read
+    (include, templating, unexpected content).
+    """
+    configs = []
+
+    for config_file in config_files:
+        try:
+            with open(config_file) as stream:
+                content = stream.read()
+        except IOError:
+            # salt runs with its defaults without a config file
+            configs.append({})
+            continue
 
-    dir_list = []
+        if '{{' in content or '{%' in content:
+            return None
 
-    # parsing file_roots
-    for env, values in salt_master_config['file_roots'].iteritems():
-        dir_list.extend(values)
+        try:
+            config = yaml.load(content, Loader=get_yaml_loader()) or {}
+        except yaml.YAMLError:
+            return None
 
-    # parsing pillar root
-    for env, values in salt_master_config['pillar_roots'].iteritems():
-        dir_list.extend(values)
+        if not isinstance(config, dict) or \
+                'include' in config or 'default_include' in config:
+            return None
 
-    return sorted(set(dir_list))
+        configs.append(config)
+
+    master_config, included_configs = configs[0], configs[1:]
+
+    included = {}
+    for config in included_configs:
+        for key in SALT_ROOT_DEFAULTS:
+            if key not in config:
+                continue
+            if not is_root_dict(config[key]):
+                return None
+            roots = included.setdefault(key, {})
+            for env, dirs in config[key].iteritems():
+                roots.setdefault(env, []).extend(dirs)
+
+    salt_roots = {}
+    for key, default in SALT_ROOT_DEFAULTS.iteritems():
+        roots = included.get(key, master_config.get(key, default))
+        if not is_root_dict(roots):
+            return None
+        salt_roots[key] = roots
+
+    return salt_roots
+
+
+def read_salt_master_roots_with_salt():
+    """ Let salt read its configuration, this takes some seconds """
+    import salt.config
+    return salt.config.client_config(SALT_MASTER_CONFIG)
+
+
+class NaclConfig(object):
+    """
+    The users ~/.nacl configuration
+
+    The file is located and read only once per process. Long running
+    processes will read it again if it has changed on disk (mtime and
+    size), all other calls are served from memory.
+    Along with the configuration we keep a ready to use environment for
+    git subprocesses, containing the proxy setting, so git() does not have
+    to rebuild it from os.environ on every call.
+    The same goes for the HTTP session of the gitlab API: all calls share
+    its keep-alive connections, so TCP and TLS handshakes are only done
+    once per host. Unless http_cache is switched off, GET responses are
+    cached (see nacl.httpcache).
+    """
+
+    def __init__(self):
+        self.path = None
+        self.stamp = None
+        self.data = None
+        self.git_env = None
+        self.http_session = None
+        self.http_cache = True
+        self._lock = threading.Lock()
+
+    def find(self):
+        """ Locate the .nacl file """
+
+        # First try to get a .nacl File from an sudo'd user
+        user_home = os.path.expanduser("~" + os.environ.get('SUDO_USER', ''))
+
+        # If this fails, look, if root has a .nacl file
+        if not os.path.isfile(user_home + '/.nacl'):
+            user_home = os.path.expanduser("~")
+
+        return user_home + '/.nacl'
+
+    def load(self):
+        """
+        Return the configuration, read from disk only if needed
+
+        Raises IOError or ValueError if the file is missing or broken.
+        """
+        with self._lock:
+            if not self.path:
+                self.path = self.find()
+
+            try:
+                stat = os.stat(self.path)
+                stamp = (stat.st_mtime, stat.st_size)
+            except OSError:
+                stamp = None
+
+            if self.data is not None and stamp and stamp == self.stamp:
+                return self.data
+
+            with open(self.path) as data_file:
+                data = json.load(data_file)
+
+            self.data = data
+            self.stamp = stamp
+            self.git_env = self._build_git_env(data)
+            self.http_session = None
+            return data
+
+    def _build_git_env(self, data):
+        """ We need os.environ (HOME!) plus a proxy, if there is any """
+        env = dict(os.environ)
+        try:
+            proxy = data['proxy']
+        except (KeyError, TypeError):
+            proxy = False
+
+        if proxy:
+            env['https_proxy'] = proxy
+        return env
+
+    def get_http_session(self):
+        """
+        Return the HTTP session, built on first use
+
+        The session has a connection pool of http_pool_size (default
+        HTTP_POOL_SIZE) connections, uses the proxy and checks SSL
+        certificates unless verify_ssl is false in the configuration.
+        """
+        data = self.load()
+        with self._lock:
+            if self.http_session is None:
+                self.http_session = self._build_http_session(data)
+            return self.http_session
+
+    def _build_http_session(self, data):
+        """ A requests.Session configured like ~/.nacl tells it """
+        # requests takes a while to import, nacl-git mostly does not need it
+        import requests
+
+        pool_size = get_http_pool_size(data)
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size,
+                                                pool_maxsize=pool_size)
+        if self.http_cache:
+            from nacl.httpcache import CachingSession
+            session = CachingSession()
+        else:
+            session = requests.Session()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+
+        proxy = data.get('proxy')
+        if proxy:
+            session.proxies = {'http': proxy, 'https': proxy}
+        session.verify = data.get('verify_ssl', True)
+        return session
+
+    def invalidate(self):
+        """ Forget everything, the next load() reads the file again """
+        with self._lock:
+            self.path = None
+            self.stamp = None
+            self.data = None
+            self.git_env = None
+            self.http_session = None
+
+
+nacl_config = NaclConfig()
 
 
 @log
 def get_users_nacl_conf(no_logging=False):
     """ return the users nacl configuration """
 
-    # First try to get a .nacl File from an sudo'd user
-    user_home = os.path.expanduser("~" + os.environ.get('SUDO_USER', ''))
-
-    # If this fails, look, if root has a .nacl file
-    if not os.path.isfile(user_home + '/.nacl'):
-        user_home = os.path.expanduser("~")
-
     __ret = []
 
     try:
-        with open(user_home + '/.nacl') as data_file:
-            user_config = json.load(data_file)
-        return {'payload': user_config}
+        return {'payload': nacl_config.load()}
     except:
         if no_logging:
             return {'payload': False}
@@ -56,6 +314,51 @@ def get_users_nacl_conf(no_logging=False):
         return __ret
 
 
+def get_git_env():
+    """
+    Return the environment for git subprocesses
+
+    It is built once per loaded configuration and must not be changed
+    by the caller.
+    """
+    # Exits, if there is no valid ~/.nacl
+    get_users_nacl_conf()
+    return nacl_config.git_env
+
+
+def get_http_pool_size(data=None):
+    """
+    Return the number of connections of the shared HTTP session
+
+    data is the nacl configuration, ~/.nacl is loaded if it is not
+    given. Running more API calls in parallel than this only makes them
+    wait for a connection.
+    """
+    if data is None:
+        # Exits, if there is no valid ~/.nacl
+        get_users_nacl_conf()
+        data = nacl_config.load()
+    return data.get('http_pool_size') or HTTP_POOL_SIZE
+
+
+def get_http_session():
+    """
+    Return the shared HTTP session for the gitlab API
+
+    See NaclConfig.get_http_session()
+    """
+    # Exits, if there is no valid ~/.nacl
+    get_users_nacl_conf()
+    return nacl_config.get_http_session()
+
+
+def disable_http_cache():
+    """ Send all gitlab API calls to the server, don't use nacl.httpcache """
+    with nacl_config._lock:
+        nacl_config.http_cache = False
+        nacl_config.http_session = None
+
+
 def write_users_nacl_conf(json_data=None):
     """ Write down the .nacl file """
 
@@ -66,6 +369,7 @@ def write_users_nacl_conf(json_data=None):
     try:
         with open(user_home + '/.nacl', 'w') as json_data_file:
             json.dump(json_data, json_data_file, sort_keys=True, indent=4)
+        nacl_config.invalidate()
         return True
     except:
         return False
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Persistent caches of the nacl package
+
+Everything that is expensive to find out and rarely changes is stored
+as JSON below ~/.cache/nacl (or $XDG_CACHE_HOME/nacl). A cache is only
+a shortcut: a missing, unreadable or broken file just means the data is
+collected again, so no function in here raises.
+"""
+import json
+import os
+import tempfile
+
+
+def get_cache_dir():
+    """ Return the directory of the nacl caches """
+    cache_home = os.environ.get('XDG_CACHE_HOME') or \
+        os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'nacl')
+
+
+def get_cache_file(name):
+    """ Return the path of the cache called name """
+    return os.path.join(get_cache_dir(), name + '.json')
+
+
+def load_cache(name):
+    """ Return the content of the cache called name or None """
+    try:
+        with open(get_cache_file(name)) as cache_file:
+            return json.load(cache_file)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def save_cache(name, data):
+    """
+    Store data in the cache called name
+
+    The file is written to a temporary file first and then renamed,
+    so concurrent readers never see a half written cache.
+    Returns True if the cache was written.
+    """
+    cache_dir = get_cache_dir()
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir, 0o700)
+
+        fd, tmp_name = tempfile.mkstemp(dir=cache_dir, prefix='.' + name)
+    except (IOError, OSError):
+        return False
+
+    try:
+        with os.fdopen(fd, 'w') as cache_file:
+            json.dump(data, cache_file)
+        os.rename(tmp_name, get_cache_file(name))
+    except (IOError, OSError, TypeError, ValueError):
+        remove_file(tmp_name)
+        return False
+    return True
+
+
+def remove_file(path):
+    """ Remove path, if it is there """
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def remove_cache(name):
+    """ Remove the cache called name """
+    remove_file(get_cache_file(name))
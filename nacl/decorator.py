@@ -9,7 +9,7 @@ SEE: https://pypi.python.org/pypi/blessings
 """
 
 import sys
-from nacl.helper import color
+from nacl.helper import color, page
 from vendor.blessings import Terminal
 import pprint
 
@@ -67,7 +67,11 @@ def log(func):
             else:
                 raise ValueError('tuple must contain 2 or 3 elements!')
 
-            if level == 'INFO':
+            if not isinstance(msg, basestring):
+                # Long outputs (like diffs) are iterators of lines,
+                # they are streamed into a pager
+                page(color(level, line.rstrip('\n')) + '\n' for line in msg)
+            elif level == 'INFO':
                 sys.stdout.write(u'[ {0} ] {1}'.format(show_lvl, color(level, msg)) + '\n')
             else:
                 sys.stderr.write(u'[ {0} ] {1}'.format(show_lvl, color(level, msg)) + '\n')
@@ -99,8 +103,15 @@ class ListLine(object):
         self.t = Terminal()
 
     def __call__(self, *args, **kwargs):
-        __ret = self._fn(*args, **kwargs)
+        self.write(self._fn(*args, **kwargs))
 
+    def write(self, __ret):
+        """
+        Print out the line for an already collected result
+
+        This is needed if the results are gathered somewhere else, like
+        in a pool of threads, and only printing is left to do.
+        """
         if not __ret:
             return
 
@@ -12,3 +12,13 @@ appropriate.
 class GitCallError(Exception):
     """ Raise this when something is wrong while calling git. """
     pass
+
+
+class RefReadError(Exception):
+    """ Raise this when refs can't be read without calling git. """
+    pass
+
+
+class ConfigReadError(Exception):
+    """ Raise this when a git config can't be read without calling git. """
+    pass
@@ -9,8 +9,17 @@ it's meaning.
 """
 from distutils import spawn
 from nacl.base import get_salt_root_dirs
-import fnmatch
+import heapq
 import os
+
+try:
+    from os import scandir
+except ImportError:
+    # python < 3.5, maybe the backport is installed
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
 # import pprint
 
 
@@ -20,22 +29,82 @@ def binary_exists(binary_name):
     return(bool(binary_path))
 
 
-def get_dir_list_from_filesystem(filter='*.git'):
+def list_directory(path):
+    """
+    Return whether path is a git working tree and its subdirectories
+
+    Symlinks to directories are not followed (like os.walk does).
+    The check for a git working tree just looks for a .git entry, which
+    might be a directory or a file (submodules and worktrees).
     """
-    Returns a list of salt directories
+    is_repo = False
+    subdirs = []
+
+    if scandir:
+        for entry in scandir(path):
+            if entry.name == '.git':
+                is_repo = True
+            elif entry.is_dir(follow_symlinks=False):
+                subdirs.append(entry.name)
+    else:
+        for name in os.listdir(path):
+            if name == '.git':
+                is_repo = True
+                continue
+            full_path = os.path.join(path, name)
+            if os.path.isdir(full_path) and not os.path.islink(full_path):
+                subdirs.append(name)
+
+    return is_repo, subdirs
+
 
-    Its default purpose is to return a list of pillar- and state
-    git directories.
-    Maybe we like to use this function later on to find directories with *.sls
-    files in them.
+def find_git_repositories(roots=None, scanned=None):
     """
+    Yield all git working trees below the salt root directories
+
+    The walk never descends into a repository once it is found (so
+    neither into .git nor into the working tree). Roots resolving to the same real path are walked
+    only once.
+    Repositories are yielded while walking, sorted by their full path,
+    so the caller can start working on the first ones before the walk is
+    done.
+    If a dict is passed as scanned, the mtime of every directory which
+    was scanned but is no repository is stored in it. Adding or removing
+    a repository changes one of these mtimes. Directories which do not
+    exist (e.g. a salt root which is not created yet) are stored with
+    None.
+    """
+    if roots is None:
+        roots = get_salt_root_dirs()
+
+    seen = set()
+
+    # Always go on with the smallest path we know of. Everything below
+    # a directory sorts after it, so the paths come out sorted (a-b is
+    # yielded before a/x, which a depth first walk would not do).
+    heap = list(set(roots))
+    heapq.heapify(heap)
+    while heap:
+        path = heapq.heappop(heap)
+
+        real_path = os.path.realpath(path)
+        if real_path in seen:
+            continue
+        seen.add(real_path)
 
-    matches = []
-    starter = get_salt_root_dirs()
+        try:
+            is_repo, subdirs = list_directory(path)
+            if scanned is not None and not is_repo:
+                scanned[path] = os.stat(path).st_mtime
+        except OSError:
+            # vanished or no permission
+            if scanned is not None and not os.path.exists(path):
+                scanned[path] = None
+            continue
 
-    for start in starter:
-        for root, dirnames, filenames in os.walk(start):
-            if fnmatch.fnmatch(root, filter):
-                matches.append(root)
+        if is_repo:
+            yield path
+            continue
 
-    return matches
+        for name in subdirs:
+            heapq.heappush(heap, os.path.join(path, name))
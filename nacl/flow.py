@@ -12,14 +12,34 @@ as well. But there are some major design flaws done while development.
 For example there is no proper abstraction of gitlab and github calls (there
 is actually no abstraction at all).
 """
+from functools import partial
 import nacl.gitlabapi as api
 from nacl.helper import check_string_to_int
 from nacl.helper import query_yes_no
+from nacl.helper import run_parallel
+from nacl.helper import split_lines
 import nacl.git as git
+import nacl.gitapi
+from nacl.cache import remove_cache
 from nacl.decorator import log
 import pprint
 
 
+@log
+def clear_cache():
+    """
+    Forget the remembered ids of gitlab projects, groups, issues and
+    mergerequests and the details of projects
+
+    They are looked up again on the next use. Needed if a project was
+    moved or replaced on the gitlab server.
+    """
+    nacl.gitapi.forget_ids()
+    remove_cache(api.IID_CACHE)
+    remove_cache(api.PROJECT_CACHE)
+    return [('INFO', 'Cached gitlab ids removed')]
+
+
 class NaclFlow(object):
     """
     Abstraction of the nacl-flow workflow
@@ -37,7 +57,16 @@ class NaclFlow(object):
         a use with different APIs like the one of github.
         """
         self.api = api.GitLapApiCall()
-        self.p_id = self.api.get_project_id()
+
+    @property
+    def p_id(self):
+        """
+        The project ID, shared with the api
+
+        It is resolved on first use, commands that are not about the
+        project of the current git repository never look it up.
+        """
+        return self.api.p_id
 
     @log
     def get_all_issues(self, all=None):
@@ -81,20 +110,22 @@ class NaclFlow(object):
 
         As long as 'all' is not set only open issues are shown.
         """
-        issues = self.api.getissues()
+        issues = [issue for issue in self.api.getissues()
+                  if all or issue['state'] != 'closed']
+
+        # One lookup per project, not per issue
+        projects = self.api.get_projects(
+            issue['project_id'] for issue in issues)
 
         __ret = []
 
         for issue in issues:
-            if not all and issue['state'] == 'closed':
-                continue
-
-            project = self.api.getproject(issue['project_id'])
+            project = projects.get(issue['project_id'], {})
 
             __ret.append(('INFO', "TITLE: " + issue['title']))
             __ret.append(('GREEN', "ID: " + str(issue['iid'])))
-            __ret.append(('GREEN', "URL: " + project['web_url']))
-            __ret.append(('BOLD', "REPO: " + project['description']))
+            __ret.append(('GREEN', "URL: " + (project.get('web_url') or '')))
+            __ret.append(('BOLD', "REPO: " + (project.get('description') or '')))
             __ret.append(('GREEN', "WHAT: " + issue['description']))
             __ret.append(('GREEN', "STATE: " + issue['state']))
             __ret.append(('INFO', "AUTHOR: " + issue['author']['name']))
@@ -416,8 +447,9 @@ class NaclFlow(object):
         __ret.append(('BOLD', "STATE: " + change['state']))
         __ret.append(('GREEN', "DATE: " + change['created_at']))
         __ret.append(('DARKCYAN', "DIFF:\n"))
-        for chg in change['changes']:
-            __ret.append(('DARKCYAN', "\n" + chg['diff']))
+        # Diffs are paged by the log decorator
+        __ret.append(('DARKCYAN', split_lines(
+            "\n" + chg['diff'] for chg in change['changes'])))
 
         __ret.append(('INFO', "COMMENTS:"))
         for comment in comments:
@@ -465,12 +497,13 @@ class NaclFlow(object):
 
             return __ret
 
-        values = self.api.get_mergerequest_details(mergerequest_id)
+        # No need for the diffs here
+        values = self.api.get_mergerequest(mergerequest_id).data
         if not values:
             __ret.append(('FAIL', "Mergerequest not found", 1))
             return __ret
 
-        mr_branch = values['changes']['source_branch']
+        mr_branch = values['source_branch']
 
         if git.branch_exist('test_' + mr_branch):
             __ret.append((
@@ -558,8 +591,9 @@ class NaclFlow(object):
             __ret.append(('FAIL', "Commit SHA must be provided"))
             return __ret
 
-        details = self.api.getrepositorycommit(self.p_id, commit)
-        diffs = self.api.getrepositorycommitdiff(self.p_id, commit)
+        details, diffs = run_parallel(
+            partial(self.api.getrepositorycommit, self.p_id, commit),
+            partial(self.api.getrepositorycommitdiff, self.p_id, commit))
 
         if details:
             __ret.append(('BOLD', "COMMIT: {0}".format(commit)))
@@ -572,7 +606,8 @@ class NaclFlow(object):
 
         if diffs:
             __ret.append(('GREEN', "DIFF:\n"))
-            for diff in diffs:
-                __ret.append(('BOLD', "\n{0}".format(diff['diff'])))
+            # Diffs are paged by the log decorator
+            __ret.append(('BOLD', split_lines(
+                "\n{0}".format(diff['diff']) for diff in diffs)))
 
         return __ret
@@ -8,48 +8,301 @@ This is an abstraction for some raw stuff with the git command
 itself and also the main module for the nacl-git command.
 """
 
+import heapq
 import os.path
 import os
+import sys
+import tempfile
+import time
+from functools import partial
+from itertools import chain
 from subprocess import Popen, PIPE
 from pprint import pprint
-from nacl.helper import color, merge_two_dicts
-from nacl.fileutils import get_dir_list_from_filesystem
+from nacl.helper import color, merge_two_dicts, input_wrapper, page
+from nacl.helper import check_string_to_int, default_jobs, thread_map
+from nacl.fileutils import find_git_repositories
+from nacl.cache import load_cache
+from nacl.cache import save_cache
+from nacl.base import get_git_env
 from nacl.base import get_users_nacl_conf
 from nacl.base import get_salt_root_dirs
 import nacl.gitapi
+import nacl.gitconfig
+import nacl.refs
 from nacl.decorator import log, ListLine
-from nacl.exceptions import GitCallError
+from nacl.exceptions import GitCallError, RefReadError, ConfigReadError
+
+# Name of the cache of all salt related repositories (see nacl.cache)
+REPOSITORY_INDEX = 'repositories'
+
+# real path -> is_git_repo()
+_git_repo_cache = {}
+
+# States of a repository after merge_repository()
+MERGED = 'merged'
+UP_TO_DATE = 'up-to-date'
+SKIPPED_DIRTY = 'skipped-dirty'
+# local master has commits origin/master does not have: nothing to merge
+NEED_PUSH = 'need-push'
+DIVERGED = 'diverged'
+FAILED = 'failed'
+MERGE_STATES = [MERGED, UP_TO_DATE, SKIPPED_DIRTY, NEED_PUSH, DIVERGED,
+                FAILED]
+MERGE_STATE_COLORS = {MERGED: 'GREEN',
+                      UP_TO_DATE: 'INFO',
+                      SKIPPED_DIRTY: 'WARNING',
+                      NEED_PUSH: 'WARNING',
+                      DIVERGED: 'WARNING',
+                      FAILED: 'FAIL'}
+
+
+class Repo(object):
+    """
+    A single git repository
+
+    All git commands are run with 'git -C <path>', so the working
+    directory of the process is never changed. That makes it safe to
+    work on several repositories at once from threads.
+    If no path is given, git runs in the current working directory.
+
+    Some facts about a repository are asked for again and again (active
+    branch, HEAD sha, origin url). They are cached in the object until
+    invalidate() is called, e.g. after a checkout.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._facts = {}
+
+    def __repr__(self):
+        return 'Repo({0!r})'.format(self.path)
+
+    @property
+    def dir_name(self):
+        """ The directory of the repository """
+        return self.path or os.getcwd()
+
+    def git(self, args):
+        """ Run git with args inside of this repository """
+        if self.path:
+            args = ['-C', self.path] + args
+        return git(args)
+
+    def git_lines(self, args):
+        """ Run git with args inside of this repository, see git_lines() """
+        if self.path:
+            args = ['-C', self.path] + args
+        return git_lines(args)
+
+    def _fact(self, name, args, read_refs=None):
+        """
+        Ask git only once for a fact
+
+        If read_refs is given (a function of nacl.refs and its arguments),
+        the fact is read from the .git directory and git is only asked if
+        that does not work.
+        """
+        if name not in self._facts:
+            value = None
+            if read_refs:
+                try:
+                    value = self.read_refs(*read_refs)
+                except RefReadError:
+                    pass
+            if value is None:
+                value = self.git(args).rstrip()
+            self._facts[name] = value
+        return self._facts[name]
+
+    def remember(self, name, value):
+        """
+        Cache a fact we already know, so git is not asked for it
+
+        Used when a fact comes for free with the output of another
+        git call (e.g. the branch from 'git status').
+        """
+        self._facts[name] = value
+
+    @property
+    def git_dir(self):
+        """ The .git directory of the repository """
+        if 'git_dir' not in self._facts:
+            git_dir = find_git_dir(os.path.realpath(self.dir_name))
+            if not git_dir:
+                git_dir = os.path.join(self.dir_name,
+                                       self.git(['rev-parse', '--git-dir']).rstrip())
+            self._facts['git_dir'] = git_dir
+        return self._facts['git_dir']
+
+    def read_refs(self, func, *args):
+        """
+        Call func of nacl.refs with the .git directory and args
+
+        Raises RefReadError if the .git directory can not be found
+        without asking git.
+        """
+        if 'local_git_dir' not in self._facts:
+            self._facts['local_git_dir'] = find_git_dir(
+                os.path.realpath(self.dir_name))
+
+        git_dir = self._facts['local_git_dir']
+        if not git_dir:
+            raise RefReadError('no .git directory found')
+        return func(git_dir, *args)
+
+    @property
+    def branch(self):
+        """ The active branch """
+        return self._fact('branch', ['rev-parse', '--abbrev-ref', 'HEAD'],
+                          (nacl.refs.current_branch,))
+
+    @property
+    def head_sha(self):
+        """ The SHA of HEAD """
+        return self._fact('head_sha', ['rev-parse', 'HEAD'],
+                          (nacl.refs.resolve, 'HEAD'))
+
+    def rev_parse(self, rev):
+        """ Return the SHA of a branch, a remote branch, a tag or HEAD """
+        try:
+            return self.read_refs(nacl.refs.resolve, rev)
+        except RefReadError:
+            return self.git(['rev-parse', rev]).rstrip()
+
+    def branches(self):
+        """ Return a list with all local branches """
+        try:
+            return self.read_refs(nacl.refs.list_branches)
+        except RefReadError:
+            return self.git(['for-each-ref',
+                             '--format="%(refname:short)"',
+                             'refs/heads/']).replace('"', '').split()
+
+    @property
+    def origin_url(self):
+        """ The url of the remote origin, read from .git/config if possible """
+        if 'origin_url' not in self._facts:
+            try:
+                self._facts['origin_url'] = \
+                    nacl.gitconfig.get_origin_url(self.git_dir)
+            except ConfigReadError:
+                pass
+        return self._fact('origin_url',
+                          ['config', '--get', 'remote.origin.url'])
+
+    def invalidate(self):
+        """ Forget all cached facts """
+        self._facts = {}
+
+
+def as_repo(repo=None):
+    """
+    Return a Repo object
+
+    Functions of this module accept a Repo, a path or None (the current
+    working directory) as the repository to work on.
+    """
+    if isinstance(repo, Repo):
+        return repo
+    return Repo(repo)
 
 
-def get_all_possible_git_dirs():
+def repository_index_is_valid(index, salt_root_dirs):
+    """
+    Is the repository index still up to date?
+
+    It is, if it was built for the same salt roots and no scanned
+    directory has changed since. A directory which was missing (mtime
+    None) must still be missing.
+    """
+    try:
+        if index['roots'] != sorted(salt_root_dirs):
+            return False
+
+        for path, mtime in index['scanned'].iteritems():
+            if mtime is None:
+                if os.path.exists(path):
+                    return False
+            elif os.stat(path).st_mtime != mtime:
+                return False
+
+        return isinstance(index['repositories'], list)
+    except (KeyError, TypeError, AttributeError, OSError):
+        return False
+
+
+def iter_possible_git_dirs(rescan=False):
     """
     There are two ways in getting git repo locations
 
     There are two ways to locate salt related git repos:
     1. Via the salt config when looking into file_root and pillar_root and
-    2. via get_dir_list_from_filesystem
+    2. via find_git_repositories below these roots
 
-    We have to go both paths and then unify the results
+    We have to go both paths and then unify the results.
+    Repositories are yielded as soon as they are found, sorted by their
+    path.
+
+    The result is stored in the repository index and reused until
+    one of the scanned directories changes or rescan is set.
     """
-    salt_root_dir = get_salt_root_dirs()
-    all_git_dirs_found = [x[:-5] for x in get_dir_list_from_filesystem()]
-    possible_git_dirs = set(salt_root_dir + all_git_dirs_found)
-    checked_git_dirs = [x for x in possible_git_dirs if is_git_repo(x)]
-    return sorted(checked_git_dirs)
+    salt_root_dirs = get_salt_root_dirs()
+
+    if not rescan:
+        index = load_cache(REPOSITORY_INDEX)
+        if repository_index_is_valid(index, salt_root_dirs):
+            for git_dir in index['repositories']:
+                yield git_dir
+            return
+
+    scanned = {}
+    found = []
+    # A root might be a subdirectory of a repository (no .git in it).
+    # The roots are merged into the sorted walk. A root which is a
+    # repository itself has been found by the walk before we get to it.
+    walk = ((git_dir, False)
+            for git_dir in find_git_repositories(salt_root_dirs, scanned))
+    roots = ((root, True) for root in sorted(set(salt_root_dirs)))
+    for git_dir, is_root in heapq.merge(walk, roots):
+        if is_root and (git_dir in found or not is_git_repo(git_dir)):
+            continue
+        found.append(git_dir)
+        yield git_dir
+
+    save_cache(REPOSITORY_INDEX, {'roots': sorted(salt_root_dirs),
+                                  'scanned': scanned,
+                                  'repositories': found})
+
+
+def get_all_possible_git_dirs(rescan=False):
+    """ Return a sorted list of all salt related git repos """
+    return sorted(iter_possible_git_dirs(rescan))
 
 
 @log
-def list_salt_git_repositories():
+def list_salt_git_repositories(jobs=None, refresh=False, rescan=False):
     """
     Printout all salt related git repos and their state
 
     Using a list of local git repositories to check whether
     they have uncommitted changes or not and list them in a pretty way.
+    The status of the repositories is collected by 'jobs' threads in
+    parallel, but printed in the order of the directories.
+    With refresh, every repository is fetched, no matter how fresh it is.
+    With rescan, the repositories are searched again instead of using
+    the repository index.
     """
 
-    check_dirs = get_all_possible_git_dirs()
+    if jobs and not (check_string_to_int(jobs) and int(jobs) > 0):
+        return [('WARNING', 'Number of jobs must be a positive integer', 1)]
+
+    # The status of the first repositories is collected while we are
+    # still looking for the others.
+    check_dirs = iter_possible_git_dirs(rescan)
 
-    if not check_dirs:
+    try:
+        first_dir = next(check_dirs)
+    except StopIteration:
         return [('WARNING', 'No git repository provided!', 3)]
 
     # Some Header
@@ -57,165 +310,414 @@ def list_salt_git_repositories():
     print("%-50s %-15s %-15s %-15s %s" % ("Directory", "Active Branch", "Status", "Local Master", "All Branches"))
     print("=" * 120)
 
-    for git_dir in check_dirs:
-        os.chdir(git_dir)
-        pretty_status()
+    repos = (Repo(git_dir) for git_dir in chain([first_dir], check_dirs))
+    collect = partial(collect_pretty_status, refresh=refresh)
+    for status in thread_map(collect, repos, int(jobs or default_jobs())):
+        pretty_status.write(status)
 
 
-def merge_all_repositories():
+@log
+def merge_all_repositories(refresh=False, rescan=False, jobs=None):
     """
     Check every salt related git repo and merge if needed
 
     Merge all repositories at once when origin/master is ahead
     and the repository is clean.
     We will merge into local master!
-    merge_git_repo is tested as well as get_all_possible_git_dirs.
-    So no further tests intended.
+    The repositories are merged by 'jobs' threads in parallel. A line is
+    printed as soon as a repository is done, a summary at the end.
     """
-    git_repo_list = get_all_possible_git_dirs()
-    for git_repo in git_repo_list:
-        merge_git_repo(git_repo)
+
+    if jobs and not (check_string_to_int(jobs) and int(jobs) > 0):
+        return [('WARNING', 'Number of jobs must be a positive integer', 1)]
+
+    git_repo_list = get_all_possible_git_dirs(rescan)
+
+    if not git_repo_list:
+        return [('WARNING', 'No git repository provided!', 3)]
+
+    def merge(git_repo):
+        return (git_repo,) + merge_repository(git_repo, refresh)
+
+    summary = dict((state, []) for state in MERGE_STATES)
+    jobs = min(int(jobs or default_jobs()), len(git_repo_list))
+    for git_repo, state, error, messages in thread_map(merge, git_repo_list,
+                                                       jobs, ordered=False):
+        print_merge_result(git_repo, state, error)
+        summary[state].append(git_repo)
+
+    print_merge_summary(summary)
+
+
+def print_merge_result(git_repo, state, error=None):
+    """ Print a single line about a merged repository """
+    line = "%-50s %s" % (git_repo, color(MERGE_STATE_COLORS[state], state))
+    if state == FAILED and error:
+        # git errors might be long, the first line has to do
+        line += ': ' + error.strip().split('\n')[0]
+    print(line)
 
 
-def merge_single_repository():
+def print_merge_summary(summary):
+    """ Print how many repositories ended up in which state """
+    print("=" * 120)
+    for state in MERGE_STATES:
+        line = "%-15s %4d" % (state, len(summary[state]))
+        if summary[state] and state in (SKIPPED_DIRTY, NEED_PUSH, DIVERGED,
+                                        FAILED):
+            line += '  ' + ', '.join(sorted(summary[state]))
+        print(color(MERGE_STATE_COLORS[state], line))
+
+
+def merge_single_repository(refresh=False):
     """" Merge a single remote repo into the local branch. """
-    merge_git_repo()
+    merge_git_repo(refresh=refresh)
 
 
 @log
-def merge_git_repo(git_repo_name=None):
+def merge_git_repo(git_repo_name=None, refresh=False):
     """
     Merge a single git repository with origin/master
 
     Merge origin/master into local master branch.
-    If another branch is active, we will switch to master and back again
-    after the merge is done.
+    If another branch is active, master is fast-forwarded without
+    checking it out (see merge_repository).
+    git_repo_name might be a path or a Repo.
     """
+    state, error, __ret = merge_repository(git_repo_name, refresh)
+    return __ret
 
-    __ret = []
 
-    if git_repo_name:
-        os.chdir(git_repo_name)
+def switch_branch(branch, repo):
+    """ Checkout branch, raises GitCallError if this fails """
+    repo.git(['checkout', branch])
+    repo.invalidate()
 
-    branch = get_current_branch()
-    dir_name = os.getcwd()
 
-    __ret.append(("INFO", "Checking: {0}".format(dir_name)))
+def can_update_branch_ref(repo):
+    """
+    May a branch, that is not checked out here, be moved by its ref only?
 
-    # First check if there are any uncommitted changes.
-    # In this case skip merging!
-    if not branch_is_clean():
-        __ret.append(('INFO', 'Uncommitted changes, skipping...'))
-        return __ret
-    else:
-        pass
+    Not if there are other worktrees: the branch might be checked out
+    in one of them and the working tree there would not be updated.
+    """
+    try:
+        git_dir = repo.git_dir
+    except GitCallError:
+        return False
 
-    # We only merge into the local master branch
-    if branch != 'master':
-        __ret.append(('INFO', 'Checkout master'))
-        checkout_branch('master')
+    return not (os.path.isdir(os.path.join(git_dir, 'worktrees')) or
+                os.path.exists(os.path.join(git_dir, 'commondir')))
 
-    if need_pull_push(return__returncode=True) == 1:
-        __ret.append(("INFO", "Need merge! "))
-        __ret.append(("INFO", "Try to merge Branch: master in {0}".format(dir_name)))
-    else:
-        # Switch back to previous branch
-        if branch != 'master':
-            __ret.append(('INFO', 'Nothing to do in master... Switch back'))
-            checkout_branch(branch)
-        return __ret
 
+def fast_forward_branch_ref(repo, branch='master', upstream='origin/master'):
+    """
+    Fast-forward a branch, which is not checked out, to upstream
+
+    Only the ref is moved, the working tree is not touched at all.
+    Raises GitCallError if this is no fast-forward or if the branch
+    has been moved by somebody else in the meantime.
+    """
+    old = repo.rev_parse(branch)
+    new = repo.rev_parse(upstream)
+
+    if repo.git(['merge-base', old, new]).rstrip() != old:
+        raise GitCallError('{0} is not an ancestor of {1}'.format(branch, upstream))
+
+    # update-ref checks, that the branch still points to old
+    repo.git(['update-ref', '-m', 'nacl: fast-forward to ' + upstream,
+              'refs/heads/' + branch, new, old])
+    repo.invalidate()
+
+
+def merge_repository(git_repo_name=None, refresh=False):
+    """
+    Merge origin/master into the local master of a repository
+
+    This does the work of merge_git_repo, but does not print anything,
+    so it might be run for several repositories at once.
+    If another branch is active, master is fast-forwarded by moving its
+    ref, the working tree stays as it is. Only if this is not possible
+    (other worktrees) we switch to master and back again.
+    Returns the state (one of MERGE_STATES), the reason why it failed
+    (None if it did not) and a list of messages for the log decorator.
+    """
+
+    __ret = []
+    error = None
+
+    repo = as_repo(git_repo_name)
+    dir_name = repo.dir_name
+
+    __ret.append(("INFO", "Checking: {0}".format(dir_name)))
+
+    state = None
     try:
-        git(['fetch'])
-        __ret.append(("INFO", "Start merge..."))
-        git(['merge', '--ff-only', 'origin/master'])
-        __ret.append(('INFO', 'Merge complete!'))
-    except GitCallError as e:
-        __ret.append(('INFO', 'Merge failed: {0}'.format(e.message)))
+        branch = get_current_branch(repo)
 
-    # Switch back to prvevious branch
-    if branch != 'master':
-        __ret.append(('INFO', 'Switch back'))
-        checkout_branch(branch)
+        # First check if there are any uncommitted changes.
+        # In this case skip merging!
+        if not branch_is_clean(repo):
+            __ret.append(('INFO', 'Uncommitted changes, skipping...'))
+            return SKIPPED_DIRTY, error, __ret
 
-    return __ret
+        # We only merge into the local master branch
+        ref_only = branch != 'master' and can_update_branch_ref(repo)
+        switch = branch != 'master' and not ref_only
+        if switch:
+            __ret.append(('INFO', 'Checkout master'))
+            switch_branch('master', repo)
+
+        try:
+            pull_push = need_pull_push(return__returncode=True, repo=repo,
+                                       refresh=refresh)
+            if pull_push == 1:
+                __ret.append(("INFO", "Need merge! "))
+                __ret.append(("INFO", "Try to merge Branch: master in {0}".format(dir_name)))
+
+                # need_pull_push has already fetched origin
+                try:
+                    if ref_only:
+                        __ret.append(("INFO", "Fast-forward master without checkout..."))
+                        fast_forward_branch_ref(repo)
+                    else:
+                        __ret.append(("INFO", "Start merge..."))
+                        repo.git(['merge', '--ff-only', 'origin/master'])
+                    __ret.append(('INFO', 'Merge complete!'))
+                    state = MERGED
+                except GitCallError as e:
+                    error = 'Merge failed: {0}'.format(e.message)
+                    __ret.append(('INFO', error))
+                    state = FAILED
+            elif pull_push == 2:
+                __ret.append(('INFO', 'master is ahead of origin/master, nothing to merge'))
+                state = NEED_PUSH
+            elif pull_push == 3:
+                __ret.append(('WARNING', 'master and origin/master have diverged'))
+                state = DIVERGED
+            else:
+                state = UP_TO_DATE
+        finally:
+            # Switch back to previous branch
+            if switch:
+                if state in (UP_TO_DATE, NEED_PUSH, DIVERGED):
+                    __ret.append(('INFO', 'Nothing to do in master... Switch back'))
+                else:
+                    __ret.append(('INFO', 'Switch back'))
+                switch_branch(branch, repo)
+    except GitCallError as e:
+        error = 'git failed: {0}'.format(e.message)
+        __ret.append(('FAIL', error))
+        return FAILED, error, __ret
+
+    return state, error, __ret
 
 
 @log
-def remote_diff():
+def remote_diff(repo=None, refresh=False):
     """ Shows the diffs between the local and the origin/master"""
 
     __ret = []
 
-    if not branch_is_clean():
+    repo = as_repo(repo)
+
+    if not branch_is_clean(repo):
         __ret.append(('INFO', 'Uncommitted changes.'))
 
-    git(['fetch'])
-    output = git(['diff', 'master', 'origin/master'])
+    fetch_origin(repo, refresh)
 
-    if output:
-        __ret.append(('BOLD', output))
+    # The diff is streamed into a pager by the log decorator, we only
+    # wait for the first line to know if there is any diff at all
+    output = repo.git_lines(['diff', 'master', 'origin/master'])
+    try:
+        first_line = next(output)
+    except StopIteration:
+        first_line = None
+
+    if first_line:
+        __ret.append(('BOLD', chain([first_line], output)))
     else:
         __ret.append(('INFO', 'No diffs found'))
 
     return __ret
 
 
+def collect_remote_diff_stat(repo, refresh=False):
+    """
+    Fetch a repository and get the diff stat of master and origin/master
+
+    Returns the Repo, the stat ('' if there are no diffs) and an error
+    message, if git failed.
+    """
+    repo = as_repo(repo)
+    try:
+        fetch_origin(repo, refresh)
+        stat = repo.git(['diff', '--stat', 'master', 'origin/master'])
+        return repo, stat.rstrip(), None
+    except GitCallError as e:
+        return repo, None, e.message.strip().split('\n')[0]
+
+
 @log
-def checkout_branch(branch=None):
+def remote_diff_all(refresh=False, rescan=False, jobs=None):
+    """
+    Show the diffs between master and origin/master of all salt repos
+
+    All repositories are fetched by 'jobs' threads in parallel. For every
+    repository with diffs only a diff stat is shown. If we are running on
+    a terminal, the full diffs can be looked at one by one afterwards.
+    """
+
+    if jobs and not (check_string_to_int(jobs) and int(jobs) > 0):
+        return [('WARNING', 'Number of jobs must be a positive integer', 1)]
+
+    git_repo_list = get_all_possible_git_dirs(rescan)
+
+    if not git_repo_list:
+        return [('WARNING', 'No git repository provided!', 3)]
+
+    collect = partial(collect_remote_diff_stat, refresh=refresh)
+    jobs = min(int(jobs or default_jobs()), len(git_repo_list))
+
+    changed = []
+    unchanged = 0
+    for repo, stat, error in thread_map(collect, git_repo_list, jobs):
+        if error:
+            print(color('FAIL', '{0}: {1}'.format(repo.dir_name, error)))
+        elif stat:
+            changed.append(repo)
+            print(color('WARNING', '[{0}] {1}'.format(len(changed), repo.dir_name)))
+            print(stat + '\n')
+        else:
+            unchanged += 1
+
+    print(color('INFO', 'No diffs found in {0} of {1} repositories'.format(
+        unchanged, len(git_repo_list))))
+
+    if changed and sys.stdin.isatty() and sys.stdout.isatty():
+        show_remote_diffs(changed)
+
+
+def show_remote_diffs(repos):
+    """ Let the user pick repositories to show the full diff of """
+    question = 'Show full diff of repository [1-{0}], q to quit'.format(len(repos))
+
+    while True:
+        choice = input_wrapper(question, 'q')
+        if choice == 'q':
+            return
+        if check_string_to_int(choice) and 1 <= int(choice) <= len(repos):
+            repo = repos[int(choice) - 1]
+            print(color('WARNING', repo.dir_name))
+            page(repo.git_lines(['diff', 'master', 'origin/master']))
+
+
+@log
+def checkout_branch(branch=None, repo=None):
     """ Checkout specified branch or master as default """
 
-    print_is_git_repo()
+    repo = as_repo(repo)
+
+    print_is_git_repo(repo)
 
     __ret = []
 
     if branch is None:
         try:
-            git(['checkout', 'master'])
-            __ret.append(('INFO', 'Branch: {0}'.format(get_current_branch())))
+            repo.git(['checkout', 'master'])
+            repo.invalidate()
+            __ret.append(('INFO', 'Branch: {0}'.format(get_current_branch(repo))))
         except GitCallError as exc:
             __ret.append(('FAIL', 'Unable to checkout Master Branch : {1}'.format(branch, exc)))
-    elif branch == get_current_branch():
-        __ret.append(('INFO', 'Already in {0}'.format(get_current_branch())))
+    elif branch == get_current_branch(repo):
+        __ret.append(('INFO', 'Already in {0}'.format(get_current_branch(repo))))
     else:
         try:
-            git(['checkout', branch])
-            __ret.append(('INFO', 'Switch to branch: {0}'.format(get_current_branch())))
+            repo.git(['checkout', branch])
+            repo.invalidate()
+            __ret.append(('INFO', 'Switch to branch: {0}'.format(get_current_branch(repo))))
         except GitCallError as exc:
             __ret.append(('FAIL', 'Unable to checkout {0} : {1}'.format(branch, exc)))
 
     return __ret
 
 
-def is_git_repo(dir_name=None):
-    """ Return whether it is a git repo or not """
-    if dir_name:
-        os.chdir(dir_name)
+def is_git_directory(path):
+    """ Does path look like a .git directory (like git itself checks it)? """
+    return os.path.isfile(os.path.join(path, 'HEAD')) and \
+        os.path.isdir(os.path.join(path, 'objects')) and \
+        os.path.isdir(os.path.join(path, 'refs'))
 
-    try:
-        git(['status', '-s'])
-        return True
-    except GitCallError:
+
+def find_git_dir(path):
+    """
+    Look for the .git directory of a working tree at or above path
+
+    Returns the .git directory or False if there is none, None if only
+    git itself can tell (.git files of worktrees and submodules, GIT_DIR
+    is set).
+    """
+    if 'GIT_DIR' in os.environ:
+        return None
+
+    if not os.path.isdir(path):
         return False
 
+    while True:
+        dot_git = os.path.join(path, '.git')
+        if os.path.isdir(dot_git):
+            if is_git_directory(dot_git):
+                return dot_git
+        elif os.path.isfile(dot_git):
+            return None
+
+        parent = os.path.dirname(path)
+        if parent == path:
+            return False
+        path = parent
+
+
+def is_git_repo(dir_name=None):
+    """
+    Return whether it is a git repo or not
+
+    Mostly this is answered by looking at the filesystem, git is only
+    asked if that is not enough. The answer is kept for the lifetime of
+    the process.
+    """
+    repo = as_repo(dir_name)
+    path = os.path.realpath(repo.dir_name)
+
+    if path not in _git_repo_cache:
+        git_dir = find_git_dir(path)
+        if git_dir is None:
+            try:
+                repo.git(['rev-parse', '--git-dir'])
+                is_repo = True
+            except GitCallError:
+                is_repo = False
+        else:
+            is_repo = bool(git_dir)
+        _git_repo_cache[path] = is_repo
+
+    return _git_repo_cache[path]
+
 
 @log
-def print_is_git_repo():
+def print_is_git_repo(repo=None):
     """ Print and exit if is no repository """
-    if not is_git_repo():
+    if not is_git_repo(repo):
         return [('WARNING', 'No git repository found!', 1)]
 
 
-def get_all_branches():
+def get_all_branches(repo=None):
     """ Return a list with all branches """
-    return git(['for-each-ref',
-                '--format="%(refname:short)"',
-                'refs/heads/']).replace('"', '').split()
+    return as_repo(repo).branches()
 
 
-def branch_exist(branch=None):
+def branch_exist(branch=None, repo=None):
     """ Check whether a branch already exists """
-    exiting_branches = get_all_branches()
+    exiting_branches = get_all_branches(repo)
     for existing_branch in exiting_branches:
         if existing_branch == branch:
             return True
@@ -267,31 +769,39 @@ def remote_prune():
     return __ret
 
 
-def get_local_url_list():
-    """ Get a list off all local repositories remote url's """
+def get_local_url_dict(rescan=False):
+    """
+    Return {path: origin url} of all local repositories
 
-    url_list = []
-    for repo in get_dir_list_from_filesystem():
-        os.chdir(repo[:-4])
-        url_list.append(git(['config', '--get', 'remote.origin.url']).rstrip())
+    The urls are read from the config files of the repositories, git is
+    only called for those that can't be read that way.
+    """
+    return dict((path, Repo(path).origin_url)
+                for path in get_all_possible_git_dirs(rescan))
 
-    return url_list
+
+def get_local_url_list(rescan=False):
+    """ Get a list off all local repositories remote url's """
+    url_dict = get_local_url_dict(rescan)
+    return [url_dict[path] for path in sorted(url_dict)]
 
 
-def compare_remote():
+def compare_remote(rescan=False):
     """
     Try to find differences between local and remote repositories
 
     Compare the existence of remote and local git repositories and show
     missing local repositories.
     """
-    local_repo_urls = get_local_url_list()
+    # ssh and http urls of the same repository have to match
+    local_repo_urls = set(nacl.gitapi.normalize_git_url(url)
+                          for url in get_local_url_list(rescan) if url)
     remote_url_dict = nacl.gitapi.get_remote_url_dict()
 
     print(color("FAIL", "WARNING: This list might be inaccurate!\n It will list remote git repositories, that are not in one of our salt environments!\n That might be ok!\n"))
 
     for url, desc in remote_url_dict.iteritems():
-        if url not in local_repo_urls:
+        if nacl.gitapi.normalize_git_url(url) not in local_repo_urls:
                 url = color("GREEN", url)
                 desc = color("WARNING", desc)
                 print("%-59s" % (url))
@@ -341,21 +851,13 @@ def git(args, env={}):
     proxy setting.
     """
 
-    user_config = get_users_nacl_conf()
+    git_env = get_git_env()
 
-    # We have to merge the os.environment and env, because we need HOME!
-    env = merge_two_dicts(env, os.environ)
+    # The prebuilt environment is shared, never change it in place
+    if env:
+        git_env = merge_two_dicts(dict(git_env), env)
 
-    # Any Proxy?
-    try:
-        proxy = user_config['proxy']
-    except KeyError:
-        proxy = False
-
-    if proxy:
-        env = merge_two_dicts(env, {'https_proxy': user_config['proxy']})
-
-    p = Popen(['git'] + args, stdout=PIPE, stderr=PIPE, env=env)
+    p = Popen(['git'] + args, stdout=PIPE, stderr=PIPE, env=git_env)
     output, err = p.communicate()
     rc = p.wait()
 
@@ -372,25 +874,62 @@ def git(args, env={}):
     return output.decode("utf-8")
 
 
-def branch_is_clean():
+def git_lines(args, env={}):
+    """
+    Streaming variant of git()
+
+    Yields the output line by line as soon as git writes it, so even
+    huge outputs (diffs) are never held in memory as a whole.
+    Like git(), it raises GitCallError if git fails, but only after all
+    lines have been consumed. If the caller stops early, git is killed.
+    """
+
+    git_env = get_git_env()
+
+    if env:
+        git_env = merge_two_dicts(dict(git_env), env)
+
+    # stderr goes to a file: a full stderr pipe would block git
+    # while we are waiting for stdout
+    with tempfile.TemporaryFile() as err_file:
+        p = Popen(['git'] + args, stdout=PIPE, stderr=err_file, env=git_env)
+        try:
+            for line in iter(p.stdout.readline, b''):
+                yield line.decode("utf-8")
+            rc = p.wait()
+        finally:
+            if p.poll() is None:
+                p.kill()
+                p.wait()
+            p.stdout.close()
+
+        err_file.seek(0)
+        err = err_file.read()
+
+    if err and rc != 0:
+        raise GitCallError(err)
+
+
+def branch_is_clean(repo=None):
     """ Check whether a branch is clean """
-    uncommited = git(['diff', '--name-only', 'HEAD'])
+    uncommited = as_repo(repo).git(['diff', '--name-only', 'HEAD'])
     if not uncommited:
         return True
 
     return False
 
 
-def get_last_commit_sha():
+def get_last_commit_sha(repo=None):
     """ Return the current commit SHA"""
-    return git(['rev-parse', 'HEAD'])
+    return as_repo(repo).head_sha
 
 
-def is_commit_on_remote(sha=None, branch='master'):
+def is_commit_on_remote(sha=None, branch='master', repo=None):
     """ Check if sha is already in the remote branch"""
     if sha:
         try:
-            remote_sha = git(['merge-base', sha.rstrip(), 'origin/' + branch])
+            remote_sha = as_repo(repo).git(
+                ['merge-base', sha.rstrip(), 'origin/' + branch])
             return bool(sha.rstrip() == remote_sha.rstrip())
         except:
             return False
@@ -398,16 +937,66 @@ def is_commit_on_remote(sha=None, branch='master'):
         raise ValueError("sha must be provided")
 
 
+def get_fetch_ttl():
+    """
+    Seconds a fetch is considered to be fresh
+
+    Can be set with 'fetch_ttl' in the ~/.nacl, defaults to a minute.
+    """
+    try:
+        return int(get_users_nacl_conf()['fetch_ttl'])
+    except (KeyError, TypeError, ValueError):
+        return 60
+
+
+def fetch_is_fresh(repo=None, ttl=None):
+    """
+    Check whether the remotes of a repo have been fetched within ttl seconds
+
+    Every fetch (no matter if done by us or the user) writes FETCH_HEAD,
+    so its mtime tells us when the last fetch happened.
+    """
+    try:
+        fetched = os.path.getmtime(
+            os.path.join(as_repo(repo).git_dir, 'FETCH_HEAD'))
+    except (OSError, GitCallError):
+        return False
+
+    if ttl is None:
+        ttl = get_fetch_ttl()
+
+    return 0 <= time.time() - fetched < ttl
+
+
+def fetch_origin(repo=None, refresh=False):
+    """
+    Update the remote refs of a repository, unless they are fresh enough
+
+    With refresh set, we fetch in any case.
+    Returns whether a fetch was done.
+    """
+    repo = as_repo(repo)
+    if not refresh and fetch_is_fresh(repo):
+        return False
+
+    repo.git(['remote', 'update'])
+    return True
+
+
 def need_pull_push(return__returncode=False,
                    local_branch='master',
-                   remote_branch='master'):
+                   remote_branch='master',
+                   repo=None,
+                   refresh=False):
     """ Check whether we need to push or pull """
 
-    git(['remote', 'update'])
+    repo = as_repo(repo)
+
+    fetch_origin(repo, refresh)
 
-    local = git(['rev-parse', local_branch])
-    remote = git(['rev-parse', 'origin/' + remote_branch])
-    base = git(['merge-base', local_branch, 'origin/' + remote_branch])
+    local = repo.rev_parse(local_branch)
+    remote = repo.rev_parse('origin/' + remote_branch)
+    base = repo.git(['merge-base', local_branch, 'origin/' + remote_branch]).rstrip()
 
     if local == remote:
         answer = "Up-to-date"
@@ -428,49 +1017,224 @@ def need_pull_push(return__returncode=False,
     return answer
 
 
-def get_current_branch():
+def get_current_branch(repo=None):
     """ Returns the current active branch """
 
-    return git(['rev-parse', '--abbrev-ref', 'HEAD']).rstrip()
+    return as_repo(repo).branch
 
 
-def is_merged(branch):
+def is_merged(branch, repo=None, refresh=False):
     """ Check whether a local branch is already merged into origin/master """
 
-    git(['remote', 'update'])
-    local = git(['rev-parse', '@']).rstrip()
-    remote = git(['merge-base', local, 'origin/master']).rstrip()
+    repo = as_repo(repo)
+    fetch_origin(repo, refresh)
+    local = repo.rev_parse('@')
+    remote = repo.git(['merge-base', local, 'origin/master']).rstrip()
 
     if local == remote:
         return True
     return False
 
 
-def print_merge_status(branch):
-    """ Print out the merge status of branch """
-    if is_merged(branch):
-        return "(merged)"
-    return "(unmerged)"
+def ahead_behind_to_answer(ahead, behind):
+    """ Translate ahead/behind counters into the answers of need_pull_push """
+    if not ahead and not behind:
+        return "Up-to-date"
+    elif not ahead:
+        return "Need to pull"
+    elif not behind:
+        return "Need to push"
+    return "Diverged"
+
+
+def parse_status_porcelain(output):
+    """
+    Parse the output of 'git status --porcelain=v2 --branch'
+
+    Returns a dict with the branch, HEAD sha (None on an unborn branch),
+    upstream, ahead/behind counters and the changed entries rendered like
+    'git status -s' does.
+    'dirty' only covers tracked files, untracked ones do not count
+    (same as branch_is_clean()).
+    """
+    status = {'branch': None,
+              'head': None,
+              'upstream': None,
+              'ahead': None,
+              'behind': None,
+              'dirty': False,
+              'changes': []}
+
+    for line in (output or '').splitlines():
+        if line.startswith('# branch.oid '):
+            # An unborn branch has no commit yet
+            if line[13:] != '(initial)':
+                status['head'] = line[13:]
+        elif line.startswith('# branch.head '):
+            status['branch'] = line[14:]
+            if status['branch'] == '(detached)':
+                # That's what 'git rev-parse --abbrev-ref HEAD' says
+                status['branch'] = 'HEAD'
+        elif line.startswith('# branch.upstream '):
+            status['upstream'] = line[18:]
+        elif line.startswith('# branch.ab '):
+            ahead, behind = line[12:].split()
+            status['ahead'] = int(ahead)
+            status['behind'] = abs(int(behind))
+        elif line[:2] in ('1 ', '2 ', 'u '):
+            fields = line.split(' ')
+            xy = fields[1].replace('.', ' ')
+            if line[0] == '1':
+                path = ' '.join(fields[8:])
+            elif line[0] == '2':
+                path, orig_path = ' '.join(fields[9:]).split('\t', 1)
+                path = '{0} -> {1}'.format(orig_path, path)
+            else:
+                path = ' '.join(fields[10:])
+            status['dirty'] = True
+            status['changes'].append('{0} {1}'.format(xy, path))
+        elif line.startswith('? '):
+            status['changes'].append('?? {0}'.format(line[2:]))
+
+    return status
+
+
+# refname, upstream and the tracking state, seperated by tabs
+BRANCH_REF_FORMAT = '%(refname:short)%09%(upstream:short)%09%(upstream:track,nobracket)'
+
+
+def parse_branch_refs(output):
+    """
+    Parse the output of for-each-ref with the BRANCH_REF_FORMAT
+
+    Returns a list of (branch, upstream, ahead, behind) tuples.
+    ahead and behind are None if there is no upstream or it is gone.
+    """
+    branches = []
+    for line in (output or '').splitlines():
+        if not line:
+            continue
+        name, upstream, track = (line.split('\t') + ['', ''])[:3]
+        ahead = behind = None
+        if upstream and track != 'gone':
+            ahead = behind = 0
+            for part in track.split(','):
+                part = part.split()
+                if len(part) == 2 and part[0] == 'ahead':
+                    ahead = int(part[1])
+                elif len(part) == 2 and part[0] == 'behind':
+                    behind = int(part[1])
+        branches.append((name, upstream or None, ahead, behind))
+    return branches
+
+
+def count_ahead_behind(local, remote, repo=None):
+    """ Return how many commits local is ahead and behind of remote """
+    output = as_repo(repo).git(['rev-list', '--left-right', '--count',
+                                '{0}...{1}'.format(local, remote)])
+    ahead, behind = output.split()
+    return int(ahead), int(behind)
+
+
+def get_repo_status(repo=None, refresh=False):
+    """
+    Collect everything pretty_status needs with as few git calls as possible
+
+    Instead of asking git for every single fact we rely on:
+      * 'git remote update' to know about the remote (skipped if the
+        last fetch is fresh enough and refresh is not set),
+      * one 'git status --porcelain=v2 --branch' for branch, dirty state,
+        upstream and ahead/behind and
+      * one 'git for-each-ref' for all branches and the tracking state
+        of master.
+    Only if master (or the active branch) does not track origin/master,
+    we have to ask 'git rev-list' once more.
+    The branch and HEAD sha we get for free are handed over to the
+    cached facts of the Repo.
+    """
+    repo = as_repo(repo)
+    fetch_origin(repo, refresh)
+    status = parse_status_porcelain(
+        repo.git(['status', '--porcelain=v2', '--branch']))
+    branches = parse_branch_refs(
+        repo.git(['for-each-ref', '--format=' + BRANCH_REF_FORMAT,
+                  'refs/heads/']))
+
+    repo.remember('branch', status['branch'])
+    if status['head'] or status['branch']:
+        repo.remember('head_sha', status['head'])
+
+    status['all_branches'] = [b[0] for b in branches]
+
+    # Local master compared to origin/master
+    if status['branch'] == 'master' and \
+       status['upstream'] == 'origin/master' and \
+       status['ahead'] is not None:
+        ahead, behind = status['ahead'], status['behind']
+    else:
+        ahead = behind = None
+        for name, upstream, b_ahead, b_behind in branches:
+            if name == 'master' and upstream == 'origin/master':
+                ahead, behind = b_ahead, b_behind
+        if ahead is None:
+            ahead, behind = count_ahead_behind('master', 'origin/master',
+                                               repo)
+    status['pull_push'] = ahead_behind_to_answer(ahead, behind)
+
+    # Is the active branch already in origin/master?
+    status['merged'] = None
+    if status['branch'] != 'master':
+        if status['upstream'] == 'origin/master' and \
+           status['ahead'] is not None:
+            status['merged'] = status['ahead'] == 0
+        else:
+            status['merged'] = count_ahead_behind('HEAD', 'origin/master',
+                                                  repo)[0] == 0
+
+    return status
+
+
+def collect_pretty_status(repo, refresh=False):
+    """
+    Collect the pretty_status of repo without printing it
+
+    Used by the threads of list_salt_git_repositories. A failing
+    repository must not break the whole list.
+    """
+    try:
+        return pretty_status._fn(repo, refresh)
+    except GitCallError:
+        return {'dir_name': as_repo(repo).dir_name,
+                'branch': '',
+                'merge_status': '',
+                'status': 'Error',
+                'pull_push': 'git failed',
+                'all_branches': ''}
 
 
 @ListLine
-def pretty_status():
+def pretty_status(repo=None, refresh=False):
     """ Prints out some information about a repository """
+    repo = as_repo(repo)
+    status = get_repo_status(repo, refresh)
+
     __ret = {}
-    __ret['branch'] = get_current_branch()
-    __ret['status'] = git(['status', '-s']).rstrip()
-    __ret['pull_push'] = need_pull_push()
+    __ret['branch'] = status['branch']
+    __ret['pull_push'] = status['pull_push']
     __ret['merge_status'] = ''
-    __ret['all_branches'] = ', '.join(get_all_branches())
+    __ret['all_branches'] = ', '.join(status['all_branches'])
 
-    if branch_is_clean():
+    if not status['dirty']:
         __ret['status'] = 'Clean'
     else:
-        __ret['status'] = __ret['status'][0:10]
+        __ret['status'] = status['changes'][0][0:10]
 
     if __ret['branch'] != 'master':
-        __ret['merge_status'] = print_merge_status(__ret['branch'])
+        if status['merged']:
+            __ret['merge_status'] = "(merged)"
+        else:
+            __ret['merge_status'] = "(unmerged)"
 
-    __ret['dir_name'] = os.getcwd()
+    __ret['dir_name'] = repo.dir_name
 
     return __ret
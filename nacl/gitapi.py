@@ -12,15 +12,142 @@ switch between gitlab and github by using an config attribute.
 """
 
 from nacl.base import get_users_nacl_conf
+from nacl.base import get_http_session
+from nacl.base import get_http_pool_size
+from nacl.cache import load_cache
+from nacl.cache import save_cache
 from nacl.decorator import log
-from nacl.helper import clean_up_dict
+from nacl.helper import clean_up_dict, thread_map
+from vendor.gitlab.exceptions import HttpError
 import vendor.gitlab
 import pprint
+import re
+
+# The most items gitlab hands out per page
+PER_PAGE = 100
+
+# Name of the cache of project and group ids (see nacl.cache)
+ID_CACHE = 'gitlab_ids'
+
+# git@host:path, ssh://[user@]host[:port]/path, http(s)://[user@]host[:port]/path
+SCP_URL_RE = re.compile(r'^(?:[^@/]+@)?([^:/]+):(?!//)(.*)$')
+URL_RE = re.compile(r'^[a-z+]+://(?:[^@/]+@)?([^:/]+)(?::\d*)?/(.*)$')
 
 
 def get_gitgitlab_handle(host, my_token):
-    """ returns a gitlab api handle """
-    return vendor.gitlab.Gitlab(host, token=my_token)
+    """ returns a gitlab api handle, using the shared HTTP session """
+    session = get_http_session()
+    return vendor.gitlab.Gitlab(host, token=my_token,
+                                verify_ssl=session.verify, session=session)
+
+
+def get_page(git, url, params, page):
+    """ Return a page of a gitlab API collection and the response headers """
+    params = dict(params, page=page, per_page=PER_PAGE)
+    request = git.session.get(url, params=params, headers=git.headers,
+                              verify=git.verify_ssl)
+    if request.status_code != 200:
+        raise HttpError('GET {0} failed: {1}'.format(url, request.status_code))
+    return request.json(), request.headers
+
+
+def get_all_pages(git, url, params={}):
+    """
+    Return all items of a paginated gitlab API collection
+
+    The first page tells us how many pages there are (X-Total-Pages),
+    the others are fetched in parallel (not more at once than the HTTP
+    session has connections). Without this header (gitlab
+    omits it for huge collections) we go on page by page until a page
+    is not full anymore.
+    """
+    items, headers = get_page(git, url, params, 1)
+
+    try:
+        total_pages = int(headers['X-Total-Pages'])
+    except (KeyError, TypeError, ValueError):
+        total_pages = None
+
+    if total_pages:
+        get = lambda page: get_page(git, url, params, page)[0]
+        jobs = max(min(total_pages - 1, get_http_pool_size()), 1)
+        for page_items in thread_map(get, range(2, total_pages + 1), jobs):
+            items.extend(page_items)
+        return items
+
+    page = 1
+    page_items = items
+    while len(page_items) == PER_PAGE:
+        page += 1
+        page_items = get_page(git, url, params, page)[0]
+        items.extend(page_items)
+    return items
+
+
+def get_cached_id(server, kind, name):
+    """
+    Return a remembered id or None
+
+    kind is 'projects' (by remote url) or 'groups' (by name). Ids are
+    kept per gitlab server, they never change on it.
+    """
+    ids = load_cache(ID_CACHE) or {}
+    return ids.get(server, {}).get(kind, {}).get(name)
+
+
+def remember_id(server, kind, name, value):
+    """ Store an id for get_cached_id() """
+    ids = load_cache(ID_CACHE) or {}
+    ids.setdefault(server, {}).setdefault(kind, {})[name] = value
+    save_cache(ID_CACHE, ids)
+
+
+def forget_ids(server=None):
+    """ Forget the remembered ids of server or of all servers """
+    ids = load_cache(ID_CACHE) or {}
+    if server:
+        ids.pop(server, None)
+    else:
+        ids = {}
+    save_cache(ID_CACHE, ids)
+
+
+def get_group_id(git, group_name):
+    """ Return the id of a group or None """
+    group_id = get_cached_id(git.host, 'groups', group_name)
+    if group_id is not None:
+        return group_id
+
+    for group in get_all_pages(git, git.groups_url, {'search': group_name}):
+        if group['name'] == group_name:
+            remember_id(git.host, 'groups', group_name, group['id'])
+            return group['id']
+    return None
+
+
+def get_group_projects(git, group_id):
+    """ Return all projects of a group, without the details we don't need """
+    return get_all_pages(git, '{0}/{1}/projects'.format(git.groups_url, group_id),
+                         {'simple': 'true'})
+
+
+def normalize_git_url(url):
+    """
+    Return a comparable form of a git remote url
+
+    git@host:group/repo.git, ssh://git@host:22/group/repo and
+    https://host/group/repo.git all end up as host/group/repo.
+    """
+    url = url.strip()
+    match = URL_RE.match(url) or SCP_URL_RE.match(url)
+    if not match:
+        return url
+
+    host, path = match.groups()
+    path = path.strip('/')
+    if path.endswith('.git'):
+        path = path[:-4]
+    return '{0}/{1}'.format(host.lower(), path)
 
 
 @log
@@ -43,12 +170,9 @@ def get_remote_url_dict():
 
     git = get_gitgitlab_handle(config['gitapiserver'], config['gitapitoken'])
 
-    group_id = None
-
     try:
-        for group in git.getgroups():
-            if group['name'] == config['gitgroup']:
-                group_id = group['id']
+        group_id = get_group_id(git, config['gitgroup'])
+        projects = get_group_projects(git, group_id) if group_id else []
     except:
         # Fix this: be more precise about what
         # fails.
@@ -57,9 +181,8 @@ def get_remote_url_dict():
 
     if group_id:
         ssh_url_dict = {}
-        group = git.getgroups(group_id)
 
-        for project in group['projects']:
+        for project in projects:
             ssh_url_dict[project['ssh_url_to_repo']] = project['description']
 
         return {'payload': clean_up_dict(ssh_url_dict, ignore_repositories)}
@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Read the config of git repositories without calling git
+
+The config of a repository is a small ini-like file below .git, so
+values like the url of origin are read right here instead of spawning
+'git config' for every single repository.
+Includes (include.path) and the config of worktrees are followed.
+Conditional includes (includeIf) can only be evaluated by git itself,
+they raise a ConfigReadError like everything else that can't be read.
+
+Only the config of the repository is read, the global and the system
+config (~/.gitconfig, /etc/gitconfig) are not.
+"""
+import os
+import re
+from nacl.exceptions import ConfigReadError
+
+# [section], [section "subsection"] or the deprecated [section.subsection]
+SECTION_RE = re.compile(r'^\[\s*([A-Za-z0-9.-]+)\s*("(?:[^"\\]|\\.)*")?\s*\]')
+
+# name of a variable, followed by '=', a comment or nothing
+NAME_RE = re.compile(r'^([A-Za-z][A-Za-z0-9-]*)\s*(=|[#;]|$)')
+
+ESCAPES = {'n': '\n', 't': '\t', 'b': '\b', '\\': '\\', '"': '"'}
+
+# How deep includes are followed (like git does it)
+MAX_INCLUDE_DEPTH = 10
+
+
+def parse_value(line, lines, pos):
+    """
+    Parse the value that starts with line
+
+    lines[pos] is the line after it. Returns the value and the position
+    of the line after the value. Quotes are removed, escapes are resolved
+    and a backslash at the end of a line continues the value on the next
+    line.
+    """
+    value = []
+    # whitespace is only kept inside of quotes and between words
+    pending_space = ''
+    quoted = False
+
+    i = 0
+    while True:
+        if i >= len(line):
+            if quoted:
+                raise ConfigReadError('unterminated quote in config')
+            return ''.join(value), pos
+
+        char = line[i]
+        i += 1
+        if char == '\\':
+            if i >= len(line):
+                # continued on the next line
+                if pos >= len(lines):
+                    raise ConfigReadError('config ends with a backslash')
+                line = lines[pos]
+                pos += 1
+                i = 0
+                continue
+            escaped = line[i]
+            i += 1
+            if escaped not in ESCAPES:
+                raise ConfigReadError('bad escape in config: \\' + escaped)
+            value.append(pending_space + ESCAPES[escaped])
+            pending_space = ''
+        elif char == '"':
+            quoted = not quoted
+            value.append(pending_space)
+            pending_space = ''
+        elif quoted:
+            value.append(char)
+        elif char in '#;':
+            return ''.join(value), pos
+        elif char.isspace():
+            if value:
+                pending_space += char
+        else:
+            value.append(pending_space + char)
+            pending_space = ''
+
+
+def parse_section(match):
+    """ Return the section prefix (e.g. 'remote.origin') of a header """
+    section, subsection = match.group(1), match.group(2)
+    if subsection is None:
+        # [Section.Sub] is the same as [section "sub"]
+        name, _, sub = section.partition('.')
+        if sub:
+            return name.lower() + '.' + sub.lower()
+        return section.lower()
+    subsection = re.sub(r'\\(.)', r'\1', subsection[1:-1])
+    return section.lower() + '.' + subsection
+
+
+def parse_config(content):
+    """
+    Return a list of (key, value) of the content of a config file
+
+    Keys are like 'git config' prints them: 'remote.origin.url' (section
+    and name in lower case, the subsection as it is). Variables without
+    a value (booleans) get True.
+    """
+    lines = content.splitlines()
+    config = []
+    section = None
+    pos = 0
+    while pos < len(lines):
+        line = lines[pos].strip()
+        pos += 1
+
+        match = SECTION_RE.match(line)
+        if match:
+            section = parse_section(match)
+            # there might be a variable behind the header
+            line = line[match.end():].strip()
+
+        if not line or line[0] in '#;':
+            continue
+
+        match = NAME_RE.match(line)
+        if not match or section is None:
+            raise ConfigReadError('unable to parse config line: ' + line)
+
+        key = section + '.' + match.group(1).lower()
+        if match.group(2) != '=':
+            config.append((key, True))
+            continue
+
+        value, pos = parse_value(line[match.end():], lines, pos)
+        config.append((key, value))
+
+    return config
+
+
+def read_config(path, depth=0):
+    """
+    Return a list of (key, value) of the config file path
+
+    Included files are read in place of their include.path, like git
+    does it. Missing includes are ignored, a missing path is not.
+    """
+    if depth > MAX_INCLUDE_DEPTH:
+        raise ConfigReadError('includes nested too deep: ' + path)
+
+    try:
+        with open(path) as config_file:
+            content = config_file.read()
+    except IOError as exc:
+        raise ConfigReadError('cannot read {0}: {1}'.format(path, exc))
+
+    config = []
+    for key, value in parse_config(content):
+        if key.startswith('includeif.'):
+            raise ConfigReadError('conditional include in ' + path)
+        if key != 'include.path':
+            config.append((key, value))
+            continue
+
+        if value is True:
+            raise ConfigReadError('include.path without a value in ' + path)
+        include = os.path.join(os.path.dirname(path),
+                               os.path.expanduser(value))
+        if os.path.exists(include):
+            config.extend(read_config(include, depth + 1))
+
+    return config
+
+
+def get_common_dir(git_dir):
+    """ Return the directory that is shared by all worktrees of git_dir """
+    try:
+        with open(os.path.join(git_dir, 'commondir')) as commondir:
+            return os.path.join(git_dir, commondir.read().strip())
+    except IOError:
+        return git_dir
+
+
+def is_true(value):
+    """ Is value a config boolean that is true? """
+    return value is True or \
+        str(value).strip().lower() in ['true', 'yes', 'on', '1']
+
+
+def read_repository_config(git_dir):
+    """
+    Return a list of (key, value) of the config of a repository
+
+    The config of a worktree is shared with the main repository. With
+    extensions.worktreeConfig, config.worktree adds to it.
+    """
+    common_dir = get_common_dir(git_dir)
+    config = read_config(os.path.join(common_dir, 'config'))
+
+    if is_true(get_value(config, 'extensions.worktreeConfig', False)):
+        path = os.path.join(git_dir, 'config.worktree')
+        if os.path.exists(path):
+            config.extend(read_config(path))
+
+    return config
+
+
+def normalize_key(key):
+    """ Lower section and name of a key, the subsection is kept """
+    section, _, name = key.rpartition('.')
+    section, dot, subsection = section.partition('.')
+    return section.lower() + dot + subsection + '.' + name.lower()
+
+
+def get_value(config, key, default=''):
+    """
+    Return the value of key in config (a list of (key, value))
+
+    Like 'git config --get', the last one wins.
+    """
+    key = normalize_key(key)
+    value = default
+    for config_key, config_value in config:
+        if config_key == key:
+            value = config_value
+    return value
+
+
+def get_origin_url(git_dir):
+    """
+    Return the url of origin of the repository with the .git dir git_dir
+
+    It is '' if there is no origin, like 'git config --get' prints it.
+    Finding git_dir is up to the caller (see nacl.git.Repo.git_dir).
+    """
+    config = read_repository_config(git_dir)
+    url = get_value(config, 'remote.origin.url')
+    if url is True:
+        raise ConfigReadError('remote.origin.url has no value')
+    return url
@@ -2,27 +2,119 @@
 # -*- coding: utf-8 -*-
 
 from nacl.base import get_users_nacl_conf
+from nacl.base import get_http_session
+from nacl.base import get_http_pool_size
+from nacl.cache import load_cache
+from nacl.cache import save_cache
 import nacl.git as git
+import nacl.gitapi
 from nacl.helper import color
+from nacl.helper import run_parallel
+from nacl.helper import thread_map
 import sys
+import time
 import pprint
 from vendor.gitlab import Gitlab
 
+# Name of the cache of iid -> id per project (see nacl.cache)
+IID_CACHE = 'iids'
+
+# Name of the cache of project details (see GitLapApiCall.get_projects())
+PROJECT_CACHE = 'projects'
+
+# How long cached project details are used (seconds)
+PROJECT_CACHE_TTL = 24 * 60 * 60
+
+# What we keep of a project
+PROJECT_FIELDS = ['web_url', 'description']
+
+
+class MergeRequest(object):
+    """
+    A mergerequest of the project, loaded in tiers
+
+    The plain data (state, branches, title, ...) comes from the single
+    mergerequest call. The changes (all the diffs!) and the comments are
+    only fetched if they are used. Every tier is fetched only once, a
+    tier that is not found is asked for again.
+    """
+
+    def __init__(self, api, mergerequest_id):
+        self.api = api
+        self.id = mergerequest_id
+        self._tiers = {}
+
+    def _tier(self, name, fetch):
+        """ Return a tier, fetch(project_id, mergerequest_id) it if needed """
+        if name not in self._tiers:
+            value = fetch(self.api.p_id, self.id)
+            if not value:
+                return value
+            self._tiers[name] = value
+        return self._tiers[name]
+
+    @property
+    def data(self):
+        """ The mergerequest without changes and comments or False """
+        # The changes contain the data as well
+        if 'changes' in self._tiers:
+            return self._tiers['changes']
+        return self._tier('data', self.api.getmergerequest)
+
+    @property
+    def changes(self):
+        """ The mergerequest including all changes or False """
+        return self._tier('changes', self.api.getmergerequestchanges)
+
+    @property
+    def comments(self):
+        """ The comments of the mergerequest """
+        return self._tier('comments', self.api.getmergerequestcomments)
+
+    @property
+    def state(self):
+        """ opened, closed, merged (or None if there is no such mergerequest) """
+        return (self.data or {}).get('state')
+
 
 class GitLapApiCall(Gitlab):
     """
     Api Calls, we are doing based on Gitlab Class
 
     It extends Gitlab with some helper functions we need mainly in nacl.flow.
+    All calls go through the shared HTTP session (see
+    nacl.base.get_http_session()), so connections to the gitlab server
+    are reused.
+    The project of the current git repository is only looked up when
+    p_id is used the first time, so calls that are not about a project
+    (e.g. the issues of the user) work outside of a repository.
+    A mergerequest is fetched only once per object (see MergeRequest),
+    until it is changed through it (accepted, commented).
     """
 
     def __init__(self):
         self.config = get_users_nacl_conf()
+        session = get_http_session()
         super(GitLapApiCall, self).__init__(
             self.config['gitapiserver'],
-            token=self.config['gitapitoken']
+            token=self.config['gitapitoken'],
+            verify_ssl=session.verify,
+            session=session
         )
-        self.p_id = self.get_project_id()
+        self._p_id = None
+        # mergerequest_id -> MergeRequest
+        self._mergerequests = {}
+
+    @property
+    def p_id(self):
+        """ The gitlab ID of the project of the current git repository """
+        if self._p_id is None:
+            self._p_id = self.get_project_id()
+        return self._p_id
+
+    @p_id.setter
+    def p_id(self, value):
+        self._p_id = value
 
     def _get_seperator(self):
         """ Get the seperator for splitting up the remote.origin.url """
@@ -41,7 +133,12 @@ class GitLapApiCall(Gitlab):
         return seperator
 
     def get_project_id(self):
-        """ Return a gitlab Project ID """
+        """
+        Return a gitlab Project ID
+
+        The ID of the remote origin url is remembered, so the API is asked
+        only once for it (see nacl.gitapi.get_cached_id()).
+        """
 
         if not git.is_git_repo():
             print(color('WARNING', 'Not a git repository'))
@@ -49,25 +146,71 @@ class GitLapApiCall(Gitlab):
 
         seperator = self._get_seperator()
 
-        remote = git.git(['config', '--get', 'remote.origin.url'])
-        remote = remote.rstrip().split(seperator)[1]
+        url = git.Repo().origin_url.rstrip()
+        project_id = nacl.gitapi.get_cached_id(self.host, 'projects', url)
+        if project_id is not None:
+            return project_id
 
         try:
-            return self.getproject(remote[1:-4])['id']
+            remote = url.split(seperator)[1]
+            project_id = self.getproject(remote[1:-4])['id']
         except:
             print(color('WARNING', 'API Call?'))
             return False
 
+        nacl.gitapi.remember_id(self.host, 'projects', url, project_id)
+        return project_id
+
+    def get_projects(self, project_ids):
+        """
+        Return {project_id: project} of project_ids
+
+        Every project is fetched only once, all of them in parallel.
+        Only the PROJECT_FIELDS of a project are returned. They are kept
+        for PROJECT_CACHE_TTL, so most of the time nothing is fetched.
+        Projects that can't be fetched are missing in the result.
+        """
+        now = time.time()
+        cache = load_cache(PROJECT_CACHE) or {}
+        known = cache.get(self.host, {})
+
+        projects = {}
+        missing = []
+        for project_id in set(project_ids):
+            entry = known.get(str(project_id))
+            if entry and 0 <= now - entry['time'] < PROJECT_CACHE_TTL:
+                projects[project_id] = entry['project']
+            else:
+                missing.append(project_id)
+
+        if not missing:
+            return projects
+
+        jobs = min(len(missing), get_http_pool_size(self.config))
+        for project_id, project in zip(missing,
+                                       thread_map(self.getproject, missing, jobs)):
+            if not project:
+                continue
+            project = dict((key, project.get(key)) for key in PROJECT_FIELDS)
+            projects[project_id] = project
+            known[str(project_id)] = {'time': now, 'project': project}
+
+        cache[self.host] = known
+        save_cache(PROJECT_CACHE, cache)
+        return projects
+
     def get_group_id(self):
         """ Get the ID of our saltstack gitlab group """
 
         try:
-            for group in self.getgroups():
-                if group['name'] == self.config['gitgroup']:
-                    return group['id']
+            group_id = nacl.gitapi.get_group_id(self, self.config['gitgroup'])
         except:
+            group_id = None
+
+        if group_id is None:
             print(color('WARNING', 'API Call?'))
             return False
+        return group_id
 
     def is_mergerequest_new(self, sourcebranch=None, targetbranch=None):
         """ Check whether a mergerqeust is new """
@@ -92,12 +235,7 @@ class GitLapApiCall(Gitlab):
         if not mergerequest_id:
             raise ValueError("mergerequest_id must be provided")
 
-        mr_details = self.get_mergerequest_details(mergerequest_id)
-
-        try:
-            return bool(mr_details['changes']['state'] == 'opened')
-        except (KeyError, TypeError):
-            return False
+        return self.get_mergerequest(mergerequest_id).state == 'opened'
 
     def get_all_issues(self):
         """ Get all issues of a project """
@@ -122,6 +260,36 @@ class GitLapApiCall(Gitlab):
 
         return self.editissue(self.p_id, issue_id, **kwargs)
 
+    def iid_to_id(self, kind, iid, lookup):
+        """
+        Return the id of the issue or mergerequest iid of our project
+
+        kind is 'issues' or 'merge_requests', lookup a function asking
+        the API for the items with an iid.
+        The id of an iid never changes, so once it is known it is kept
+        in a cache and the API is not asked again.
+        Returns False if there is no such iid.
+        """
+        try:
+            iid = int(iid)
+        except ValueError:
+            return False
+
+        project = '{0} {1}'.format(self.host, self.p_id)
+        ids = load_cache(IID_CACHE) or {}
+        known = ids.get(project, {}).get(kind, {})
+        if str(iid) in known:
+            return known[str(iid)]
+
+        for item in lookup(self.p_id, iid=iid) or []:
+            if int(item['iid']) == iid:
+                # Another command might have written the cache meanwhile
+                ids = load_cache(IID_CACHE) or {}
+                ids.setdefault(project, {}).setdefault(kind, {})[str(iid)] = item['id']
+                save_cache(IID_CACHE, ids)
+                return item['id']
+        return False
+
     def issue_iid_to_uid(self, iid=None):
         """
         Convert the iid to the well known uid
@@ -131,19 +299,12 @@ class GitLapApiCall(Gitlab):
         has its own id (iid).
         This is mainly a workaround for users when they are used to work
         with the iid (like shown on the website).
+        The issue is looked up by its iid, not searched in all issues.
         """
         if not iid:
             raise ValueError('iid mus be provided')
 
-        all_project_issues = self.get_all_issues()
-        if all_project_issues:
-            for issue in all_project_issues:
-                try:
-                    if int(issue['iid']) == int(iid):
-                        return issue['id']
-                except ValueError:
-                    return False
-        return False
+        return self.iid_to_id('issues', iid, self.getprojectissues)
 
     def mergerequest_iid_to_id(self, iid=None):
         """
@@ -157,25 +318,59 @@ class GitLapApiCall(Gitlab):
         if not iid:
             raise ValueError('iid mus be provided')
 
-        all_project_mergerequests = self.getmergerequests(self.p_id)
-        if all_project_mergerequests:
-            for mergerequest in all_project_mergerequests:
-                try:
-                    if int(mergerequest['iid']) == int(iid):
-                        return mergerequest['id']
-                except ValueError:
-                    return False
-        return False
+        return self.iid_to_id('merge_requests', iid, self.getmergerequests)
+
+    def get_mergerequest(self, mergerequest_id):
+        """
+        Return the MergeRequest of mergerequest_id
+
+        Nothing is fetched until its data is used.
+        """
+        if mergerequest_id not in self._mergerequests:
+            self._mergerequests[mergerequest_id] = \
+                MergeRequest(self, mergerequest_id)
+        return self._mergerequests[mergerequest_id]
 
     def get_mergerequest_details(self, mergerequest_id):
-        """ Get details of a mergerequest """
-        values = {}
+        """
+        Get details of a mergerequest: its changes and comments
 
-        values['changes'] = self.getmergerequestchanges(
-            self.p_id, mergerequest_id)
-        values['comments'] = self.getmergerequestcomments(
-            self.p_id, mergerequest_id)
-        return values
+        The result is shared by all callers and must not be changed.
+        """
+        # The project is looked up here, not in both threads
+        if not self.p_id:
+            return {'changes': False, 'comments': False}
+
+        mergerequest = self.get_mergerequest(mergerequest_id)
+        changes, comments = run_parallel(lambda: mergerequest.changes,
+                                         lambda: mergerequest.comments)
+        return {'changes': changes, 'comments': comments}
+
+    def forget_mergerequest(self, mergerequest_id=None):
+        """ Fetch a (or every) mergerequest again """
+        if mergerequest_id is None:
+            self._mergerequests.clear()
+        else:
+            self._mergerequests.pop(mergerequest_id, None)
+
+    def updatemergerequest(self, project_id, mergerequest_id, **kwargs):
+        """ See Gitlab.updatemergerequest(), the details are fetched again """
+        self.forget_mergerequest(mergerequest_id)
+        return super(GitLapApiCall, self).updatemergerequest(
+            project_id, mergerequest_id, **kwargs)
+
+    def acceptmergerequest(self, project_id, mergerequest_id,
+                           merge_commit_message=None):
+        """ See Gitlab.acceptmergerequest(), the details are fetched again """
+        self.forget_mergerequest(mergerequest_id)
+        return super(GitLapApiCall, self).acceptmergerequest(
+            project_id, mergerequest_id, merge_commit_message)
+
+    def addcommenttomergerequest(self, project_id, mergerequest_id, note):
+        """ See Gitlab.addcommenttomergerequest(), the details are fetched again """
+        self.forget_mergerequest(mergerequest_id)
+        return super(GitLapApiCall, self).addcommenttomergerequest(
+            project_id, mergerequest_id, note)
 
     def mr_is_mergeable(self, mergerequest_id=None):
         """
@@ -192,10 +387,10 @@ class GitLapApiCall(Gitlab):
         if not mergerequest_id:
             raise ValueError('mergerequest_id and/or branch must be provided')
 
-        mr_details = self.get_mergerequest_details(mergerequest_id)
+        mr_data = self.get_mergerequest(mergerequest_id).data
         current_branch = git.get_current_branch()
-        source_branch = mr_details['changes']['source_branch']
-        target_branch = mr_details['changes']['target_branch']
+        source_branch = mr_data['source_branch']
+        target_branch = mr_data['target_branch']
 
         # Checkout the branches
         reverse_stash = False
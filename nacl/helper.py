@@ -3,9 +3,16 @@
 """
 Helper functions that aren't fit anywhere else
 """
+from distutils import spawn
+from multiprocessing import cpu_count
+from subprocess import Popen, PIPE
+import Queue
+import errno
+import os
 import random
 import string
 import sys
+import threading
 
 
 def id_generator(size=6, chars=string.ascii_uppercase + string.digits):
@@ -114,3 +121,170 @@ def check_string_to_int(int_string):
         return int(int_string)
 
     return int_string.isdigit()
+
+
+def default_jobs():
+    """
+    Default number of parallel jobs
+
+    Most of our parallel work is waiting for git remotes or the gitlab
+    API, so we can afford more threads than there are CPUs.
+    """
+    try:
+        return cpu_count() * 2
+    except NotImplementedError:
+        return 4
+
+
+def thread_map(func, iterable, jobs=None, ordered=True):
+    """
+    Run func for every item of iterable in jobs threads
+
+    Results are yielded as soon as they are available. If ordered is set,
+    they are yielded in the order of iterable, so a result is only handed
+    out after everything before it is done. An exception of func is
+    raised here, in place of its result.
+    The threads take the items from iterable while they go, so a
+    generator may still be producing items while the first results are
+    handed out. If the caller stops early, no new items are started.
+    Plain threads are used instead of a ThreadPool: tearing a pool down
+    takes about 100ms, longer than most of the API calls we run here.
+    """
+    items = enumerate(iterable)
+    lock = threading.Lock()
+    done = Queue.Queue()
+    stop = threading.Event()
+
+    def work():
+        while not stop.is_set():
+            try:
+                with lock:
+                    index, item = next(items)
+            except StopIteration:
+                break
+            except Exception as exc:
+                # the iterable itself failed
+                done.put((None, False, exc))
+                break
+            try:
+                done.put((index, True, func(item)))
+            except Exception as exc:
+                done.put((index, False, exc))
+        done.put(None)
+
+    threads = [threading.Thread(target=work)
+               for _ in range(jobs or default_jobs())]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    pending = {}
+    next_index = 0
+    running = len(threads)
+    try:
+        while running:
+            try:
+                # Waiting with a timeout keeps us responsive to Ctrl-C.
+                # It is short, python 2 polls the queue less often the
+                # longer it waits.
+                result = done.get(True, 0.05)
+            except Queue.Empty:
+                continue
+
+            if result is None:
+                running -= 1
+                continue
+
+            index, success, value = result
+            if index is None or not ordered:
+                if not success:
+                    raise value
+                yield value
+                continue
+
+            pending[index] = (success, value)
+            while next_index in pending:
+                success, value = pending.pop(next_index)
+                next_index += 1
+                if not success:
+                    raise value
+                yield value
+    finally:
+        stop.set()
+
+
+def run_parallel(*calls):
+    """
+    Call all functions of calls at the same time, each in a thread
+
+    Returns their results in the order of calls. For independent calls
+    (e.g. to the gitlab API) this takes as long as the slowest call,
+    not as long as all of them. An exception of a call is raised here.
+    """
+    return list(thread_map(lambda call: call(), calls, len(calls) or 1))
+
+
+def split_lines(chunks):
+    """ Turn an iterable of text chunks into lines (with line endings) """
+    for chunk in chunks:
+        for line in chunk.splitlines(True):
+            yield line
+
+
+def get_pager():
+    """
+    Return the pager command or None if there is none
+
+    Like git, we use $PAGER and fall back to less.
+    """
+    pager = os.environ.get('PAGER')
+    if pager:
+        return pager
+    if spawn.find_executable('less'):
+        return 'less'
+    return None
+
+
+def page(lines):
+    """
+    Show lines in a pager
+
+    The lines are handed to the pager while they are produced, so it
+    shows the first screen while the rest is still on its way, and
+    nothing is ever collected in memory. Quitting the pager stops the
+    output. If stdout is no terminal (or there is no pager), the lines
+    are just written to stdout.
+    """
+    pager = get_pager() if sys.stdout.isatty() else None
+
+    if not pager:
+        for line in lines:
+            sys.stdout.write(encode(line))
+        sys.stdout.flush()
+        return
+
+    env = dict(os.environ)
+    # Quit if it fits on one screen, keep colors
+    env.setdefault('LESS', 'FRX')
+
+    p = Popen(pager, shell=True, stdin=PIPE, env=env)
+    try:
+        for line in lines:
+            p.stdin.write(encode(line))
+    except IOError as e:
+        # The user has quit the pager
+        if e.errno != errno.EPIPE:
+            raise
+    finally:
+        try:
+            p.stdin.close()
+        except IOError:
+            pass
+        p.wait()
+
+
+def encode(text):
+    """ unicode -> utf-8 encoded str, everything else stays as it is """
+    if isinstance(text, unicode):
+        return text.encode('utf-8')
+    return text
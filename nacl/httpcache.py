@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+A HTTP cache for the GET calls to the gitlab API
+
+Responses with an ETag or a Last-Modified header are stored below
+~/.cache/nacl/http. The next GET of the same url asks the server with
+If-None-Match/If-Modified-Since whether it has changed. If it has not,
+the server answers 304 without a body and the stored response is used.
+So the cache never hands out stale data, it only saves the download.
+
+The key of a response contains the (hashed) token, users never see
+responses of each other. The files are only readable by the user.
+If the cache grows above its size, the least recently used responses
+are removed.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import requests
+from requests.structures import CaseInsensitiveDict
+from nacl.cache import get_cache_dir
+from nacl.cache import remove_file
+
+# Maximum size of all cached responses in bytes
+HTTP_CACHE_SIZE = 50 * 1024 * 1024
+
+# Headers the token is sent in
+AUTH_HEADERS = ['PRIVATE-TOKEN', 'Authorization']
+
+
+def get_http_cache_dir():
+    """ Return the directory of the cached responses """
+    return os.path.join(get_cache_dir(), 'http')
+
+
+class CachingSession(requests.Session):
+    """
+    A requests.Session revalidating GET responses it has seen before
+
+    All other methods are sent as they are.
+    """
+
+    def __init__(self, cache_dir=None, max_size=HTTP_CACHE_SIZE):
+        super(CachingSession, self).__init__()
+        self.cache_dir = cache_dir or get_http_cache_dir()
+        self.max_size = max_size
+
+    def request(self, method, url, **kwargs):
+        """ Send a request, GET requests are answered from the cache if possible """
+        if method.upper() != 'GET':
+            return super(CachingSession, self).request(method, url, **kwargs)
+
+        headers = dict(kwargs.get('headers') or {})
+        key = self.get_key(url, kwargs.get('params'), headers)
+        entry = self.load(key)
+        if entry:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+            kwargs['headers'] = headers
+
+        response = super(CachingSession, self).request(method, url, **kwargs)
+
+        if response.status_code == 304 and entry:
+            return self.restore(response, entry, key)
+        if response.status_code == 200:
+            self.store(key, response)
+        return response
+
+    def get_key(self, url, params, headers):
+        """ Return the cache key of a GET request """
+        url = requests.Request('GET', url, params=params).prepare().url
+        auth = [headers.get(name, '') for name in AUTH_HEADERS]
+        return hashlib.sha256(json.dumps([url] + auth)).hexdigest()
+
+    def get_path(self, key):
+        """ Return the file of a cached response """
+        return os.path.join(self.cache_dir, key + '.json')
+
+    def load(self, key):
+        """ Return the cached response of key or None """
+        try:
+            with open(self.get_path(key)) as entry_file:
+                return json.load(entry_file)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def restore(self, response, entry, key):
+        """ Turn a 304 response into the cached response """
+        headers = CaseInsensitiveDict(entry['headers'])
+        # The server may have sent fresh validators
+        for name in ['ETag', 'Last-Modified']:
+            if name in response.headers:
+                headers[name] = response.headers[name]
+        response.headers = headers
+        response.status_code = 200
+        response._content = entry['content'].encode('utf-8')
+
+        # the mtime tells which responses were used least recently
+        try:
+            os.utime(self.get_path(key), None)
+        except OSError:
+            pass
+        return response
+
+    def store(self, key, response):
+        """ Store response if the server sent validators for it """
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if not etag and not last_modified:
+            return
+
+        try:
+            content = response.content.decode('utf-8')
+        except UnicodeDecodeError:
+            return
+
+        entry = {'etag': etag,
+                 'last_modified': last_modified,
+                 'headers': dict(response.headers),
+                 'content': content}
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir, 0o700)
+            # mkstemp creates the file readable for the user only
+            fd, tmp_name = tempfile.mkstemp(dir=self.cache_dir, prefix='.')
+        except (IOError, OSError):
+            return
+
+        try:
+            with os.fdopen(fd, 'w') as entry_file:
+                json.dump(entry, entry_file)
+            os.rename(tmp_name, self.get_path(key))
+        except (IOError, OSError, TypeError, ValueError):
+            remove_file(tmp_name)
+            return
+        self.evict()
+
+    def evict(self):
+        """ Remove the least recently used responses above max_size """
+        entries = []
+        try:
+            for name in os.listdir(self.cache_dir):
+                if not name.endswith('.json'):
+                    continue
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        except OSError:
+            return
+
+        size = sum(entry[1] for entry in entries)
+        for mtime, entry_size, path in sorted(entries):
+            if size <= self.max_size:
+                break
+            remove_file(path)
+            size -= entry_size
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Read git refs without calling git
+
+Looking up a branch or a SHA is just reading a small file below .git,
+so it is done right here instead of spawning a git process.
+Supported are HEAD, loose refs and packed-refs in the files backend.
+Everything else (worktrees, reftable, revisions like 'master~2')
+raises a RefReadError and the caller has to ask git instead.
+"""
+import mmap
+import os
+import re
+from nacl.exceptions import RefReadError
+
+# packed-refs larger than this are searched memory-mapped
+PACKED_REFS_MMAP_SIZE = 64 * 1024
+
+# How git expands a short name (see 'git help revisions')
+REF_RULES = ['%s', 'refs/%s', 'refs/tags/%s', 'refs/heads/%s',
+             'refs/remotes/%s', 'refs/remotes/%s/HEAD']
+
+# SHA-1 or SHA-256
+SHA_RE = re.compile(r'^[0-9a-f]{40}([0-9a-f]{24})?$')
+
+# Only plain ref names, no revision syntax
+REF_NAME_RE = re.compile(r'^[A-Za-z0-9_./+-]+$')
+
+# packed-refs path -> ((mtime, size), {ref: sha})
+_packed_refs_cache = {}
+
+
+def check_layout(git_dir):
+    """ Raise RefReadError if refs of git_dir are not stored as files """
+    if os.path.exists(os.path.join(git_dir, 'commondir')):
+        raise RefReadError('worktree: refs are in the common dir')
+    if os.path.isdir(os.path.join(git_dir, 'reftable')):
+        raise RefReadError('refs are stored in a reftable')
+    if not os.path.isfile(os.path.join(git_dir, 'HEAD')):
+        raise RefReadError('no HEAD in ' + git_dir)
+
+
+def read_ref_file(git_dir, ref):
+    """ Return the content of a loose ref or None if there is none """
+    try:
+        with open(os.path.join(git_dir, ref)) as ref_file:
+            return ref_file.read().strip()
+    except IOError:
+        return None
+
+
+def read_symbolic_ref(git_dir, ref='HEAD'):
+    """ Return the ref a symbolic ref points to or None if it is detached """
+    content = read_ref_file(git_dir, ref)
+    if content is None:
+        raise RefReadError('cannot read ' + ref)
+    if content.startswith('ref: '):
+        return content[5:].strip()
+    return None
+
+
+def stat_packed_refs(git_dir):
+    """ Return the path of packed-refs and its (mtime, size) or None """
+    path = os.path.join(git_dir, 'packed-refs')
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return path, None
+    return path, (stat.st_mtime, stat.st_size)
+
+
+def parse_packed_refs(content):
+    """ Return {ref: sha} of the content of a packed-refs file """
+    refs = {}
+    for line in content.splitlines():
+        # comments and peeled tags
+        if not line or line[0] in '#^':
+            continue
+        sha, _, ref = line.partition(' ')
+        refs[ref] = sha
+    return refs
+
+
+def read_packed_refs(git_dir):
+    """ Return all packed refs as {ref: sha} """
+    path, stamp = stat_packed_refs(git_dir)
+    if stamp is None:
+        return {}
+
+    cached = _packed_refs_cache.get(path)
+    if cached and cached[0] == stamp:
+        return cached[1]
+
+    with open(path) as packed_refs:
+        refs = parse_packed_refs(packed_refs.read())
+
+    _packed_refs_cache[path] = (stamp, refs)
+    return refs
+
+
+def find_packed_ref(git_dir, ref):
+    """
+    Return the SHA of a packed ref or None
+
+    Big packed-refs files are not read and parsed as a whole, just the
+    line of ref is looked up in a memory map.
+    """
+    path, stamp = stat_packed_refs(git_dir)
+    if stamp is None:
+        return None
+
+    if stamp[1] < PACKED_REFS_MMAP_SIZE or path in _packed_refs_cache:
+        return read_packed_refs(git_dir).get(ref)
+
+    with open(path, 'rb') as packed_refs:
+        packed = mmap.mmap(packed_refs.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            needle = ' ' + ref + '\n'
+            pos = packed.find(needle)
+            while pos != -1:
+                start = packed.rfind('\n', 0, pos) + 1
+                sha = packed[start:pos]
+                if SHA_RE.match(sha):
+                    return sha
+                pos = packed.find(needle, pos + 1)
+        finally:
+            packed.close()
+    return None
+
+
+def resolve_full_ref(git_dir, ref, depth=0):
+    """ Return the SHA of a full ref name (e.g. refs/heads/master) or None """
+    if depth > 5:
+        raise RefReadError('symbolic refs nested too deep: ' + ref)
+
+    content = read_ref_file(git_dir, ref)
+    if content is not None:
+        if content.startswith('ref: '):
+            return resolve_full_ref(git_dir, content[5:].strip(), depth + 1)
+        if SHA_RE.match(content):
+            return content
+        raise RefReadError('unexpected content in ' + ref)
+
+    if ref == 'HEAD':
+        return None
+    return find_packed_ref(git_dir, ref)
+
+
+def resolve(git_dir, name):
+    """
+    Return the SHA name points to
+
+    name is a ref name like git rev-parse takes it: HEAD, @, master,
+    origin/master or refs/heads/master.
+    Raises RefReadError if git has to be asked instead (revision syntax,
+    unknown names, unsupported layout).
+    """
+    if name == '@':
+        name = 'HEAD'
+
+    if not REF_NAME_RE.match(name) or '..' in name:
+        raise RefReadError('not a plain ref name: ' + name)
+
+    check_layout(git_dir)
+
+    for rule in REF_RULES:
+        sha = resolve_full_ref(git_dir, rule % name)
+        if sha:
+            return sha
+
+    raise RefReadError('unknown ref: ' + name)
+
+
+def current_branch(git_dir):
+    """
+    Return the active branch, 'HEAD' if it is detached
+
+    This is what 'git rev-parse --abbrev-ref HEAD' prints.
+    """
+    check_layout(git_dir)
+
+    ref = read_symbolic_ref(git_dir)
+    if ref is None:
+        return 'HEAD'
+    if not ref.startswith('refs/heads/'):
+        raise RefReadError('HEAD points to ' + ref)
+    return ref[len('refs/heads/'):]
+
+
+def list_refs(git_dir, prefix='refs/heads/'):
+    """ Return {ref: sha} of all refs starting with prefix """
+    check_layout(git_dir)
+
+    refs = dict((ref, sha) for ref, sha in read_packed_refs(git_dir).items()
+                if ref.startswith(prefix))
+
+    # loose refs win over packed ones
+    top = os.path.join(git_dir, prefix)
+    for dir_path, dir_names, file_names in os.walk(top):
+        for file_name in file_names:
+            if file_name.endswith('.lock'):
+                continue
+            path = os.path.join(dir_path, file_name)
+            ref = os.path.relpath(path, git_dir).replace(os.sep, '/')
+            content = read_ref_file(git_dir, ref)
+            if content and SHA_RE.match(content):
+                refs[ref] = content
+
+    return refs
+
+
+def list_branches(git_dir):
+    """ Return the sorted names of all local branches """
+    return sorted(ref[len('refs/heads/'):] for ref in list_refs(git_dir))
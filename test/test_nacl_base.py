@@ -2,10 +2,19 @@
 # -*- coding: utf-8 -*-
 import unittest
 import mock
+import json
+import os
+import shutil
+import tempfile
+import nacl.base
 from nacl.base import get_salt_root_dirs
+from nacl.base import read_salt_master_roots
+from nacl.base import SALT_ROOT_DEFAULTS
 from nacl.base import get_users_nacl_conf
 from nacl.base import write_users_nacl_conf
 from nacl.base import init_nacl
+from nacl.base import NaclConfig
+from nacl.httpcache import CachingSession
 
 
 class TestNaclBase(unittest.TestCase):
@@ -22,8 +31,26 @@ class TestNaclBase(unittest.TestCase):
             'prod': ['/srv/salt/prod'
                      '/srv/formulas/nginx-formula']}}
 
+    def _salt_config_dir(self, master, master_d={}):
+        config_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, config_dir)
+        os.mkdir(os.path.join(config_dir, 'master.d'))
+        with open(os.path.join(config_dir, 'master'), 'w') as f:
+            f.write(master)
+        for name, content in master_d.items():
+            with open(os.path.join(config_dir, 'master.d', name), 'w') as f:
+                f.write(content)
+        patcher = mock.patch('nacl.base.SALT_MASTER_CONFIG',
+                             os.path.join(config_dir, 'master'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        nacl.base._salt_root_dirs_cache.clear()
+        return config_dir
+
+    @mock.patch('nacl.base.read_salt_master_roots', return_value=None)
     @mock.patch('salt.config.client_config', return_value=sample_salt_config)
-    def test_get_salt_root_dir(self, mock_config):
+    def test_get_salt_root_dir(self, mock_config, mock_rsmr):
+        self._salt_config_dir('')
         self.assertEqual(['/srv/pillar/base',
                           '/srv/pillar/dev',
                           '/srv/pillar/prod',
@@ -31,6 +58,49 @@ class TestNaclBase(unittest.TestCase):
                           '/srv/salt/prod/srv/formulas/nginx-formula'],
                          get_salt_root_dirs())
 
+    def test_get_salt_root_dir_without_salt(self):
+        self._salt_config_dir('file_roots:\n  base:\n    - /srv/salt/base\n',
+                              {'a.conf': 'pillar_roots:\n  dev: [/srv/pillar/dev]\n',
+                               'b.conf': 'pillar_roots:\n  dev: [/srv/pillar/dev2]\n'})
+        with mock.patch('nacl.base.read_salt_master_roots_with_salt') as mock_salt:
+            self.assertEqual(['/srv/pillar/dev',
+                              '/srv/pillar/dev2',
+                              '/srv/salt/base'],
+                             get_salt_root_dirs())
+            self.assertFalse(mock_salt.called)
+
+    def test_get_salt_root_dir_defaults(self):
+        self._salt_config_dir('# nothing configured\n')
+        self.assertEqual(['/srv/pillar', '/srv/salt',
+                          '/srv/spm/pillar', '/srv/spm/salt'],
+                         get_salt_root_dirs())
+
+    def test_get_salt_root_dir_cached(self):
+        config_dir = self._salt_config_dir('file_roots: {base: [/foo]}\n')
+        self.assertEqual(['/foo', '/srv/pillar', '/srv/spm/pillar'], get_salt_root_dirs())
+        with mock.patch('nacl.base.read_salt_master_roots') as mock_rsmr:
+            get_salt_root_dirs()
+            self.assertFalse(mock_rsmr.called)
+        # a new file in master.d is noticed
+        with open(os.path.join(config_dir, 'master.d', 'c.conf'), 'w') as f:
+            f.write('pillar_roots: {base: [/bar]}\n')
+        self.assertEqual(['/bar', '/foo'], get_salt_root_dirs())
+
+    # read_salt_master_roots()
+
+    def test_read_salt_master_roots_needs_salt(self):
+        for master in ['include: foo.conf\n',
+                       'default_include: foo.d/*.conf\n',
+                       'file_roots: {{ foo }}\n',
+                       'file_roots: [/foo]\n',
+                       'file_roots: {base: [/foo]\n',
+                       '- foo\n']:
+            config_dir = self._salt_config_dir(master)
+            self.assertEqual(None, read_salt_master_roots([os.path.join(config_dir, 'master')]))
+
+    def test_read_salt_master_roots_missing_master(self):
+        self.assertEqual(SALT_ROOT_DEFAULTS, read_salt_master_roots(['/not/existing']))
+
     # get_users_nacl_conf()
 
     @mock.patch('os.path.expanduser', return_value="/tmp/")
@@ -69,6 +139,70 @@ class TestNaclBase(unittest.TestCase):
         self.assertEqual([('FAIL', ' ~/.nacl not found or invalid JSON', 3)],
                          get_users_nacl_conf._fn())
 
+    # NaclConfig
+
+    def write_nacl_file(self, path, data, mtime):
+        with open(path, 'w') as nacl_file:
+            json.dump(data, nacl_file)
+        os.utime(path, (mtime, mtime))
+
+    def test_nacl_config_cached_and_reloaded(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            path = tmp_dir + '/.nacl'
+            self.write_nacl_file(path, {'proxy': 'http://proxy:3128'}, 1000)
+
+            config = NaclConfig()
+            config.path = path
+            self.assertEqual({'proxy': 'http://proxy:3128'}, config.load())
+            self.assertEqual('http://proxy:3128',
+                             config.git_env['https_proxy'])
+
+            # Not changed on disk: no reading at all
+            with mock.patch('json.load') as mock_load:
+                config.load()
+                self.assertFalse(mock_load.called)
+
+            # Changed on disk: read it again
+            self.write_nacl_file(path, {'gitgroup': 'salt'}, 2000)
+            self.assertEqual({'gitgroup': 'salt'}, config.load())
+            self.assertNotIn('https_proxy', config.git_env)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    @mock.patch('os.path.expanduser', return_value="/tmp/nacl_not_there")
+    def test_nacl_config_missing(self, mock_expanduser):
+        self.assertRaises(IOError, NaclConfig().load)
+
+    def test_nacl_config_http_session(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            path = tmp_dir + '/.nacl'
+            self.write_nacl_file(path, {'proxy': 'http://proxy:3128',
+                                        'http_pool_size': 4}, 1000)
+
+            config = NaclConfig()
+            config.path = path
+            session = config.get_http_session()
+            self.assertIs(session, config.get_http_session())
+            self.assertEqual('http://proxy:3128', session.proxies['https'])
+            self.assertTrue(session.verify)
+            self.assertEqual(4, session.get_adapter('https://foo')._pool_maxsize)
+
+            # A changed configuration gets a new session
+            self.write_nacl_file(path, {'verify_ssl': False}, 2000)
+            session = config.get_http_session()
+            self.assertFalse(session.verify)
+            self.assertEqual({}, session.proxies)
+            self.assertIsInstance(session, CachingSession)
+
+            # --no-cache
+            config.http_cache = False
+            config.http_session = None
+            self.assertNotIsInstance(config.get_http_session(), CachingSession)
+        finally:
+            shutil.rmtree(tmp_dir)
+
     # write_users_nacl_conf()
 
     def test_write_users_nacl_conf(self):
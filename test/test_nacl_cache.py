@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+import mock
+from nacl.cache import get_cache_dir
+from nacl.cache import load_cache
+from nacl.cache import save_cache
+from nacl.cache import remove_cache
+
+
+class TestNaclCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_home = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_home)
+        patcher = mock.patch.dict('os.environ',
+                                  {'XDG_CACHE_HOME': self.cache_home})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    # get_cache_dir()
+
+    def test_get_cache_dir(self):
+        self.assertEqual(os.path.join(self.cache_home, 'nacl'), get_cache_dir())
+
+    @mock.patch.dict('os.environ', {'XDG_CACHE_HOME': '', 'HOME': '/foo'})
+    def test_get_cache_dir_default(self):
+        self.assertEqual('/foo/.cache/nacl', get_cache_dir())
+
+    # load_cache() and save_cache()
+
+    def test_save_and_load_cache(self):
+        self.assertTrue(save_cache('foo', {'bar': [1, 2]}))
+        self.assertEqual({'bar': [1, 2]}, load_cache('foo'))
+        self.assertEqual(['foo.json'], os.listdir(get_cache_dir()))
+
+    def test_load_cache_missing(self):
+        self.assertEqual(None, load_cache('foo'))
+
+    def test_load_cache_broken(self):
+        os.makedirs(get_cache_dir())
+        with open(os.path.join(get_cache_dir(), 'foo.json'), 'w') as f:
+            f.write('{broken')
+        self.assertEqual(None, load_cache('foo'))
+
+    def test_save_cache_not_serializable(self):
+        self.assertFalse(save_cache('foo', {'bar': object()}))
+        self.assertEqual([], os.listdir(get_cache_dir()))
+
+    # remove_cache()
+
+    def test_remove_cache(self):
+        save_cache('foo', {})
+        remove_cache('foo')
+        self.assertEqual(None, load_cache('foo'))
+        # Nothing to remove is fine, too
+        remove_cache('foo')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -44,6 +44,16 @@ class TestLog(unittest.TestCase):
         output = mock_stdout.getvalue()
         self.assertEqual(u'[ WARN ] \x1b[94mfoo\x1b[0m\n', output)
 
+    # Iterators of lines are paged
+    @mock.patch('nacl.decorator.page')
+    def test_log_stream(self, mock_page):
+        @log
+        def dummy():
+            return [('BOLD', iter(['foo\n', 'bar']))]
+        dummy()
+        self.assertEqual([u'\x1b[1mfoo\x1b[0m\n', u'\x1b[1mbar\x1b[0m\n'],
+                         list(mock_page.call_args[0][0]))
+
     @mock.patch('sys.exit', return_value=None)
     def test_log_c(self, mock):
         @log
@@ -1,9 +1,13 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
 import unittest
 import mock
+import nacl.fileutils
 from nacl.fileutils import binary_exists
-from nacl.fileutils import get_dir_list_from_filesystem
+from nacl.fileutils import find_git_repositories
 
 
 class TestNaclFileUtils(unittest.TestCase):
@@ -14,23 +18,59 @@ class TestNaclFileUtils(unittest.TestCase):
         self.assertTrue(binary_exists('ls'))
         self.assertFalse(binary_exists('not_existing'))
 
-    # get_dir_list_from_filesystem()
-
-    @mock.patch('nacl.fileutils.get_salt_root_dirs', return_value=['/bar'])
-    @mock.patch('os.walk',
-                return_value=[('/fooo/.git', 'dirname', 'filename')])
-    def test_get_dir_list_from_filesystem_filter_set(self,
-                                                     mock_gsrd,
-                                                     mock_oswalk):
-        self.assertEqual(['/fooo/.git'], get_dir_list_from_filesystem('*.git'))
-
-    @mock.patch('nacl.fileutils.get_salt_root_dirs', return_value=['/bar'])
-    @mock.patch('os.walk',
-                return_value=[('/fooo/.git', 'dirname', 'filename')])
-    def test_get_dir_list_from_filesystem_no_filter(self,
-                                                    mock_gsrd,
-                                                    mock_oswalk):
-        self.assertEqual(['/fooo/.git'], get_dir_list_from_filesystem())
+    # find_git_repositories()
+
+    def _make_tree(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        for path in ['b/.git/refs', 'a/.git/objects', 'a/nested/.git',
+                     'c/d/e/.git', 'f']:
+            os.makedirs(os.path.join(root, path))
+        # A worktree or submodule has a .git file
+        os.makedirs(os.path.join(root, 'g'))
+        open(os.path.join(root, 'g', '.git'), 'w').close()
+        return root
+
+    def test_find_git_repositories(self):
+        root = self._make_tree()
+        self.assertEqual([os.path.join(root, x) for x in ['a', 'b', 'c/d/e', 'g']],
+                         list(find_git_repositories([root])))
+
+    def test_find_git_repositories_same_root_twice(self):
+        root = self._make_tree()
+        link = root + '_link'
+        os.symlink(root, link)
+        self.addCleanup(os.remove, link)
+        self.assertEqual(4, len(list(find_git_repositories([root, link]))))
+
+    def test_find_git_repositories_without_scandir(self):
+        root = self._make_tree()
+        with mock.patch.object(nacl.fileutils, 'scandir', None):
+            self.assertEqual([os.path.join(root, x) for x in ['a', 'b', 'c/d/e', 'g']],
+                             list(find_git_repositories([root])))
+
+    def test_find_git_repositories_scanned(self):
+        root = self._make_tree()
+        scanned = {}
+        list(find_git_repositories([root], scanned))
+        self.assertEqual(sorted([root, root + '/c', root + '/c/d', root + '/f']),
+                         sorted(scanned))
+        self.assertEqual(os.stat(root).st_mtime, scanned[root])
+
+    # Sorted by the full path, not directory by directory
+    def test_find_git_repositories_sorted(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        for path in ['a/x/.git', 'a-b/.git', 'a.c/.git', 'a0/.git']:
+            os.makedirs(os.path.join(root, path))
+        self.assertEqual([os.path.join(root, x) for x in ['a-b', 'a.c', 'a/x', 'a0']],
+                         list(find_git_repositories([root])))
+
+    def test_find_git_repositories_missing_root(self):
+        self.assertEqual([], list(find_git_repositories(['/not/existing'])))
+        scanned = {}
+        list(find_git_repositories(['/not/existing'], scanned))
+        self.assertEqual({'/not/existing': None}, scanned)
 
 
 if __name__ == '__main__':
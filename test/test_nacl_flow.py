@@ -7,24 +7,59 @@ import unittest
 import mock
 import pprint
 from nacl.flow import NaclFlow
+from nacl.flow import clear_cache
+
+
+def joined(__ret):
+    """ Join the lines of streamed messages, to compare them """
+    return [(level, msg if isinstance(msg, basestring) else ''.join(msg))
+            for level, msg in __ret]
 
 
 class TestNaclFlow(unittest.TestCase):
     """ Testting the nacl-flow.py main components """
 
-    @mock.patch('nacl.gitlabapi.GitLapApiCall.get_project_id',
-                return_value=123)
     @mock.patch('nacl.gitlabapi.get_users_nacl_conf',
                 return_value={
                     'gitapiserver': 'foo',
                     'gitapitoken': 'bar'
                 })
-    def setUp(self, mock_guc, mock):
+    @mock.patch('nacl.gitlabapi.get_http_session')
+    def setUp(self, mock_ghs, mock_guc):
         self.flow = NaclFlow()
+        self.flow.api.p_id = 123
+
+    # __init__()
+
+    # Not about a project: no repository needed
+    @mock.patch('nacl.gitlabapi.get_users_nacl_conf',
+                return_value={
+                    'gitapiserver': 'foo',
+                    'gitapitoken': 'bar'
+                })
+    @mock.patch('nacl.gitlabapi.get_http_session')
+    @mock.patch('nacl.gitlabapi.GitLapApiCall.get_project_id',
+                return_value=22)
+    def test_init_lazy_project(self, mock_gpi, mock_ghs, mock_guc):
+        flow = NaclFlow()
+        self.assertFalse(mock_gpi.called)
+        self.assertEqual(22, flow.p_id)
+        self.assertEqual(22, flow.api.p_id)
+        self.assertEqual(1, mock_gpi.call_count)
 
     def raise_TypeError():
         raise TypeError('foo')
 
+    # clear_cache()
+    @mock.patch('nacl.gitapi.forget_ids')
+    @mock.patch('nacl.flow.remove_cache')
+    def test_clear_cache(self, mock_rc, mock_fi):
+        self.assertEqual([('INFO', 'Cached gitlab ids removed')],
+                         clear_cache._fn())
+        mock_fi.assert_called_with()
+        mock_rc.assert_any_call('iids')
+        mock_rc.assert_any_call('projects')
+
     # get_all_issues()
     @mock.patch('nacl.gitlabapi.GitLapApiCall.get_all_issues',
                 side_effect=raise_TypeError)
@@ -114,7 +149,9 @@ class TestNaclFlow(unittest.TestCase):
                 return_value=issues_assignee)
     @mock.patch('nacl.gitlabapi.GitLapApiCall.getproject',
                 return_value=project_a)
-    def test_get_my_issues(self, mock_gai, mock_gp):
+    @mock.patch('nacl.gitlabapi.load_cache', return_value=None)
+    @mock.patch('nacl.gitlabapi.save_cache')
+    def test_get_my_issues(self, mock_sc, mock_lc, mock_gai, mock_gp):
         self.assertEquals([('INFO', 'TITLE: foo'),
                            ('GREEN', 'ID: 123'),
                            ('GREEN', 'URL: http://foo.com'),
@@ -131,10 +168,26 @@ class TestNaclFlow(unittest.TestCase):
                 return_value=[])
     @mock.patch('nacl.gitlabapi.GitLapApiCall.getproject',
                 return_value=project_a)
-    def test_get_my_no_issues(self, mock_gai, mock_gp):
+    @mock.patch('nacl.gitlabapi.load_cache', return_value=None)
+    @mock.patch('nacl.gitlabapi.save_cache')
+    def test_get_my_no_issues(self, mock_sc, mock_lc, mock_gp, mock_gi):
         self.assertEquals([('INFO',
                            'No open issues found. Try nacl-flow mi all')],
                           self.flow.get_my_issues._fn(self.flow))
+        self.assertFalse(mock_gp.called)
+
+    # Closed issues are not shown and their projects are not looked up
+    @mock.patch('nacl.gitlabapi.GitLapApiCall.getissues',
+                return_value=[{'state': 'closed', 'project_id': 7}])
+    @mock.patch('nacl.gitlabapi.GitLapApiCall.getproject',
+                return_value=project_a)
+    @mock.patch('nacl.gitlabapi.load_cache', return_value=None)
+    @mock.patch('nacl.gitlabapi.save_cache')
+    def test_get_my_issues_closed(self, mock_sc, mock_lc, mock_gp, mock_gi):
+        self.assertEquals([('INFO',
+                           'No open issues found. Try nacl-flow mi all')],
+                          self.flow.get_my_issues._fn(self.flow))
+        self.assertFalse(mock_gp.called)
 
     # edit_issue()
 
@@ -675,7 +728,7 @@ class TestNaclFlow(unittest.TestCase):
                            ('INFO', 'COMMENTS:'),
                            ('GREEN', 'John Doe:'),
                            ('GREEN', 'foo_note\n----------------------------------------')],
-                          self.flow.get_mergerequest_details._fn(self.flow))
+                          joined(self.flow.get_mergerequest_details._fn(self.flow)))
 
     # MR not found
     @mock.patch('nacl.gitlabapi.GitLapApiCall.get_mergerequest_details',
@@ -725,7 +778,7 @@ class TestNaclFlow(unittest.TestCase):
                 return_value=123)
     @mock.patch('nacl.gitlabapi.GitLapApiCall.is_mergerequest_open',
                 return_value=True)
-    @mock.patch('nacl.gitlabapi.GitLapApiCall.get_mergerequest_details',
+    @mock.patch('nacl.gitlabapi.GitLapApiCall.getmergerequest',
                 return_value=False)
     def test_test_merge_request_mr_not_found(self,
                                              mock_igr,
@@ -743,8 +796,8 @@ class TestNaclFlow(unittest.TestCase):
                 return_value=123)
     @mock.patch('nacl.gitlabapi.GitLapApiCall.is_mergerequest_open',
                 return_value=True)
-    @mock.patch('nacl.gitlabapi.GitLapApiCall.get_mergerequest_details',
-                return_value=sample_mr_open)
+    @mock.patch('nacl.gitlabapi.GitLapApiCall.getmergerequest',
+                return_value=sample_mr_open['changes'])
     @mock.patch('nacl.git.branch_exist', return_value=True)
     def test_test_merge_request_test_branch_exists(self,
                                                    mock_igr,
@@ -763,8 +816,8 @@ class TestNaclFlow(unittest.TestCase):
                 return_value=123)
     @mock.patch('nacl.gitlabapi.GitLapApiCall.is_mergerequest_open',
                 return_value=True)
-    @mock.patch('nacl.gitlabapi.GitLapApiCall.get_mergerequest_details',
-                return_value=sample_mr_open)
+    @mock.patch('nacl.gitlabapi.GitLapApiCall.getmergerequest',
+                return_value=sample_mr_open['changes'])
     @mock.patch('nacl.git.branch_exist', return_value=False)
     @mock.patch('nacl.git.git', return_value=True)
     @mock.patch('nacl.git.get_current_branch', return_value='test_bar')
@@ -936,7 +989,7 @@ class TestNaclFlow(unittest.TestCase):
                            ('GREEN', 'DATE: foo_date'),
                            ('GREEN', 'DIFF:\n'),
                            ('BOLD', '\nfoo_diff')],
-                          self.flow.get_commit._fn(self.flow, 'aaabbb'))
+                          joined(self.flow.get_commit._fn(self.flow, 'aaabbb')))
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,7 +1,13 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import os
+import shutil
+import subprocess
+import tempfile
 import unittest
 import mock
+import nacl.git
+from io import BytesIO as StringIO
 # import pprint
 from nacl.git import branch_is_clean
 from nacl.git import need_pull_push
@@ -15,24 +21,135 @@ from nacl.git import is_commit_on_remote
 from nacl.git import get_current_branch
 from nacl.git import get_local_url_list
 from nacl.git import git
-from nacl.exceptions import GitCallError
+from nacl.exceptions import GitCallError, RefReadError
 from nacl.git import list_salt_git_repositories
 from nacl.git import remote_diff
+from nacl.git import compare_remote
+from nacl.git import git_lines
+from nacl.git import remote_diff_all
+from nacl.git import collect_remote_diff_stat
+from nacl.git import show_remote_diffs
 from nacl.git import checkout_branch
 from nacl.git import change_or_create_branch
 from nacl.git import merge_git_repo
+from nacl.git import merge_repository
+from nacl.git import print_merge_result
+from nacl.git import merge_all_repositories
+from nacl.git import fast_forward_branch_ref
+from nacl.git import can_update_branch_ref
 from nacl.git import remote_prune
 from nacl.git import pretty_status
-from nacl.git import print_merge_status
 from nacl.git import get_user_name
 from nacl.git import get_user_email
 from nacl.git import set_user_name
 from nacl.git import set_user_email
 from nacl.git import get_all_possible_git_dirs
+from nacl.git import iter_possible_git_dirs
+from nacl.git import repository_index_is_valid
+from nacl.git import ahead_behind_to_answer
+from nacl.git import parse_status_porcelain
+from nacl.git import parse_branch_refs
+from nacl.git import get_repo_status
+from nacl.git import collect_pretty_status
+from nacl.git import Repo
+from nacl.git import as_repo
+from nacl.git import fetch_is_fresh
+from nacl.git import fetch_origin
+from nacl.git import get_fetch_ttl
+from nacl.fileutils import find_git_repositories
 
 
 class TestNaclGit(unittest.TestCase):
 
+    # Repo
+
+    @mock.patch('nacl.git.git', return_value='master\n')
+    def test_repo_git_with_path(self, mock_git):
+        Repo('/foo').git(['status'])
+        mock_git.assert_called_once_with(['-C', '/foo', 'status'])
+
+    @mock.patch('nacl.git.git', return_value='master\n')
+    def test_repo_git_without_path(self, mock_git):
+        Repo().git(['status'])
+        mock_git.assert_called_once_with(['status'])
+
+    # facts are asked for once and forgotten after invalidate()
+    @mock.patch('nacl.git.git', side_effect=['master\n', 'issue_1\n'])
+    def test_repo_facts_cached(self, mock_git):
+        repo = Repo('/foo')
+        self.assertEqual('master', repo.branch)
+        self.assertEqual('master', repo.branch)
+        repo.invalidate()
+        self.assertEqual('issue_1', repo.branch)
+        self.assertEqual(2, mock_git.call_count)
+
+    # remembered facts are not asked for
+    @mock.patch('nacl.git.git')
+    def test_repo_remember(self, mock_git):
+        repo = Repo('/foo')
+        repo.remember('branch', 'issue_1')
+        self.assertEqual('issue_1', repo.branch)
+        self.assertFalse(mock_git.called)
+
+    # .git/config can not be read: ask git
+    @mock.patch('nacl.git.find_git_dir', return_value='/foo/.git')
+    @mock.patch('nacl.git.git', return_value='git@foo.git\n')
+    def test_repo_origin_url(self, mock_git, mock_fgd):
+        self.assertEqual('git@foo.git', Repo('/foo').origin_url)
+        mock_git.assert_called_once_with(
+            ['-C', '/foo', 'config', '--get', 'remote.origin.url'])
+
+    # A subdirectory of a checkout (e.g. a salt root) is read without git
+    def test_repo_origin_url_subdirectory(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        subprocess.check_call(['git', 'init', '-q', tmp_dir])
+        subprocess.check_call(['git', '-C', tmp_dir, 'remote', 'add', 'origin',
+                               'git@git.example.com:salt/foo.git'])
+        os.mkdir(os.path.join(tmp_dir, 'states'))
+        with mock.patch('nacl.git.git') as mock_git:
+            self.assertEqual('git@git.example.com:salt/foo.git',
+                             Repo(os.path.join(tmp_dir, 'states')).origin_url)
+            self.assertFalse(mock_git.called)
+
+    @mock.patch('os.getcwd', return_value='/foo/bar')
+    def test_repo_dir_name(self, mock_getcwd):
+        self.assertEqual('/foo', Repo('/foo').dir_name)
+        self.assertEqual('/foo/bar', Repo().dir_name)
+
+    # Refs are read from .git, git is asked if that does not work
+    @mock.patch('nacl.git.find_git_dir', return_value='/foo/.git')
+    @mock.patch('nacl.refs.resolve', return_value='abc')
+    @mock.patch('nacl.git.git')
+    def test_repo_rev_parse(self, mock_git, mock_resolve, mock_fgd):
+        self.assertEqual('abc', Repo('/foo').rev_parse('master'))
+        mock_resolve.assert_called_once_with('/foo/.git', 'master')
+        self.assertFalse(mock_git.called)
+
+    @mock.patch('nacl.git.find_git_dir', return_value='/foo/.git')
+    @mock.patch('nacl.refs.resolve', side_effect=RefReadError())
+    @mock.patch('nacl.git.git', return_value='abc\n')
+    def test_repo_rev_parse_by_git(self, mock_git, mock_resolve, mock_fgd):
+        self.assertEqual('abc', Repo('/foo').rev_parse('master~1'))
+        mock_git.assert_called_once_with(['-C', '/foo', 'rev-parse', 'master~1'])
+
+    @mock.patch('nacl.git.find_git_dir', return_value='/foo/.git')
+    @mock.patch('nacl.refs.current_branch', return_value='foo')
+    @mock.patch('nacl.git.git')
+    def test_repo_branch_from_refs(self, mock_git, mock_cb, mock_fgd):
+        repo = Repo('/foo')
+        self.assertEqual('foo', repo.branch)
+        self.assertEqual('foo', repo.branch)
+        self.assertEqual(1, mock_cb.call_count)
+        self.assertFalse(mock_git.called)
+
+    # as_repo()
+    def test_as_repo(self):
+        repo = Repo('/foo')
+        self.assertIs(repo, as_repo(repo))
+        self.assertEqual('/foo', as_repo('/foo').path)
+        self.assertEqual(None, as_repo().path)
+
     # branch_is_clean()
     @mock.patch('nacl.git.git', return_value=None)
     def test_branch_is_clean(self, whatever):
@@ -43,67 +160,157 @@ class TestNaclGit(unittest.TestCase):
         self.assertFalse(branch_is_clean())
 
     # need_pull_push()
+    @mock.patch('nacl.git.find_git_dir', return_value=None)
+    @mock.patch('nacl.git.fetch_is_fresh', return_value=False)
     @mock.patch('nacl.git.git', side_effect=[None, "a", "a", "b"])
-    def test_need_pull_push_0(self, whatever):
+    def test_need_pull_push_0(self, whatever, mock_fif, mock_fgd):
         self.assertEqual(need_pull_push(True), 0)
 
+    @mock.patch('nacl.git.find_git_dir', return_value=None)
+    @mock.patch('nacl.git.fetch_is_fresh', return_value=False)
     @mock.patch('nacl.git.git', side_effect=[None, "a", "b", "a"])
-    def test_need_pull_push_1(self, whatever):
+    def test_need_pull_push_1(self, whatever, mock_fif, mock_fgd):
         self.assertEqual(need_pull_push(True), 1)
 
+    @mock.patch('nacl.git.find_git_dir', return_value=None)
+    @mock.patch('nacl.git.fetch_is_fresh', return_value=False)
     @mock.patch('nacl.git.git', side_effect=[None, "a", "b", "b"])
-    def test_need_pull_push_2(self, whatever):
+    def test_need_pull_push_2(self, whatever, mock_fif, mock_fgd):
         self.assertEqual(need_pull_push(True), 2)
 
+    @mock.patch('nacl.git.find_git_dir', return_value=None)
+    @mock.patch('nacl.git.fetch_is_fresh', return_value=False)
     @mock.patch('nacl.git.git', side_effect=[None, "a", "b", "c"])
-    def test_need_pull_push_3(self, whatever):
+    def test_need_pull_push_3(self, whatever, mock_fif, mock_fgd):
         self.assertEqual(need_pull_push(True), 3)
 
+    @mock.patch('nacl.git.find_git_dir', return_value=None)
+    @mock.patch('nacl.git.fetch_is_fresh', return_value=False)
     @mock.patch('nacl.git.git', side_effect=[None, "a", "a", "b"])
-    def test_need_pull_push_0_answer(self, whatever):
+    def test_need_pull_push_0_answer(self, whatever, mock_fif, mock_fgd):
         self.assertEqual(need_pull_push(False), 'Up-to-date')
 
+    @mock.patch('nacl.git.find_git_dir', return_value=None)
+    @mock.patch('nacl.git.fetch_is_fresh', return_value=False)
     @mock.patch('nacl.git.git', side_effect=[None, "a", "b", "a"])
-    def test_need_pull_push_1_answer(self, whatever):
+    def test_need_pull_push_1_answer(self, whatever, mock_fif, mock_fgd):
         self.assertEqual(need_pull_push(False), 'Need to pull')
 
+    @mock.patch('nacl.git.find_git_dir', return_value=None)
+    @mock.patch('nacl.git.fetch_is_fresh', return_value=False)
     @mock.patch('nacl.git.git', side_effect=[None, "a", "b", "b"])
-    def test_need_pull_push_2_answer(self, whatever):
+    def test_need_pull_push_2_answer(self, whatever, mock_fif, mock_fgd):
         self.assertEqual(need_pull_push(False), 'Need to push')
 
+    @mock.patch('nacl.git.find_git_dir', return_value=None)
+    @mock.patch('nacl.git.fetch_is_fresh', return_value=False)
     @mock.patch('nacl.git.git', side_effect=[None, "a", "b", "c"])
-    def test_need_pull_push_3_answer(self, whatever):
+    def test_need_pull_push_3_answer(self, whatever, mock_fif, mock_fgd):
         self.assertEqual(need_pull_push(False), 'Diverged')
 
     # is_merged()
+    @mock.patch('nacl.git.find_git_dir', return_value=None)
+    @mock.patch('nacl.git.fetch_is_fresh', return_value=False)
     @mock.patch('nacl.git.git', side_effect=[None, "a", "a"])
-    def test_is_merged_true(self, whatever):
+    def test_is_merged_true(self, whatever, mock_fif, mock_fgd):
         self.assertTrue(is_merged("foo_branch"))
 
+    @mock.patch('nacl.git.find_git_dir', return_value=None)
+    @mock.patch('nacl.git.fetch_is_fresh', return_value=False)
     @mock.patch('nacl.git.git', side_effect=[None, "a", "b"])
-    def test_is_merged_false(self, nacl_git_mock):
+    def test_is_merged_false(self, nacl_git_mock, mock_fif, mock_fgd):
         self.assertFalse(is_merged("foo_branch"))
 
+    # fetch_is_fresh()
+    @mock.patch('nacl.git.find_git_dir', return_value='/foo/.git')
+    @mock.patch('os.path.getmtime', return_value=1000)
+    @mock.patch('time.time', return_value=1030)
+    def test_fetch_is_fresh(self, mock_time, mock_getmtime, mock_fgd):
+        self.assertTrue(fetch_is_fresh('/foo', 60))
+        self.assertFalse(fetch_is_fresh('/foo', 10))
+
+    @mock.patch('nacl.git.find_git_dir', return_value='/foo/.git')
+    @mock.patch('os.path.getmtime', side_effect=OSError())
+    def test_fetch_is_fresh_never_fetched(self, mock_getmtime, mock_fgd):
+        self.assertFalse(fetch_is_fresh('/foo', 60))
+
+    # get_fetch_ttl()
+    @mock.patch('nacl.git.get_users_nacl_conf', return_value={'fetch_ttl': 5})
+    def test_get_fetch_ttl(self, mock_guc):
+        self.assertEqual(5, get_fetch_ttl())
+
+    @mock.patch('nacl.git.get_users_nacl_conf', return_value={})
+    def test_get_fetch_ttl_default(self, mock_guc):
+        self.assertEqual(60, get_fetch_ttl())
+
+    # fetch_origin()
+    @mock.patch('nacl.git.fetch_is_fresh', return_value=True)
+    @mock.patch('nacl.git.git', return_value='')
+    def test_fetch_origin_fresh(self, mock_git, mock_fif):
+        self.assertFalse(fetch_origin('/foo'))
+        self.assertFalse(mock_git.called)
+
+    @mock.patch('nacl.git.fetch_is_fresh', return_value=True)
+    @mock.patch('nacl.git.git', return_value='')
+    def test_fetch_origin_refresh(self, mock_git, mock_fif):
+        self.assertTrue(fetch_origin('/foo', refresh=True))
+        mock_git.assert_called_once_with(['-C', '/foo', 'remote', 'update'])
+
     # is_git_repo()
-    @mock.patch('os.chdir', return_value=True)
-    @mock.patch('nacl.git.git', return_value=True)
-    def test_is_git_repo(self, os_mock, mock_git):
+    def _git_tree(self):
+        nacl.git._git_repo_cache.clear()
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        for path in ['repo/.git/objects', 'repo/.git/refs', 'repo/sub',
+                     'no_repo', 'broken/.git']:
+            os.makedirs(os.path.join(tmp_dir, path))
+        open(os.path.join(tmp_dir, 'repo/.git/HEAD'), 'w').close()
+        return tmp_dir
+
+    @mock.patch('nacl.git.git')
+    def test_is_git_repo(self, mock_git):
+        tmp_dir = self._git_tree()
+        self.assertTrue(is_git_repo(os.path.join(tmp_dir, 'repo')))
+        self.assertTrue(is_git_repo(os.path.join(tmp_dir, 'repo/sub')))
+        self.assertFalse(mock_git.called)
+
+    @mock.patch('nacl.git.git')
+    def test_is_git_repo_no_repo(self, mock_git):
+        tmp_dir = self._git_tree()
+        self.assertFalse(is_git_repo(os.path.join(tmp_dir, 'no_repo')))
+        self.assertFalse(is_git_repo(os.path.join(tmp_dir, 'broken')))
+        self.assertFalse(is_git_repo(os.path.join(tmp_dir, 'not_existing')))
+        self.assertFalse(mock_git.called)
+
+    @mock.patch('os.getcwd')
+    @mock.patch('nacl.git.git')
+    def test_is_git_repo_cwd(self, mock_git, mock_getcwd):
+        tmp_dir = self._git_tree()
+        mock_getcwd.return_value = os.path.join(tmp_dir, 'repo')
         self.assertTrue(is_git_repo())
 
-    @mock.patch('os.chdir', return_value=True)
-    @mock.patch('nacl.git.git', return_value=True)
-    def test_is_git_repo_with_dir_name(self, os_mock, mock_git):
-        self.assertTrue(is_git_repo('foo'))
+    # A .git file (worktree, submodule) is checked by git
+    @mock.patch('nacl.git.git', return_value='/foo/.git/worktrees/bar')
+    def test_is_git_repo_with_git_file(self, mock_git):
+        tmp_dir = self._git_tree()
+        open(os.path.join(tmp_dir, 'no_repo', '.git'), 'w').close()
+        self.assertTrue(is_git_repo(os.path.join(tmp_dir, 'no_repo')))
+        mock_git.assert_called_once_with(['-C', os.path.join(tmp_dir, 'no_repo'),
+                                          'rev-parse', '--git-dir'])
 
-    @mock.patch('os.chdir', return_value=True)
     @mock.patch('nacl.git.git', side_effect=GitCallError())
-    def test_is_git_repo_raises(self, os_mock, mock_git):
-        self.assertFalse(is_git_repo())
-
-    @mock.patch('os.chdir', return_value=True)
-    @mock.patch('nacl.git.git', side_effect=GitCallError())
-    def test_is_git_repo_with_dir_name_raises(self, os_mock, mock_git):
-        self.assertFalse(is_git_repo('foo'))
+    def test_is_git_repo_with_git_file_raises(self, mock_git):
+        tmp_dir = self._git_tree()
+        open(os.path.join(tmp_dir, 'no_repo', '.git'), 'w').close()
+        self.assertFalse(is_git_repo(os.path.join(tmp_dir, 'no_repo')))
+
+    @mock.patch('nacl.git.git', return_value='/foo/.git')
+    def test_is_git_repo_cached(self, mock_git):
+        tmp_dir = self._git_tree()
+        open(os.path.join(tmp_dir, 'no_repo', '.git'), 'w').close()
+        is_git_repo(os.path.join(tmp_dir, 'no_repo'))
+        is_git_repo(os.path.join(tmp_dir, 'no_repo'))
+        self.assertEqual(1, mock_git.call_count)
 
     # print_is_git_repo()
     @mock.patch('nacl.git.is_git_repo', return_value=False)
@@ -112,8 +319,9 @@ class TestNaclGit(unittest.TestCase):
                           print_is_git_repo._fn())
 
     # get_all_branches()
+    @mock.patch('nacl.git.find_git_dir', return_value=None)
     @mock.patch('nacl.git.git', side_effect=["foo_branch"])
-    def test_get_all_branches(self, git_mock):
+    def test_get_all_branches(self, git_mock, mock_fgd):
         self.assertEqual(get_all_branches(), ["foo_branch"])
 
     # branch_exists()
@@ -126,8 +334,9 @@ class TestNaclGit(unittest.TestCase):
         self.assertFalse(branch_exist("b4"))
 
     # get_last_commit_sha()
+    @mock.patch('nacl.git.find_git_dir', return_value=None)
     @mock.patch('nacl.git.git', side_effect=["aaaabbbbcccc"])
-    def test_get_last_commit_sha(self, mock):
+    def test_get_last_commit_sha(self, mock, mock_fgd):
         self.assertEqual(get_last_commit_sha(), "aaaabbbbcccc")
 
     # is_commit_on_remote()
@@ -188,14 +397,14 @@ class TestNaclGit(unittest.TestCase):
     # normal git call
     @mock.patch('subprocess.Popen.communicate', return_value=('foo', None))
     @mock.patch('subprocess.Popen.wait', return_value=0)
-    @mock.patch('nacl.git.get_users_nacl_conf', return_value={})
+    @mock.patch('nacl.git.get_git_env', return_value={})
     def test_git(self, mock_wait, mock_communicate, mock_conf):
         self.assertEquals('foo', git(['foo']))
 
     # raises GitCallError
     @mock.patch('subprocess.Popen.communicate', return_value=('foo', 'bar'))
     @mock.patch('subprocess.Popen.wait', return_value=1)
-    @mock.patch('nacl.git.get_users_nacl_conf', return_value={})
+    @mock.patch('nacl.git.get_git_env', return_value={})
     def test_raise_git_call_error(self,
                                   mock_wait,
                                   mock_communicate,
@@ -205,13 +414,11 @@ class TestNaclGit(unittest.TestCase):
     # providing an env
     @mock.patch('subprocess.Popen.communicate', return_value=('foo', None))
     @mock.patch('subprocess.Popen.wait', return_value=0)
-    @mock.patch('nacl.git.get_users_nacl_conf',
-                return_value={
-                    'gitapiserver': 'foo',
-                    'gitapitoken': 'bar'
-                })
-    def test_git_providing_env(self, mock_wait, mock_communicate, mock_guc):
+    @mock.patch('nacl.git.get_git_env', return_value={'HOME': '/foo'})
+    def test_git_providing_env(self, mock_gge, mock_wait, mock_communicate):
         self.assertEquals('foo', git(['foo'], env={'foo': 'bar'}))
+        # the shared environment must not be changed
+        self.assertEquals({'HOME': '/foo'}, mock_gge.return_value)
 
     # list_salt_git_repositories (partly)
     #
@@ -240,31 +447,230 @@ class TestNaclGit(unittest.TestCase):
     # the functions under tests.
     # When changing the messages one has to change the tests as well!
 
-    @mock.patch('nacl.git.get_all_possible_git_dirs', return_value=[])
-    def test_list_salt_git_repositories(self, mock_gapgd):
+    @mock.patch('nacl.git.iter_possible_git_dirs', return_value=iter([]))
+    def test_list_salt_git_repositories(self, mock_ipgd):
         self.assertEqual([('WARNING', 'No git repository provided!', 3)], list_salt_git_repositories._fn())
 
+    def test_list_salt_git_repositories_jobs_no_int(self):
+        self.assertEqual([('WARNING', 'Number of jobs must be a positive integer', 1)], list_salt_git_repositories._fn('foo'))
+
+    @mock.patch('nacl.git.iter_possible_git_dirs',
+                return_value=iter(['/foo', '/bar']))
+    @mock.patch('nacl.git.collect_pretty_status',
+                side_effect=lambda x, refresh: x.path)
+    @mock.patch('nacl.git.pretty_status')
+    def test_list_salt_git_repositories_in_order(self, mock_ps, mock_cps, mock_ipgd):
+        list_salt_git_repositories._fn('2')
+        self.assertEqual([mock.call('/foo'), mock.call('/bar')],
+                         mock_ps.write.call_args_list)
+
+    # collect_pretty_status()
+    @mock.patch('nacl.git.get_repo_status', side_effect=GitCallError())
+    def test_collect_pretty_status_git_fails(self, mock_grs):
+        self.assertEqual('git failed',
+                         collect_pretty_status('/foo')['pull_push'])
+
     # get_all_possible_git_dirs()
+    @mock.patch('nacl.git.save_cache')
+    @mock.patch('nacl.git.load_cache', return_value=None)
+    @mock.patch('nacl.git.get_salt_root_dirs', return_value=['/foo'])
+    @mock.patch('nacl.git.find_git_repositories',
+                return_value=['/foo/b', '/foo/a'])
+    @mock.patch('nacl.git.is_git_repo', return_value=True)
+    def test_get_all_possible_git_dirs(self, mock_isgr, mock_fgr, mock_gsrd, mock_lc, mock_sc):
+        self.assertEqual(['/foo', '/foo/a', '/foo/b'], get_all_possible_git_dirs())
+
+    # Roots which are found by the walker are not checked again
+    @mock.patch('nacl.git.save_cache')
+    @mock.patch('nacl.git.load_cache', return_value=None)
     @mock.patch('nacl.git.get_salt_root_dirs', return_value=['/foo'])
-    @mock.patch('nacl.git.get_dir_list_from_filesystem',
-                return_value=['/foo/.git', '/bar/.git'])
+    @mock.patch('nacl.git.find_git_repositories', return_value=['/foo'])
     @mock.patch('nacl.git.is_git_repo', return_value=True)
-    def test_get_all_possible_git_dirs(self, mock_isgr, mock_gdlff, mock_gsrd):
-        self.assertEqual(['/bar', '/foo'], get_all_possible_git_dirs())
+    def test_get_all_possible_git_dirs_root_is_repo(self, mock_isgr, mock_fgr, mock_gsrd, mock_lc, mock_sc):
+        self.assertEqual(['/foo'], get_all_possible_git_dirs())
+        self.assertFalse(mock_isgr.called)
+
+    # Roots which are no repositories are dropped
+    @mock.patch('nacl.git.save_cache')
+    @mock.patch('nacl.git.load_cache', return_value=None)
+    @mock.patch('nacl.git.get_salt_root_dirs', return_value=['/foo'])
+    @mock.patch('nacl.git.find_git_repositories', return_value=[])
+    @mock.patch('nacl.git.is_git_repo', return_value=False)
+    def test_get_all_possible_git_dirs_no_repo(self, mock_isgr, mock_fgr, mock_gsrd, mock_lc, mock_sc):
+        self.assertEqual([], get_all_possible_git_dirs())
+
+    # Roots inside of a repository are yielded in order with the others
+    @mock.patch('nacl.git.save_cache')
+    @mock.patch('nacl.git.load_cache', return_value=None)
+    @mock.patch('nacl.git.get_salt_root_dirs', return_value=['/foo', '/foo-bar'])
+    @mock.patch('nacl.git.find_git_repositories', return_value=['/foo/a'])
+    @mock.patch('nacl.git.is_git_repo', side_effect=lambda root: root == '/foo-bar')
+    def test_iter_possible_git_dirs_sorted(self, mock_isgr, mock_fgr, mock_gsrd, mock_lc, mock_sc):
+        self.assertEqual(['/foo-bar', '/foo/a'], list(iter_possible_git_dirs()))
+        self.assertEqual(['/foo-bar', '/foo/a'],
+                         mock_sc.call_args[0][1]['repositories'])
+
+    # The result of a scan is stored in the index
+    @mock.patch('nacl.git.save_cache')
+    @mock.patch('nacl.git.load_cache', return_value=None)
+    @mock.patch('nacl.git.get_salt_root_dirs', return_value=['/foo'])
+    @mock.patch('nacl.git.find_git_repositories', return_value=['/foo/a'])
+    @mock.patch('nacl.git.is_git_repo', return_value=False)
+    def test_get_all_possible_git_dirs_saves_index(self, mock_isgr, mock_fgr, mock_gsrd, mock_lc, mock_sc):
+        get_all_possible_git_dirs()
+        mock_sc.assert_called_once_with('repositories',
+                                        {'roots': ['/foo'],
+                                         'scanned': {},
+                                         'repositories': ['/foo/a']})
+
+    # A valid index is used without scanning
+    @mock.patch('nacl.git.save_cache')
+    @mock.patch('nacl.git.load_cache',
+                return_value={'roots': ['/foo'], 'scanned': {},
+                              'repositories': ['/foo/a']})
+    @mock.patch('nacl.git.get_salt_root_dirs', return_value=['/foo'])
+    @mock.patch('nacl.git.find_git_repositories')
+    @mock.patch('nacl.git.is_git_repo')
+    def test_get_all_possible_git_dirs_from_index(self, mock_isgr, mock_fgr, mock_gsrd, mock_lc, mock_sc):
+        self.assertEqual(['/foo/a'], get_all_possible_git_dirs())
+        self.assertFalse(mock_fgr.called)
+        self.assertFalse(mock_isgr.called)
+        self.assertFalse(mock_sc.called)
+
+    # rescan ignores the index
+    @mock.patch('nacl.git.save_cache')
+    @mock.patch('nacl.git.load_cache',
+                return_value={'roots': ['/foo'], 'scanned': {},
+                              'repositories': ['/foo/a']})
+    @mock.patch('nacl.git.get_salt_root_dirs', return_value=['/foo'])
+    @mock.patch('nacl.git.find_git_repositories', return_value=['/foo/b'])
+    @mock.patch('nacl.git.is_git_repo', return_value=False)
+    def test_get_all_possible_git_dirs_rescan(self, mock_isgr, mock_fgr, mock_gsrd, mock_lc, mock_sc):
+        self.assertEqual(['/foo/b'], get_all_possible_git_dirs(rescan=True))
+        self.assertFalse(mock_lc.called)
+
+    # repository_index_is_valid()
+    def test_repository_index_is_valid(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(os.rmdir, tmp_dir)
+        index = {'roots': ['/foo'],
+                 'scanned': {tmp_dir: os.stat(tmp_dir).st_mtime},
+                 'repositories': []}
+        self.assertTrue(repository_index_is_valid(index, ['/foo']))
+        # other salt roots
+        self.assertFalse(repository_index_is_valid(index, ['/bar']))
+        # a scanned directory has changed
+        os.utime(tmp_dir, (0, 0))
+        self.assertFalse(repository_index_is_valid(index, ['/foo']))
+        # no or broken index
+        self.assertFalse(repository_index_is_valid(None, ['/foo']))
+        self.assertFalse(repository_index_is_valid({'roots': ['/foo']}, ['/foo']))
+
+    # A salt root which is created after the index was built
+    def test_repository_index_is_valid_missing_root(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        root = os.path.join(tmp_dir, 'salt')
+        scanned = {}
+        list(find_git_repositories([root], scanned))
+        index = {'roots': [root], 'scanned': scanned, 'repositories': []}
+        self.assertTrue(repository_index_is_valid(index, [root]))
+        os.makedirs(os.path.join(root, 'foo', '.git'))
+        self.assertFalse(repository_index_is_valid(index, [root]))
 
     # remote_diff()
 
     # branch is not clean and no diffs found
     @mock.patch('nacl.git.branch_is_clean', return_value=False)
     @mock.patch('nacl.git.git', return_value=None)
-    def test_remote_diff_branch_not_clean(self, mock_branch, mock_git):
+    @mock.patch('nacl.git.git_lines', return_value=iter([]))
+    @mock.patch('nacl.git.fetch_is_fresh', return_value=False)
+    def test_remote_diff_branch_not_clean(self, mock_fif, mock_gl, mock_branch, mock_git):
         self.assertEquals([('INFO', 'Uncommitted changes.'), ('INFO', 'No diffs found')], remote_diff._fn())
 
-    # branch is clean and pseudo diffs found
+    # branch is clean and pseudo diffs found, they are streamed
     @mock.patch('nacl.git.branch_is_clean', return_value=True)
-    @mock.patch('nacl.git.git', return_value='foo')
-    def test_remote_diff_branch_clean(self, mock_branch, mock_git):
-        self.assertEquals([('BOLD', 'foo')], remote_diff._fn())
+    @mock.patch('nacl.git.git', return_value=None)
+    @mock.patch('nacl.git.git_lines', return_value=iter(['foo\n', 'bar\n']))
+    @mock.patch('nacl.git.fetch_is_fresh', return_value=False)
+    def test_remote_diff_branch_clean(self, mock_fif, mock_gl, mock_branch, mock_git):
+        __ret = remote_diff._fn()
+        self.assertEquals('BOLD', __ret[0][0])
+        self.assertEquals(['foo\n', 'bar\n'], list(__ret[0][1]))
+
+    # git_lines()
+    @mock.patch('nacl.git.get_git_env', return_value=dict(os.environ))
+    def test_git_lines(self, mock_gge):
+        lines = git_lines(['--version'])
+        self.assertTrue(next(lines).startswith('git version'))
+        self.assertEqual([], list(lines))
+
+    @mock.patch('nacl.git.get_git_env', return_value=dict(os.environ))
+    def test_git_lines_raises(self, mock_gge):
+        lines = git_lines(['-C', '/not/existing', 'status'])
+        self.assertRaises(GitCallError, list, lines)
+
+    # Stopping early kills git
+    @mock.patch('nacl.git.get_git_env', return_value=dict(os.environ))
+    def test_git_lines_close(self, mock_gge):
+        lines = git_lines(['help', '-a'])
+        next(lines)
+        lines.close()
+
+    # collect_remote_diff_stat()
+    @mock.patch('nacl.git.fetch_is_fresh', return_value=True)
+    @mock.patch('nacl.git.git', return_value=' foo | 2 +-\n')
+    def test_collect_remote_diff_stat(self, mock_git, mock_fif):
+        repo, stat, error = collect_remote_diff_stat('/foo')
+        self.assertEqual(('/foo', ' foo | 2 +-', None), (repo.path, stat, error))
+        mock_git.assert_called_once_with(['-C', '/foo', 'diff', '--stat', 'master', 'origin/master'])
+
+    @mock.patch('nacl.git.fetch_is_fresh', return_value=False)
+    @mock.patch('nacl.git.git', side_effect=GitCallError('fatal: no origin\nmore'))
+    def test_collect_remote_diff_stat_raises(self, mock_git, mock_fif):
+        self.assertEqual((None, 'fatal: no origin'), collect_remote_diff_stat('/foo')[1:])
+
+    # remote_diff_all()
+    def test_remote_diff_all_jobs_no_int(self):
+        self.assertEqual([('WARNING', 'Number of jobs must be a positive integer', 1)],
+                         remote_diff_all._fn(jobs='x'))
+
+    @mock.patch('nacl.git.get_all_possible_git_dirs', return_value=['/a', '/b', '/c'])
+    @mock.patch('nacl.git.collect_remote_diff_stat',
+                side_effect=lambda x, refresh: {
+                    '/a': (Repo('/a'), ' foo | 1 +', None),
+                    '/b': (Repo('/b'), '', None),
+                    '/c': (Repo('/c'), None, 'fatal')}[x])
+    @mock.patch('nacl.git.show_remote_diffs')
+    @mock.patch('sys.stdin')
+    @mock.patch('sys.stdout')
+    def test_remote_diff_all(self, mock_stdout, mock_stdin, mock_srd, mock_crds, mock_gapgd):
+        mock_stdin.isatty.return_value = True
+        mock_stdout.isatty.return_value = True
+        remote_diff_all._fn()
+        self.assertEqual(['/a'], [x.path for x in mock_srd.call_args[0][0]])
+
+    # Nothing to ask, if we are not on a terminal
+    @mock.patch('nacl.git.get_all_possible_git_dirs', return_value=['/a'])
+    @mock.patch('nacl.git.collect_remote_diff_stat',
+                return_value=(Repo('/a'), ' foo | 1 +', None))
+    @mock.patch('nacl.git.show_remote_diffs')
+    @mock.patch('sys.stdin')
+    @mock.patch('sys.stdout')
+    def test_remote_diff_all_no_tty(self, mock_stdout, mock_stdin, mock_srd, mock_crds, mock_gapgd):
+        mock_stdin.isatty.return_value = False
+        remote_diff_all._fn()
+        self.assertFalse(mock_srd.called)
+
+    # show_remote_diffs()
+    @mock.patch('nacl.git.input_wrapper', side_effect=['2', '3', 'x', 'q'])
+    @mock.patch('nacl.git.git_lines', return_value=iter(['the diff']))
+    @mock.patch('nacl.git.page')
+    @mock.patch('sys.stdout')
+    def test_show_remote_diffs(self, mock_stdout, mock_page, mock_gl, mock_iw):
+        show_remote_diffs([Repo('/a'), Repo('/b')])
+        mock_gl.assert_called_once_with(['-C', '/b', 'diff', 'master', 'origin/master'])
+        self.assertEqual(1, mock_page.call_count)
 
     # checkout_branch()
     # First Check: branch is not provided
@@ -331,13 +737,15 @@ class TestNaclGit(unittest.TestCase):
         self.assertEquals([('INFO', 'foo')], change_or_create_branch._fn(None))
 
     # branch is provided but doesn't exists
+    @mock.patch('nacl.git.find_git_dir', return_value=None)
     @mock.patch('nacl.git.git', return_value='bar')
     @mock.patch('nacl.git.print_is_git_repo', return_value=None)
     @mock.patch('nacl.git.branch_exist', return_value=False)
     def test_change_or_create_branch_branch_not_exists(self,
                                                        mock_git,
                                                        mock_pigr,
-                                                       mock_be):
+                                                       mock_be,
+                                                       mock_fgd):
         self.assertEquals([('INFO', 'Creating branch: bar'), ('INFO', 'Switch into: bar')],
                           change_or_create_branch._fn('bar'))
 
@@ -355,21 +763,15 @@ class TestNaclGit(unittest.TestCase):
     # merge_git_repo()
 
     # Test git_repo_name is provided and branch is dirty
-    @mock.patch('os.chdir', return_value=True)
-    @mock.patch('os.getcwd', return_value='/foo/bar')
     @mock.patch('nacl.git.get_current_branch', return_value='foo')
     @mock.patch('nacl.git.branch_is_clean', return_value=False)
     def test_merge_git_repo_branch_is_dirty(self,
                                             mock_bic,
-                                            mock_gcb,
-                                            mock_getcwd,
-                                            mock_chdir):
+                                            mock_gcb):
         self.assertEquals([('INFO', 'Checking: /foo/bar'), ('INFO', 'Uncommitted changes, skipping...')],
-                          merge_git_repo._fn('bar'))
+                          merge_git_repo._fn('/foo/bar'))
 
     # Branch is clean and needs pull, master is active
-    @mock.patch('os.chdir', return_value=True)
-    @mock.patch('os.getcwd', return_value='/foo/bar')
     @mock.patch('nacl.git.get_current_branch', return_value='master')
     @mock.patch('nacl.git.branch_is_clean', return_value=True)
     @mock.patch('nacl.git.git', return_value='baz')
@@ -378,32 +780,27 @@ class TestNaclGit(unittest.TestCase):
                                             mock_npp,
                                             mock_git,
                                             mock_bic,
-                                            mock_gcb,
-                                            mock_getcwd,
-                                            mock_chdir):
+                                            mock_gcb):
         self.assertEquals([('INFO', 'Checking: /foo/bar'),
                            ('INFO', 'Need merge! '),
                            ('INFO', 'Try to merge Branch: master in /foo/bar'),
                            ('INFO', 'Start merge...'),
                            ('INFO', 'Merge complete!')],
-                          merge_git_repo._fn('bar'))
+                          merge_git_repo._fn('/foo/bar'))
 
     # Branch is clean and needs pull, master is NOT active
-    @mock.patch('os.chdir', return_value=True)
-    @mock.patch('os.getcwd', return_value='/foo/bar')
+    # and can only be updated with a checkout (other worktrees)
     @mock.patch('nacl.git.get_current_branch', return_value='foo')
     @mock.patch('nacl.git.branch_is_clean', return_value=True)
     @mock.patch('nacl.git.git', return_value='baz')
     @mock.patch('nacl.git.need_pull_push', return_value=1)
-    @mock.patch('nacl.git.checkout_branch', return_value=None)
+    @mock.patch('nacl.git.can_update_branch_ref', return_value=False)
     def test_merge_git_repo_branch_is_clean_not_master(self,
-                                                       mock_cb,
+                                                       mock_cubr,
                                                        mock_npp,
                                                        mock_git,
                                                        mock_bic,
-                                                       mock_gcb,
-                                                       mock_getcwd,
-                                                       mock_chdir):
+                                                       mock_gcb):
         self.assertEquals([('INFO', 'Checking: /foo/bar'),
                            ('INFO', 'Checkout master'),
                            ('INFO', 'Need merge! '),
@@ -411,32 +808,52 @@ class TestNaclGit(unittest.TestCase):
                            ('INFO', 'Start merge...'),
                            ('INFO', 'Merge complete!'),
                            ('INFO', 'Switch back')],
-                          merge_git_repo._fn('bar'))
+                          merge_git_repo._fn('/foo/bar'))
 
     # Branch is clean but DON'T needs pull, master is NOT active
-    @mock.patch('os.chdir', return_value=True)
-    @mock.patch('os.getcwd', return_value='/foo/bar')
+    # and can only be updated with a checkout (other worktrees)
     @mock.patch('nacl.git.get_current_branch', return_value='foo')
     @mock.patch('nacl.git.branch_is_clean', return_value=True)
     @mock.patch('nacl.git.git', return_value='baz')
     @mock.patch('nacl.git.need_pull_push', return_value=0)
-    @mock.patch('nacl.git.checkout_branch', return_value=None)
+    @mock.patch('nacl.git.can_update_branch_ref', return_value=False)
     def test_merge_git_repo_branch_no_pull_not_master(self,
-                                                      mock_cb,
+                                                      mock_cubr,
                                                       mock_npp,
                                                       mock_git,
                                                       mock_bic,
-                                                      mock_gcb,
-                                                      mock_getcwd,
-                                                      mock_chdir):
+                                                      mock_gcb):
         self.assertEquals([('INFO', 'Checking: /foo/bar'),
                            ('INFO', 'Checkout master'),
                            ('INFO', 'Nothing to do in master... Switch back')],
-                          merge_git_repo._fn('bar'))
+                          merge_git_repo._fn('/foo/bar'))
+
+    # Branch is clean and needs pull, master is NOT active:
+    # only the ref of master is moved
+    @mock.patch('nacl.git.get_current_branch', return_value='foo')
+    @mock.patch('nacl.git.branch_is_clean', return_value=True)
+    @mock.patch('nacl.git.git')
+    @mock.patch('nacl.git.need_pull_push', return_value=1)
+    @mock.patch('nacl.git.can_update_branch_ref', return_value=True)
+    @mock.patch('nacl.git.fast_forward_branch_ref')
+    def test_merge_git_repo_not_master_ref_only(self,
+                                                mock_ffbr,
+                                                mock_cubr,
+                                                mock_npp,
+                                                mock_git,
+                                                mock_bic,
+                                                mock_gcb):
+        self.assertEquals([('INFO', 'Checking: /foo/bar'),
+                           ('INFO', 'Need merge! '),
+                           ('INFO', 'Try to merge Branch: master in /foo/bar'),
+                           ('INFO', 'Fast-forward master without checkout...'),
+                           ('INFO', 'Merge complete!')],
+                          merge_git_repo._fn('/foo/bar'))
+        self.assertEqual(1, mock_ffbr.call_count)
+        # No checkout at all
+        self.assertFalse(mock_git.called)
 
     # Raise Exception output test
-    @mock.patch('os.chdir', return_value=True)
-    @mock.patch('os.getcwd', return_value='/foo/bar')
     @mock.patch('nacl.git.get_current_branch', return_value='master')
     @mock.patch('nacl.git.branch_is_clean', return_value=True)
     @mock.patch('nacl.git.git', side_effect=git_side_effect)
@@ -447,13 +864,187 @@ class TestNaclGit(unittest.TestCase):
                                                 mock_npp,
                                                 mock_git,
                                                 mock_bic,
-                                                mock_gcb,
-                                                mock_getcwd,
-                                                mock_chdir):
+                                                mock_gcb):
         self.assertEquals([('INFO', 'Checking: /foo/bar'),
                            ('INFO', 'Need merge! '),
                            ('INFO', 'Try to merge Branch: master in /foo/bar'),
-                           ('INFO', 'Merge failed: ')], merge_git_repo._fn('bar'))
+                           ('INFO', 'Start merge...'),
+                           ('INFO', 'Merge failed: ')], merge_git_repo._fn('/foo/bar'))
+
+    # Switching to master fails: no merge into the wrong branch
+    @mock.patch('nacl.git.get_current_branch', return_value='foo')
+    @mock.patch('nacl.git.branch_is_clean', return_value=True)
+    @mock.patch('nacl.git.git', side_effect=GitCallError('local changes'))
+    @mock.patch('nacl.git.need_pull_push')
+    def test_merge_repository_checkout_fails(self,
+                                             mock_npp,
+                                             mock_git,
+                                             mock_bic,
+                                             mock_gcb):
+        self.assertEquals(('failed',
+                           'git failed: local changes',
+                           [('INFO', 'Checking: /foo/bar'),
+                            ('INFO', 'Checkout master'),
+                            ('FAIL', 'git failed: local changes')]),
+                          merge_repository('/foo/bar'))
+        self.assertFalse(mock_npp.called)
+
+    def git_merge_fails_side_effect(args):
+        if 'merge' in args:
+            raise GitCallError('conflict')
+        return ''
+
+    # The merge fails after switching to master: we switch back, but
+    # the reason is still the failed merge
+    @mock.patch('nacl.git.get_current_branch', return_value='foo')
+    @mock.patch('nacl.git.branch_is_clean', return_value=True)
+    @mock.patch('nacl.git.can_update_branch_ref', return_value=False)
+    @mock.patch('nacl.git.git', side_effect=git_merge_fails_side_effect)
+    @mock.patch('nacl.git.need_pull_push', return_value=1)
+    @mock.patch('sys.stdout', new_callable=StringIO)
+    def test_merge_repository_fails_switch_back(self,
+                                                mock_stdout,
+                                                mock_npp,
+                                                mock_git,
+                                                mock_cubr,
+                                                mock_bic,
+                                                mock_gcb):
+        state, error, messages = merge_repository('/foo/bar')
+        self.assertEquals('failed', state)
+        self.assertEquals('Merge failed: conflict', error)
+        self.assertEquals(('INFO', 'Switch back'), messages[-1])
+        self.assertEquals(['-C', '/foo/bar', 'checkout', 'foo'],
+                          mock_git.call_args[0][0])
+
+        print_merge_result('/foo/bar', state, error)
+        self.assertIn('Merge failed: conflict', mock_stdout.getvalue())
+        self.assertNotIn('Switch back', mock_stdout.getvalue())
+
+    # Diverged master can not be fast-forwarded, but nothing failed
+    @mock.patch('nacl.git.get_current_branch', return_value='master')
+    @mock.patch('nacl.git.branch_is_clean', return_value=True)
+    @mock.patch('nacl.git.git')
+    @mock.patch('nacl.git.need_pull_push', return_value=3)
+    def test_merge_repository_diverged(self,
+                                       mock_npp,
+                                       mock_git,
+                                       mock_bic,
+                                       mock_gcb):
+        state, error, messages = merge_repository('/foo/bar')
+        self.assertEquals('diverged', state)
+        self.assertEquals(None, error)
+        self.assertEquals(('WARNING', 'master and origin/master have diverged'),
+                          messages[-1])
+        self.assertFalse(mock_git.called)
+
+    # master is ahead of origin/master: nothing to merge, not up-to-date
+    @mock.patch('nacl.git.get_current_branch', return_value='foo')
+    @mock.patch('nacl.git.branch_is_clean', return_value=True)
+    @mock.patch('nacl.git.can_update_branch_ref', return_value=False)
+    @mock.patch('nacl.git.git', return_value='')
+    @mock.patch('nacl.git.need_pull_push', return_value=2)
+    def test_merge_repository_need_push(self,
+                                        mock_npp,
+                                        mock_git,
+                                        mock_cubr,
+                                        mock_bic,
+                                        mock_gcb):
+        state, error, messages = merge_repository('/foo/bar')
+        self.assertEquals('need-push', state)
+        self.assertEquals(None, error)
+        self.assertEquals(('INFO', 'Nothing to do in master... Switch back'),
+                          messages[-1])
+        # checkout master and back, no merge
+        self.assertEquals([['-C', '/foo/bar', 'checkout', 'master'],
+                           ['-C', '/foo/bar', 'checkout', 'foo']],
+                          [c[0][0] for c in mock_git.call_args_list])
+
+    @mock.patch('nacl.git.get_current_branch', return_value='master')
+    @mock.patch('nacl.git.branch_is_clean', side_effect=[False, True, True])
+    @mock.patch('nacl.git.git')
+    @mock.patch('nacl.git.need_pull_push', side_effect=[0, 1])
+    def test_merge_repository_states(self,
+                                     mock_npp,
+                                     mock_git,
+                                     mock_bic,
+                                     mock_gcb):
+        self.assertEquals(['skipped-dirty', 'up-to-date', 'merged'],
+                          [merge_repository('/foo/bar')[0] for x in range(3)])
+
+    # fast_forward_branch_ref()
+    def _repo_with_origin(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        env = dict(os.environ,
+                   GIT_AUTHOR_NAME='nacl', GIT_AUTHOR_EMAIL='nacl@example.com',
+                   GIT_COMMITTER_NAME='nacl', GIT_COMMITTER_EMAIL='nacl@example.com')
+        for args in [['init', '-q'],
+                     ['checkout', '-q', '-b', 'master'],
+                     ['commit', '-q', '--allow-empty', '-m', 'one'],
+                     ['checkout', '-q', '-b', 'foo'],
+                     ['commit', '-q', '--allow-empty', '-m', 'two'],
+                     ['update-ref', 'refs/remotes/origin/master', 'foo'],
+                     ['commit', '-q', '--allow-empty', '-m', 'three']]:
+            subprocess.check_call(['git', '-C', tmp_dir] + args, env=env)
+        return Repo(tmp_dir)
+
+    @mock.patch('nacl.git.get_git_env', return_value=dict(os.environ))
+    def test_fast_forward_branch_ref(self, mock_gge):
+        repo = self._repo_with_origin()
+        head = repo.head_sha
+        fast_forward_branch_ref(repo)
+        self.assertEqual(repo.rev_parse('origin/master'), repo.rev_parse('master'))
+        # Nothing else changed
+        self.assertEqual('foo', repo.branch)
+        self.assertEqual(head, repo.head_sha)
+        self.assertTrue(can_update_branch_ref(repo))
+
+    # no fast-forward
+    @mock.patch('nacl.git.get_git_env', return_value=dict(os.environ))
+    def test_fast_forward_branch_ref_no_ancestor(self, mock_gge):
+        repo = self._repo_with_origin()
+        # master is ahead of origin/master
+        repo.git(['update-ref', 'refs/heads/master', 'foo'])
+        master = repo.rev_parse('master')
+        self.assertRaises(GitCallError, fast_forward_branch_ref, repo)
+        self.assertEqual(master, repo.rev_parse('master'))
+
+    @mock.patch('nacl.git.get_git_env', return_value=dict(os.environ))
+    def test_can_update_branch_ref_worktrees(self, mock_gge):
+        repo = self._repo_with_origin()
+        os.mkdir(os.path.join(repo.git_dir, 'worktrees'))
+        self.assertFalse(can_update_branch_ref(repo))
+
+    # merge_all_repositories()
+    def test_merge_all_repositories_jobs_no_int(self):
+        self.assertEqual([('WARNING', 'Number of jobs must be a positive integer', 1)],
+                         merge_all_repositories._fn(jobs='0'))
+
+    @mock.patch('nacl.git.get_all_possible_git_dirs', return_value=[])
+    def test_merge_all_repositories_no_repos(self, mock_gapgd):
+        self.assertEqual([('WARNING', 'No git repository provided!', 3)],
+                         merge_all_repositories._fn())
+
+    @mock.patch('nacl.git.get_all_possible_git_dirs',
+                return_value=['/a', '/b', '/c'])
+    @mock.patch('nacl.git.merge_repository',
+                side_effect=lambda x, refresh: {
+                    '/a': ('merged', None, []),
+                    '/b': ('failed', 'Merge failed: foo',
+                           [('INFO', 'Merge failed: foo')]),
+                    '/c': ('merged', None, [])}[x])
+    @mock.patch('nacl.git.print_merge_result')
+    @mock.patch('nacl.git.print_merge_summary')
+    def test_merge_all_repositories(self, mock_pms, mock_pmr, mock_mr, mock_gapgd):
+        merge_all_repositories._fn(jobs='2')
+        self.assertEqual(3, mock_pmr.call_count)
+        self.assertEqual({'merged': ['/a', '/c'],
+                          'up-to-date': [],
+                          'skipped-dirty': [],
+                          'need-push': [],
+                          'diverged': [],
+                          'failed': ['/b']},
+                         dict((k, sorted(v)) for k, v in mock_pms.call_args[0][0].items()))
 
     # remote_prune()
     @mock.patch('nacl.git.git', return_value='')
@@ -465,57 +1056,170 @@ class TestNaclGit(unittest.TestCase):
         self.assertEquals([('FAIL', 'Prune failed: ')], remote_prune._fn())
 
     # get_local_url_list()
-    @mock.patch('nacl.git.get_dir_list_from_filesystem', return_value=['foo'])
+    @mock.patch('nacl.git.get_all_possible_git_dirs', return_value=['foo'])
     @mock.patch('os.chdir', return_value=None)
     @mock.patch('nacl.git.git', return_value='git@foo.git')
     def test_get_local_url_list(self, mock_gdlff, mock_os, mock_git):
         self.assertEquals(['git@foo.git'], get_local_url_list())
 
+    # compare_remote()
+    @mock.patch('nacl.git.get_local_url_list',
+                return_value=['git@git.example.com:salt/foo.git', ''])
+    @mock.patch('nacl.gitapi.get_remote_url_dict',
+                return_value={'https://git.example.com/salt/foo.git': 'foo',
+                              'git@git.example.com:salt/bar.git': 'bar'})
+    @mock.patch('sys.stdout', new_callable=StringIO)
+    def test_compare_remote(self, mock_stdout, mock_grud, mock_glul):
+        compare_remote()
+        output = mock_stdout.getvalue()
+        self.assertIn('salt/bar.git', output)
+        self.assertNotIn('salt/foo.git', output)
+
     # pretty_status()
     # Branch is clean
-    @mock.patch('nacl.git.get_current_branch', return_value='foo')
-    @mock.patch('nacl.git.git', return_value='M status')
-    @mock.patch('nacl.git.need_pull_push', return_value='Yes')
-    @mock.patch('nacl.git.get_all_branches', return_value=['a', 'b'])
-    @mock.patch('nacl.git.branch_is_clean', return_value=True)
-    @mock.patch('nacl.git.print_merge_status', return_value='baz')
+    repo_status_clean = {
+        'branch': 'foo',
+        'dirty': False,
+        'changes': ['?? bar'],
+        'pull_push': 'Yes',
+        'all_branches': ['a', 'b'],
+        'merged': False}
+
+    @mock.patch('nacl.git.get_repo_status', return_value=repo_status_clean)
     @mock.patch('os.getcwd', return_value='/foo/bar')
-    def test_pretty_status(self,
-                           mock_getcwd,
-                           mock_ms,
-                           mock_bic,
-                           mock_gab,
-                           mock_npp,
-                           mock_git,
-                           mock_gcb):
-        self.assertEquals({'status': 'Clean', 'dir_name': '/foo/bar', 'pull_push': 'Yes', 'all_branches': 'a, b', 'branch': 'foo', 'merge_status': 'baz'}, pretty_status._fn())
+    def test_pretty_status(self, mock_getcwd, mock_grs):
+        self.assertEquals({'status': 'Clean', 'dir_name': '/foo/bar', 'pull_push': 'Yes', 'all_branches': 'a, b', 'branch': 'foo', 'merge_status': '(unmerged)'}, pretty_status._fn())
 
     # Branch is not clean!
-    @mock.patch('nacl.git.get_current_branch', return_value='foo')
-    @mock.patch('nacl.git.git', return_value='M status')
-    @mock.patch('nacl.git.need_pull_push', return_value='Yes')
-    @mock.patch('nacl.git.get_all_branches', return_value=['a', 'b'])
-    @mock.patch('nacl.git.branch_is_clean', return_value=False)
-    @mock.patch('nacl.git.print_merge_status', return_value='baz')
+    repo_status_dirty = {
+        'branch': 'foo',
+        'dirty': True,
+        'changes': [' M status', '?? bar'],
+        'pull_push': 'Yes',
+        'all_branches': ['a', 'b'],
+        'merged': True}
+
+    @mock.patch('nacl.git.get_repo_status', return_value=repo_status_dirty)
     @mock.patch('os.getcwd', return_value='/foo/bar')
-    def test_pretty_status_2(self,
-                             mock_getcwd,
-                             mock_ms,
-                             mock_bic,
-                             mock_gab,
-                             mock_npp,
-                             mock_git,
-                             mock_gcb):
-        self.assertEquals({'status': 'M status', 'dir_name': '/foo/bar', 'pull_push': 'Yes', 'all_branches': 'a, b', 'branch': 'foo', 'merge_status': 'baz'}, pretty_status._fn())
-
-    # print_merge_status()
-    @mock.patch('nacl.git.is_merged', return_value=True)
-    def test_print_merge_status_1(self, mock):
-        self.assertEquals('(merged)', print_merge_status('foo'))
-
-    @mock.patch('nacl.git.is_merged', return_value=False)
-    def test_print_merge_status_2(self, mock):
-        self.assertEquals('(unmerged)', print_merge_status('foo'))
+    def test_pretty_status_2(self, mock_getcwd, mock_grs):
+        self.assertEquals({'status': ' M status', 'dir_name': '/foo/bar', 'pull_push': 'Yes', 'all_branches': 'a, b', 'branch': 'foo', 'merge_status': '(merged)'}, pretty_status._fn())
+
+    # ahead_behind_to_answer()
+    def test_ahead_behind_to_answer(self):
+        self.assertEquals('Up-to-date', ahead_behind_to_answer(0, 0))
+        self.assertEquals('Need to pull', ahead_behind_to_answer(0, 2))
+        self.assertEquals('Need to push', ahead_behind_to_answer(1, 0))
+        self.assertEquals('Diverged', ahead_behind_to_answer(1, 2))
+
+    # parse_status_porcelain()
+    porcelain_v2 = (
+        '# branch.oid aaaabbbbcccc\n'
+        '# branch.head issue_1\n'
+        '# branch.upstream origin/master\n'
+        '# branch.ab +1 -2\n'
+        '1 .M N... 100644 100644 100644 aaa aaa init.sls\n'
+        '2 R. N... 100644 100644 100644 aaa aaa R100 new.sls\told.sls\n'
+        '? untracked.sls\n')
+
+    def test_parse_status_porcelain(self):
+        self.assertEquals({'branch': 'issue_1',
+                           'head': 'aaaabbbbcccc',
+                           'upstream': 'origin/master',
+                           'ahead': 1,
+                           'behind': 2,
+                           'dirty': True,
+                           'changes': [' M init.sls',
+                                       'R  old.sls -> new.sls',
+                                       '?? untracked.sls']},
+                          parse_status_porcelain(self.porcelain_v2))
+
+    # untracked files only, detached HEAD and no upstream
+    def test_parse_status_porcelain_clean(self):
+        status = parse_status_porcelain('# branch.oid aaaa\n'
+                                        '# branch.head (detached)\n'
+                                        '? untracked.sls\n')
+        self.assertEquals('HEAD', status['branch'])
+        self.assertEquals(None, status['upstream'])
+        self.assertEquals(None, status['ahead'])
+        self.assertFalse(status['dirty'])
+
+    # unborn branch: there is no HEAD sha yet
+    def test_parse_status_porcelain_initial(self):
+        status = parse_status_porcelain('# branch.oid (initial)\n'
+                                        '# branch.head master\n')
+        self.assertEquals('master', status['branch'])
+        self.assertEquals(None, status['head'])
+
+    # parse_branch_refs()
+    def test_parse_branch_refs(self):
+        self.assertEquals([('issue_1', 'origin/master', 3, 0),
+                           ('master', 'origin/master', 0, 0),
+                           ('old', 'origin/old', None, None),
+                           ('test', None, None, None)],
+                          parse_branch_refs('issue_1\torigin/master\tahead 3\n'
+                                            'master\torigin/master\t\n'
+                                            'old\torigin/old\tgone\n'
+                                            'test\t\t\n'))
+
+    # get_repo_status()
+    def git_status_side_effect(args):
+        if args[0] == 'status':
+            return ('# branch.oid aaaa\n'
+                    '# branch.head master\n'
+                    '# branch.upstream origin/master\n'
+                    '# branch.ab +0 -2\n')
+        if args[0] == 'for-each-ref':
+            return 'issue_1\torigin/master\tahead 1\nmaster\torigin/master\tbehind 2\n'
+        return ''
+
+    # master is active: no further git calls needed
+    @mock.patch('nacl.git.fetch_is_fresh', return_value=True)
+    @mock.patch('nacl.git.git', side_effect=git_status_side_effect)
+    def test_get_repo_status_master(self, mock_git, mock_fif):
+        status = get_repo_status()
+        self.assertEquals('Need to pull', status['pull_push'])
+        self.assertEquals(['issue_1', 'master'], status['all_branches'])
+        self.assertEquals(None, status['merged'])
+        # fetch is fresh: no 'git remote update'
+        self.assertEquals(2, mock_git.call_count)
+
+    def git_status_side_effect_branch(args):
+        if args[0] == 'status':
+            return ('# branch.oid aaaa\n'
+                    '# branch.head issue_1\n'
+                    '# branch.upstream origin/master\n'
+                    '# branch.ab +0 -0\n')
+        if args[0] == 'for-each-ref':
+            return 'issue_1\torigin/master\t\nmaster\t\t\n'
+        if args[0] == 'rev-list':
+            return '1\t0\n'
+        return ''
+
+    # master is not active and does not track origin/master
+    @mock.patch('nacl.git.fetch_is_fresh', return_value=False)
+    @mock.patch('nacl.git.git', side_effect=git_status_side_effect_branch)
+    def test_get_repo_status_branch(self, mock_git, mock_fif):
+        status = get_repo_status()
+        self.assertEquals('Need to push', status['pull_push'])
+        self.assertTrue(status['merged'])
+        self.assertEquals(4, mock_git.call_count)
+
+    def git_status_side_effect_initial(args):
+        if args[0] == 'status':
+            return ('# branch.oid (initial)\n'
+                    '# branch.head master\n')
+        if args[0] == 'rev-list':
+            return '0\t1\n'
+        return ''
+
+    # unborn master: the HEAD sha is None, git is not asked for it
+    @mock.patch('nacl.git.fetch_is_fresh', return_value=True)
+    @mock.patch('nacl.git.git', side_effect=git_status_side_effect_initial)
+    def test_get_repo_status_initial(self, mock_git, mock_fif):
+        repo = Repo()
+        get_repo_status(repo)
+        self.assertEquals(None, repo.head_sha)
+        self.assertEquals(3, mock_git.call_count)
 
 if __name__ == '__main__':
     unittest.main()
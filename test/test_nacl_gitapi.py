@@ -2,8 +2,14 @@
 # -*- coding: utf-8 -*-
 import unittest
 import mock
+import nacl.helper
 from nacl.gitapi import get_gitgitlab_handle
 from nacl.gitapi import get_remote_url_dict
+from nacl.gitapi import get_all_pages
+from nacl.gitapi import normalize_git_url
+from nacl.gitapi import get_group_id
+from nacl.gitapi import forget_ids
+from vendor.gitlab.exceptions import HttpError
 
 
 class TestNaclGitApi(unittest.TestCase):
@@ -11,8 +17,10 @@ class TestNaclGitApi(unittest.TestCase):
     # get_gitgitlab_handle()
 
     @mock.patch('vendor.gitlab.Gitlab', return_value='foo')
-    def test_get_gitlab_handle(self, mock):
+    @mock.patch('nacl.gitapi.get_http_session')
+    def test_get_gitlab_handle(self, mock_ghs, mock):
         self.assertEquals('foo', get_gitgitlab_handle('bar', 'baz'))
+        self.assertIs(mock_ghs.return_value, mock.call_args[1]['session'])
 
     # get_remote_url_dict()
 
@@ -29,32 +37,19 @@ class TestNaclGitApi(unittest.TestCase):
         'gitgroup': 'u_saltstack'
     }
 
-    # Mocking git.getgroups() the hard way
+    # Mocking the paginated API calls
+    def return_pages(git, url, params={}):
+        if url.endswith('/groups'):
+            return [{'name': 'saltstack_foo', 'id': 1},
+                    {'name': 'saltstack', 'id': 123}]
+        if url.endswith('/groups/123/projects'):
+            return [{'ssh_url_to_repo': 'ssh_url', 'description': 'foo'}]
+        raise ValueError(url)
+
     def return_handle(host, token):
-        class Foo:
-            def getgroups(self, group_id=None):
-                sample_group = [{
-                    'name': 'saltstack',
-                    'id': 123,
-                    'projects': [{
-                        'ssh_url_to_repo': 'ssh_url',
-                        'description': 'foo'
-                    }]
-                }]
-
-                sample_projects = {
-                    'name': 'saltstack',
-                    'id': 123,
-                    'projects': [{
-                        'ssh_url_to_repo': 'ssh_url',
-                        'description': 'foo'
-                    }]
-                }
-                if group_id:
-                    return sample_projects
-                else:
-                    return sample_group
-        return Foo()
+        git = mock.Mock()
+        git.groups_url = 'https://server/api/v3/groups'
+        return git
 
     @mock.patch("nacl.gitapi.get_users_nacl_conf",
                 return_value=sample_user_config_1)
@@ -78,7 +73,13 @@ class TestNaclGitApi(unittest.TestCase):
     @mock.patch("nacl.gitapi.get_users_nacl_conf",
                 return_value=sample_user_config_1)
     @mock.patch('nacl.gitapi.get_gitgitlab_handle', side_effect=return_handle)
+    @mock.patch('nacl.gitapi.get_all_pages', side_effect=return_pages)
+    @mock.patch('nacl.gitapi.load_cache', return_value=None)
+    @mock.patch('nacl.gitapi.save_cache')
     def test_get_remote_url_dict_group(self,
+                                       mock_sc,
+                                       mock_lc,
+                                       mock_gap,
                                        mock_config,
                                        mock_handle):
         self.assertEqual({'payload': {'ssh_url': 'foo'}},
@@ -89,11 +90,108 @@ class TestNaclGitApi(unittest.TestCase):
     @mock.patch("nacl.gitapi.get_users_nacl_conf",
                 return_value=sample_user_config_2)
     @mock.patch('nacl.gitapi.get_gitgitlab_handle', side_effect=return_handle)
+    @mock.patch('nacl.gitapi.get_all_pages', side_effect=return_pages)
+    @mock.patch('nacl.gitapi.load_cache', return_value=None)
+    @mock.patch('nacl.gitapi.save_cache')
     def test_get_remote_url_dict_unknown_group(self,
+                                               mock_sc,
+                                               mock_lc,
+                                               mock_gap,
                                                mock_config,
                                                mock_handle):
         self.assertEqual([('FAIL', 'Git group not found: u_saltstack', 1)],
                          get_remote_url_dict._fn())
 
+    # get_all_pages()
+
+    def response(self, items, total_pages=None):
+        request = mock.Mock(status_code=200, headers={})
+        request.json.return_value = items
+        if total_pages:
+            request.headers['X-Total-Pages'] = str(total_pages)
+        return request
+
+    @mock.patch('nacl.gitapi.get_http_pool_size', return_value=10)
+    def test_get_all_pages(self, mock_ghps):
+        git = mock.Mock()
+        mock_get = git.session.get
+        mock_get.side_effect = lambda url, params, headers, verify: \
+            self.response([params['page']], 3)
+        self.assertEqual([1, 2, 3], get_all_pages(git, 'url', {'simple': 'true'}))
+        self.assertEqual(3, mock_get.call_count)
+        self.assertEqual({'simple': 'true', 'page': 3, 'per_page': 100},
+                         mock_get.call_args[1]['params'])
+
+    # Not more pages at once than the HTTP session has connections
+    @mock.patch('nacl.gitapi.get_http_pool_size', return_value=2)
+    @mock.patch('nacl.gitapi.thread_map', side_effect=nacl.helper.thread_map)
+    def test_get_all_pages_pool_size(self, mock_tm, mock_ghps):
+        git = mock.Mock()
+        git.session.get.side_effect = lambda url, params, headers, verify: \
+            self.response([params['page']], 5)
+        self.assertEqual([1, 2, 3, 4, 5], get_all_pages(git, 'url'))
+        self.assertEqual(2, mock_tm.call_args[0][2])
+
+    # Without X-Total-Pages: until a page is not full
+    def test_get_all_pages_without_total(self):
+        git = mock.Mock()
+        git.session.get.side_effect = [self.response(range(100)),
+                                       self.response(range(100)),
+                                       self.response(range(5))]
+        self.assertEqual(205, len(get_all_pages(git, 'url')))
+
+    def test_get_all_pages_fails(self):
+        git = mock.Mock()
+        git.session.get.return_value = mock.Mock(status_code=401)
+        self.assertRaises(HttpError, get_all_pages, git, 'url')
+
+    # get_group_id()
+
+    @mock.patch('nacl.gitapi.get_all_pages',
+                return_value=[{'name': 'saltstack_foo', 'id': 1},
+                              {'name': 'saltstack', 'id': 123}])
+    @mock.patch('nacl.gitapi.load_cache', return_value={
+        'https://other': {'groups': {'saltstack': 7}}})
+    @mock.patch('nacl.gitapi.save_cache')
+    def test_get_group_id(self, mock_sc, mock_lc, mock_gap):
+        git = mock.Mock(host='https://git')
+        self.assertEqual(123, get_group_id(git, 'saltstack'))
+        mock_sc.assert_called_with('gitlab_ids', {
+            'https://other': {'groups': {'saltstack': 7}},
+            'https://git': {'groups': {'saltstack': 123}}})
+
+    @mock.patch('nacl.gitapi.get_all_pages')
+    @mock.patch('nacl.gitapi.load_cache', return_value={
+        'https://git': {'groups': {'saltstack': 7}}})
+    def test_get_group_id_cached(self, mock_lc, mock_gap):
+        self.assertEqual(7, get_group_id(mock.Mock(host='https://git'), 'saltstack'))
+        self.assertFalse(mock_gap.called)
+
+    # forget_ids()
+
+    @mock.patch('nacl.gitapi.load_cache', return_value={
+        'https://git': {'groups': {'saltstack': 7}},
+        'https://other': {'groups': {'saltstack': 8}}})
+    @mock.patch('nacl.gitapi.save_cache')
+    def test_forget_ids(self, mock_sc, mock_lc):
+        forget_ids('https://git')
+        mock_sc.assert_called_with('gitlab_ids', {
+            'https://other': {'groups': {'saltstack': 8}}})
+        forget_ids()
+        mock_sc.assert_called_with('gitlab_ids', {})
+
+    # normalize_git_url()
+
+    def test_normalize_git_url(self):
+        for url in ['git@Git.Example.com:salt/foo.git',
+                    'ssh://git@git.example.com:2222/salt/foo.git',
+                    'https://git.example.com/salt/foo.git',
+                    'http://user@git.example.com:80/salt/foo/']:
+            self.assertEqual('git.example.com/salt/foo', normalize_git_url(url))
+
+    def test_normalize_git_url_path(self):
+        self.assertEqual('/srv/foo.git', normalize_git_url('/srv/foo.git'))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+from nacl.gitconfig import parse_config
+from nacl.gitconfig import get_origin_url
+from nacl.exceptions import ConfigReadError
+
+
+class TestNaclGitConfig(unittest.TestCase):
+
+    def setUp(self):
+        self.work_tree = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.work_tree)
+        self.git_dir = os.path.join(self.work_tree, '.git')
+        self.git('init', '-q')
+
+    def git(self, *args):
+        env = dict(os.environ,
+                   GIT_AUTHOR_NAME='nacl', GIT_AUTHOR_EMAIL='nacl@example.com',
+                   GIT_COMMITTER_NAME='nacl', GIT_COMMITTER_EMAIL='nacl@example.com')
+        return subprocess.Popen(['git', '-C', self.work_tree] + list(args),
+                                stdout=subprocess.PIPE,
+                                env=env).communicate()[0].strip()
+
+    def append_config(self, content, name='config'):
+        with open(os.path.join(self.git_dir, name), 'a') as config:
+            config.write(content)
+
+    # parse_config()
+
+    def test_parse_config(self):
+        content = ('# comment\n'
+                   '[Core]\n'
+                   '\tBare = false ; comment\n'
+                   '\tquotepath\n'
+                   '[remote "Origin"] url = git@foo:bar.git\n'
+                   '[branch.Master]\n'
+                   '  remote = "  a \\"b\\"" c # d\n'
+                   '  merge = refs/\\\n'
+                   'heads/master\n')
+        self.assertEqual([('core.bare', 'false'),
+                          ('core.quotepath', True),
+                          ('remote.Origin.url', 'git@foo:bar.git'),
+                          ('branch.master.remote', '  a "b" c'),
+                          ('branch.master.merge', 'refs/heads/master')],
+                         parse_config(content))
+
+    def test_parse_config_broken(self):
+        for content in ['url = foo\n', '[core]\n  = foo\n',
+                        '[core]\n  foo = "bar\n', '[core]\n  foo = \\x\n']:
+            self.assertRaises(ConfigReadError, parse_config, content)
+
+    # get_origin_url()
+
+    def test_get_origin_url(self):
+        self.assertEqual('', get_origin_url(self.git_dir))
+        self.git('remote', 'add', 'origin', 'git@git.example.com:salt/foo.git')
+        self.assertEqual(self.git('config', '--get', 'remote.origin.url'),
+                         get_origin_url(self.git_dir))
+
+    def test_get_origin_url_include(self):
+        self.git('remote', 'add', 'origin', 'git@git.example.com:salt/foo.git')
+        self.append_config('[remote "origin"]\n\turl = git@bar.git\n', 'remotes')
+        self.append_config('[include]\n\tpath = remotes\n\tpath = missing\n')
+        self.assertEqual('git@bar.git', self.git('config', '--get', 'remote.origin.url'))
+        self.assertEqual('git@bar.git', get_origin_url(self.git_dir))
+
+    def test_get_origin_url_include_if(self):
+        self.append_config('[includeIf "gitdir:/foo/"]\n\tpath = remotes\n')
+        self.assertRaises(ConfigReadError, get_origin_url, self.git_dir)
+
+    def test_get_origin_url_worktree(self):
+        self.git('remote', 'add', 'origin', 'git@git.example.com:salt/foo.git')
+        self.git('commit', '-q', '--allow-empty', '-m', 'one')
+        worktree = os.path.join(self.work_tree, 'wt')
+        self.git('worktree', 'add', '-q', '-b', 'foo', worktree)
+        self.assertEqual('git@git.example.com:salt/foo.git',
+                         get_origin_url(os.path.join(self.git_dir, 'worktrees', 'wt')))
+
+    def test_get_origin_url_worktree_config(self):
+        self.git('config', 'extensions.worktreeConfig', 'true')
+        self.git('config', '--worktree', 'remote.origin.url', 'git@wt.git')
+        self.assertEqual('git@wt.git', get_origin_url(self.git_dir))
+
+    def test_get_origin_url_no_repository(self):
+        self.assertRaises(ConfigReadError, get_origin_url,
+                          os.path.join(self.work_tree, 'foo'))
+
+
+if __name__ == '__main__':
+    unittest.main()
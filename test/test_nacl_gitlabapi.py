@@ -34,43 +34,86 @@ class TestNaclGitLapApiCall(unittest.TestCase):
     @mock.patch(
         "nacl.gitlabapi.get_users_nacl_conf",
         side_effect=[fake_config])
-    @mock.patch('nacl.gitlabapi.GitLapApiCall.get_project_id',
-                return_value=123)
-    def setUp(self, config_mock, mock_pid):
+    @mock.patch('nacl.gitlabapi.get_http_session')
+    def setUp(self, mock_ghs, config_mock):
         self.git = GitLapApiCall()
+        self.git.p_id = 123
+
+    # __init__()
+
+    # All calls share one HTTP session
+    @mock.patch("nacl.gitlabapi.get_users_nacl_conf",
+                side_effect=[fake_config])
+    @mock.patch('nacl.gitlabapi.get_http_session')
+    def test_init_session(self, mock_ghs, mock_guc):
+        mock_ghs.return_value.verify = False
+        git = GitLapApiCall()
+        self.assertIs(mock_ghs.return_value, git.session)
+        self.assertFalse(git.verify_ssl)
+        git.session.get.return_value = mock.Mock(status_code=200, content='{"id": 1}')
+        self.assertEqual({'id': 1}, git.getproject(1))
 
     # get_project_id
-    @mock.patch("nacl.git.git",
-                side_effect=["http://gitlab.example.com/foo.git"])
+    @mock.patch("nacl.git.Repo.origin_url", new_callable=mock.PropertyMock,
+                return_value="http://gitlab.example.com/foo.git")
     @mock.patch("nacl.gitlabapi.GitLapApiCall.getproject",
                 return_value={'id': 22})
     @mock.patch("nacl.git.is_git_repo", return_value=True)
+    @mock.patch('nacl.gitapi.load_cache', return_value=None)
+    @mock.patch('nacl.gitapi.save_cache')
     def test_get_project_id_success(self,
-                                    mock_git,
+                                    mock_sc,
+                                    mock_lc,
+                                    mock_is_git,
                                     mock_getproject,
-                                    is_git_mock):
+                                    mock_url):
         self.assertEqual(self.git.get_project_id(), 22)
-
-    @mock.patch("nacl.git.git",
-                side_effect=["http://gitlab.example.com/foo.git"])
+        mock_getproject.assert_called_with('foo')
+        mock_sc.assert_called_with('gitlab_ids', {
+            'http://gitlab.example.com': {
+                'projects': {'http://gitlab.example.com/foo.git': 22}}})
+
+    # Known urls are not looked up again
+    @mock.patch("nacl.git.Repo.origin_url", new_callable=mock.PropertyMock,
+                return_value="http://gitlab.example.com/foo.git")
+    @mock.patch("nacl.gitlabapi.GitLapApiCall.getproject")
+    @mock.patch("nacl.git.is_git_repo", return_value=True)
+    @mock.patch('nacl.gitapi.load_cache', return_value={
+        'http://gitlab.example.com': {
+            'projects': {'http://gitlab.example.com/foo.git': 33}}})
+    def test_get_project_id_cached(self,
+                                   mock_lc,
+                                   mock_is_git,
+                                   mock_getproject,
+                                   mock_url):
+        self.assertEqual(self.git.get_project_id(), 33)
+        self.assertFalse(mock_getproject.called)
+
+    @mock.patch("nacl.git.Repo.origin_url", new_callable=mock.PropertyMock,
+                return_value="http://gitlab.example.com/foo.git")
     @mock.patch("nacl.gitlabapi.GitLapApiCall.getproject",
                 return_value=False)
     @mock.patch("nacl.git.is_git_repo", return_value=True)
+    @mock.patch('nacl.gitapi.load_cache', return_value=None)
+    @mock.patch('nacl.gitapi.save_cache')
     def test_get_project_id_false(self,
-                                  mock_git,
+                                  mock_sc,
+                                  mock_lc,
+                                  mock_is_git,
                                   mock_getproject,
-                                  mock_is_git):
+                                  mock_url):
         self.assertFalse(self.git.get_project_id())
+        self.assertFalse(mock_sc.called)
 
-    @mock.patch("nacl.git.git",
-                side_effect=["http://gitlab.example.com/foo.git"])
+    @mock.patch("nacl.git.Repo.origin_url", new_callable=mock.PropertyMock,
+                return_value="http://gitlab.example.com/foo.git")
     @mock.patch("nacl.gitlabapi.GitLapApiCall.getproject",
                 return_value={'id': 22})
     @mock.patch("nacl.git.is_git_repo", return_value=False)
     def test_get_project_id_sys_exit(self,
-                                     mock_git,
+                                     mock_is_git,
                                      mock_getproject,
-                                     mock_is_git):
+                                     mock_url):
         self.assertRaises(SystemExit, self.git.get_project_id)
 
     # _get_seperator()
@@ -81,21 +124,70 @@ class TestNaclGitLapApiCall(unittest.TestCase):
     # Test an https:// URL
     @mock.patch('nacl.gitlabapi.get_users_nacl_conf',
                 side_effect=[fake_config_2])
-    @mock.patch('nacl.gitlabapi.GitLapApiCall.get_project_id',
-                return_value=123)
-    def test_get_seperator_https(self, mock_gpi, mock):
+    @mock.patch('nacl.gitlabapi.get_http_session')
+    def test_get_seperator_https(self, mock_ghs, mock):
         self.git = GitLapApiCall()
         self.assertEqual(self.git._get_seperator(), 'gitlab.other.com')
 
+    # get_projects()
+
+    @mock.patch("nacl.gitlabapi.GitLapApiCall.getproject",
+                side_effect=lambda project_id: {
+                    'id': project_id, 'web_url': 'url', 'description': 'foo'})
+    @mock.patch('nacl.gitlabapi.load_cache', return_value=None)
+    @mock.patch('nacl.gitlabapi.save_cache')
+    @mock.patch('time.time', return_value=1000)
+    def test_get_projects(self, mock_time, mock_sc, mock_lc, mock_gp):
+        project = {'web_url': 'url', 'description': 'foo'}
+        self.assertEqual({1: project, 2: project},
+                         self.git.get_projects([1, 2, 1, 1]))
+        self.assertEqual(2, mock_gp.call_count)
+        mock_sc.assert_called_with('projects', {
+            'http://gitlab.example.com': {
+                '1': {'time': 1000, 'project': project},
+                '2': {'time': 1000, 'project': project}}})
+
+    # Cached projects are used until they are too old
+    @mock.patch("nacl.gitlabapi.GitLapApiCall.getproject",
+                return_value={'web_url': 'new', 'description': 'foo'})
+    @mock.patch('nacl.gitlabapi.load_cache', return_value={
+        'http://gitlab.example.com': {
+            '1': {'time': 1000, 'project': {'web_url': 'cached'}},
+            '2': {'time': 1000 - 24 * 60 * 60, 'project': {'web_url': 'old'}}}})
+    @mock.patch('nacl.gitlabapi.save_cache')
+    @mock.patch('time.time', return_value=1000)
+    def test_get_projects_cached(self, mock_time, mock_sc, mock_lc, mock_gp):
+        projects = self.git.get_projects([1, 2])
+        self.assertEqual('cached', projects[1]['web_url'])
+        self.assertEqual('new', projects[2]['web_url'])
+        mock_gp.assert_called_once_with(2)
+
+    @mock.patch("nacl.gitlabapi.GitLapApiCall.getproject", return_value=False)
+    @mock.patch('nacl.gitlabapi.load_cache', return_value=None)
+    @mock.patch('nacl.gitlabapi.save_cache')
+    def test_get_projects_not_found(self, mock_sc, mock_lc, mock_gp):
+        self.assertEqual({}, self.git.get_projects([1]))
+
+    # Not more calls at once than the HTTP session has connections
+    @mock.patch('nacl.gitlabapi.thread_map', return_value=[False] * 5)
+    @mock.patch('nacl.gitlabapi.load_cache', return_value=None)
+    @mock.patch('nacl.gitlabapi.save_cache')
+    def test_get_projects_pool_size(self, mock_sc, mock_lc, mock_tm):
+        self.git.get_projects(range(5))
+        self.assertEqual(5, mock_tm.call_args[0][2])
+
+        self.git.config = dict(self.fake_config, http_pool_size=2)
+        self.git.get_projects(range(5))
+        self.assertEqual(2, mock_tm.call_args[0][2])
+
     # get_group_id
-    @mock.patch("nacl.gitlabapi.GitLapApiCall.getgroups",
-                return_value=[{'name': 'saltstack', 'id': 6}])
-    def test_get_group_id_success(self, mock_getgroups):
+    @mock.patch("nacl.gitapi.get_group_id", return_value=6)
+    def test_get_group_id_success(self, mock_ggi):
         self.assertEqual(self.git.get_group_id(), 6)
+        mock_ggi.assert_called_with(self.git, 'saltstack')
 
-    @mock.patch("nacl.gitlabapi.GitLapApiCall.getgroups",
-                return_value=[{'name': 'saltstack'}])
-    def test_get_group_id_false(self, mock_getgroups):
+    @mock.patch("nacl.gitapi.get_group_id", return_value=None)
+    def test_get_group_id_false(self, mock_ggi):
         self.assertFalse(self.git.get_group_id())
 
     # is_mergerequest_new
@@ -160,24 +252,27 @@ class TestNaclGitLapApiCall(unittest.TestCase):
     def test_is_mergerequest_open(self):
         self.assertRaises(ValueError, self.git.is_mergerequest_open)
 
-    mergerequest_details = {'changes': {'state': 'opened'}}
+    mergerequest_details = {'state': 'opened'}
 
-    @mock.patch("nacl.gitlabapi.GitLapApiCall.get_mergerequest_details",
+    # Only the mergerequest itself is fetched, no diffs
+    @mock.patch("nacl.gitlabapi.GitLapApiCall.getmergerequestchanges")
+    @mock.patch("nacl.gitlabapi.GitLapApiCall.getmergerequest",
                 return_value=mergerequest_details)
-    def test_is_mergerequest_open_true(self, mock):
+    def test_is_mergerequest_open_true(self, mock, mock_changes):
         self.assertTrue(self.git.is_mergerequest_open(1))
+        mock.assert_called_with(123, 1)
+        self.assertFalse(mock_changes.called)
 
-    mergerequest_details_2 = {'changes': {'state': 'closed'}}
+    mergerequest_details_2 = {'state': 'closed'}
 
-    @mock.patch("nacl.gitlabapi.GitLapApiCall.get_mergerequest_details",
+    @mock.patch("nacl.gitlabapi.GitLapApiCall.getmergerequest",
                 return_value=mergerequest_details_2)
     def test_is_mergerequest_open_false(self, mock):
         self.assertFalse(self.git.is_mergerequest_open(1))
 
-    mergerequest_details_3 = {}
-
-    @mock.patch("nacl.gitlabapi.GitLapApiCall.get_mergerequest_details",
-                return_value=mergerequest_details_3)
+    # Not found
+    @mock.patch("nacl.gitlabapi.GitLapApiCall.getmergerequest",
+                return_value=False)
     def test_is_mergerequest_open_false_2(self, mock):
         self.assertFalse(self.git.is_mergerequest_open(1))
 
@@ -222,21 +317,38 @@ class TestNaclGitLapApiCall(unittest.TestCase):
         'id': 1
     }]
 
-    @mock.patch("nacl.gitlabapi.GitLapApiCall.get_all_issues",
+    @mock.patch("nacl.gitlabapi.GitLapApiCall.getprojectissues",
                 return_value=all_project_issues)
-    def test_issue_iid_to_uid_id__returned(self, mock):
+    @mock.patch('nacl.gitlabapi.load_cache', return_value=None)
+    @mock.patch('nacl.gitlabapi.save_cache')
+    def test_issue_iid_to_uid_id__returned(self, mock_sc, mock_lc, mock):
         self.assertEqual(self.git.issue_iid_to_uid(11), 1)
+        mock.assert_called_with(123, iid=11)
+        mock_sc.assert_called_with('iids', {
+            'http://gitlab.example.com 123': {'issues': {'11': 1}}})
 
-    @mock.patch("nacl.gitlabapi.GitLapApiCall.get_all_issues",
-                return_value=all_project_issues)
-    def test_issue_iid_to_uid_id_not_found(self, mock):
+    @mock.patch("nacl.gitlabapi.GitLapApiCall.getprojectissues",
+                return_value=[])
+    @mock.patch('nacl.gitlabapi.load_cache', return_value=None)
+    @mock.patch('nacl.gitlabapi.save_cache')
+    def test_issue_iid_to_uid_id_not_found(self, mock_sc, mock_lc, mock):
         self.assertFalse(self.git.issue_iid_to_uid(22))
+        self.assertFalse(mock_sc.called)
 
     # a string is given and strings can not be project id's
-    @mock.patch("nacl.gitlabapi.GitLapApiCall.get_all_issues",
+    @mock.patch("nacl.gitlabapi.GitLapApiCall.getprojectissues",
                 return_value=all_project_issues)
     def test_issue_iid_to_uid_string_given(self, mock):
         self.assertFalse(self.git.issue_iid_to_uid('aa'))
+        self.assertFalse(mock.called)
+
+    # Known iids are not looked up again
+    @mock.patch("nacl.gitlabapi.GitLapApiCall.getprojectissues")
+    @mock.patch('nacl.gitlabapi.load_cache', return_value={
+        'http://gitlab.example.com 123': {'issues': {'11': 1}}})
+    def test_issue_iid_to_uid_cached(self, mock_lc, mock):
+        self.assertEqual(self.git.issue_iid_to_uid('11'), 1)
+        self.assertFalse(mock.called)
 
     # mergerequest_iid_to_id()
 
@@ -250,12 +362,17 @@ class TestNaclGitLapApiCall(unittest.TestCase):
 
     @mock.patch("nacl.gitlabapi.GitLapApiCall.getmergerequests",
                 return_value=all_project_mr)
-    def test_mergerequest_id__returned(self, mock):
+    @mock.patch('nacl.gitlabapi.load_cache', return_value=None)
+    @mock.patch('nacl.gitlabapi.save_cache')
+    def test_mergerequest_id__returned(self, mock_sc, mock_lc, mock):
         self.assertEqual(self.git.mergerequest_iid_to_id(11), 1)
+        mock.assert_called_with(123, iid=11)
 
     @mock.patch("nacl.gitlabapi.GitLapApiCall.getmergerequests",
-                return_value=all_project_mr)
-    def test_mergerequest_id_not_found(self, mock):
+                return_value=False)
+    @mock.patch('nacl.gitlabapi.load_cache', return_value=None)
+    @mock.patch('nacl.gitlabapi.save_cache')
+    def test_mergerequest_id_not_found(self, mock_sc, mock_lc, mock):
         self.assertFalse(self.git.mergerequest_iid_to_id(22))
 
     # a string is given and strings can not be MR id's
@@ -264,6 +381,40 @@ class TestNaclGitLapApiCall(unittest.TestCase):
     def test_mergerequest_string_given(self, mock):
         self.assertFalse(self.git.mergerequest_iid_to_id('aa'))
 
+    # Known iids of other projects don't count
+    @mock.patch("nacl.gitlabapi.GitLapApiCall.getmergerequests",
+                return_value=all_project_mr)
+    @mock.patch('nacl.gitlabapi.load_cache', return_value={
+        'http://gitlab.example.com 124': {'merge_requests': {'11': 2}}})
+    @mock.patch('nacl.gitlabapi.save_cache')
+    def test_mergerequest_id_other_project(self, mock_sc, mock_lc, mock):
+        self.assertEqual(self.git.mergerequest_iid_to_id(11), 1)
+
+    # MergeRequest
+
+    @mock.patch("nacl.gitlabapi.GitLapApiCall.getmergerequest",
+                return_value={'state': 'opened'})
+    @mock.patch("nacl.gitlabapi.GitLapApiCall.getmergerequestchanges",
+                return_value={'state': 'merged', 'changes': []})
+    @mock.patch("nacl.gitlabapi.GitLapApiCall.getmergerequestcomments",
+                return_value=[])
+    def test_mergerequest_tiers(self, mock_comments, mock_changes, mock_mr):
+        mergerequest = self.git.get_mergerequest(1)
+        self.assertIs(mergerequest, self.git.get_mergerequest(1))
+        self.assertFalse(mock_mr.called)
+
+        self.assertEqual('opened', mergerequest.state)
+        self.assertEqual('opened', mergerequest.state)
+        self.assertEqual(1, mock_mr.call_count)
+        self.assertFalse(mock_changes.called)
+        self.assertFalse(mock_comments.called)
+
+        # Once the changes are there, they are up to date data as well
+        self.assertEqual([], mergerequest.changes['changes'])
+        self.assertEqual('merged', mergerequest.state)
+        self.assertEqual(1, mock_mr.call_count)
+        self.assertFalse(mock_comments.called)
+
     # get_mergerequest_details()
 
     @mock.patch("nacl.gitlabapi.GitLapApiCall.getmergerequestchanges",
@@ -280,16 +431,48 @@ class TestNaclGitLapApiCall(unittest.TestCase):
                                       mock_is_git):
         self.assertEqual(self.git.get_mergerequest_details(1), {'changes': 'foo', 'comments': 'bar'})
 
+    # Fetched once, until the mergerequest is changed
+    @mock.patch("nacl.gitlabapi.GitLapApiCall.getmergerequestchanges",
+                return_value='foo')
+    @mock.patch("nacl.gitlabapi.GitLapApiCall.getmergerequestcomments",
+                return_value='bar')
+    @mock.patch("vendor.gitlab.Gitlab.addcommenttomergerequest",
+                return_value=True)
+    def test_get_mergerequest_details_cached(self,
+                                             mock_comment,
+                                             mock_get_mr_comments,
+                                             mock_get_mr_changes):
+        self.git.get_mergerequest_details(1)
+        self.git.get_mergerequest_details(1)
+        self.assertEqual(1, mock_get_mr_changes.call_count)
+        self.git.get_mergerequest_details(2)
+        self.assertEqual(2, mock_get_mr_changes.call_count)
+
+        self.assertTrue(self.git.addcommenttomergerequest(123, 1, 'foo'))
+        self.git.get_mergerequest_details(1)
+        self.git.get_mergerequest_details(2)
+        self.assertEqual(3, mock_get_mr_comments.call_count)
+
+    @mock.patch("nacl.gitlabapi.GitLapApiCall.getmergerequestchanges",
+                return_value=False)
+    @mock.patch("nacl.gitlabapi.GitLapApiCall.getmergerequestcomments",
+                return_value=False)
+    def test_get_mergerequest_details_not_found(self,
+                                                mock_get_mr_comments,
+                                                mock_get_mr_changes):
+        self.git.get_mergerequest_details(1)
+        self.git.get_mergerequest_details(1)
+        self.assertEqual(2, mock_get_mr_changes.call_count)
+
     # mr_is_mergeable()
     def test_mr_is_mergeable_raises(self):
         self.assertRaises(ValueError, self.git.mr_is_mergeable)
 
     mergerequest_details_mergeable = {
-        'changes': {
-            'source_branch': 'issue_1',
-            'target_branch': 'issue_1'}}
+        'source_branch': 'issue_1',
+        'target_branch': 'issue_1'}
 
-    @mock.patch("nacl.gitlabapi.GitLapApiCall.get_mergerequest_details",
+    @mock.patch("nacl.gitlabapi.GitLapApiCall.getmergerequest",
                 return_value=mergerequest_details_mergeable)
     @mock.patch("nacl.git.get_current_branch", return_value='master')
     @mock.patch("nacl.git.branch_is_clean", return_value=True)
@@ -301,7 +484,7 @@ class TestNaclGitLapApiCall(unittest.TestCase):
                                   mock_git):
         self.assertTrue(self.git.mr_is_mergeable(666))
 
-    @mock.patch("nacl.gitlabapi.GitLapApiCall.get_mergerequest_details",
+    @mock.patch("nacl.gitlabapi.GitLapApiCall.getmergerequest",
                 return_value=mergerequest_details_mergeable)
     @mock.patch("nacl.git.get_current_branch", return_value='master')
     @mock.patch("nacl.git.branch_is_clean", return_value=False)
@@ -320,7 +503,7 @@ class TestNaclGitLapApiCall(unittest.TestCase):
         else:
             raise ValueError
 
-    @mock.patch("nacl.gitlabapi.GitLapApiCall.get_mergerequest_details",
+    @mock.patch("nacl.gitlabapi.GitLapApiCall.getmergerequest",
                 return_value=mergerequest_details_mergeable)
     @mock.patch("nacl.git.get_current_branch", return_value='master')
     @mock.patch("nacl.git.branch_is_clean", return_value=False)
@@ -333,7 +516,7 @@ class TestNaclGitLapApiCall(unittest.TestCase):
         self.assertFalse(self.git.mr_is_mergeable(666))
 
     # We simulate a failed git merge
-    @mock.patch("nacl.gitlabapi.GitLapApiCall.get_mergerequest_details",
+    @mock.patch("nacl.gitlabapi.GitLapApiCall.getmergerequest",
                 return_value=mergerequest_details_mergeable)
     @mock.patch("nacl.git.get_current_branch", return_value='master')
     @mock.patch("nacl.git.branch_is_clean", return_value=True)
@@ -354,6 +537,14 @@ class TestNaclGitLapApiCall(unittest.TestCase):
     def test_accept_mergerequest_true(self, mock_am):
         self.assertTrue(self.git.accept_mergerequest(666))
 
+    @mock.patch("vendor.gitlab.Gitlab.acceptmergerequest",
+                return_value={'state': 'merged'})
+    def test_accept_mergerequest_forgets_details(self, mock_am):
+        self.git._mergerequests[666] = {'changes': 'foo'}
+        self.git.accept_mergerequest(666)
+        self.assertNotIn(666, self.git._mergerequests)
+        mock_am.assert_called_with(123, 666, None)
+
     # remote_branch_exists()
     def test_remote_branch_exists(self):
         self.assertRaises(ValueError, self.git.remote_branch_exists)
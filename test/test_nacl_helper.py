@@ -1,5 +1,6 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import time
 import unittest
 import mock
 import nacl.helper
@@ -112,5 +113,112 @@ class TestNaclHelper(unittest.TestCase):
     def test_check_int_3(self):
         self.assertFalse(nacl.helper.check_string_to_int('AA'))
 
+    # thread_map()
+
+    def test_thread_map_ordered(self):
+        self.assertEqual([1, 4, 9, 16],
+                         list(nacl.helper.thread_map(lambda x: x * x,
+                                                     [1, 2, 3, 4], 3)))
+
+    def test_thread_map_unordered(self):
+        self.assertEqual([1, 4, 9, 16],
+                         sorted(nacl.helper.thread_map(lambda x: x * x,
+                                                       [1, 2, 3, 4], 3,
+                                                       ordered=False)))
+
+    def test_thread_map_raises(self):
+        def square(x):
+            if x == 3:
+                raise ValueError('foo')
+            return x * x
+        results = nacl.helper.thread_map(square, [1, 2, 3, 4], 2)
+        self.assertEqual([1, 4], [next(results), next(results)])
+        self.assertRaises(ValueError, next, results)
+
+    # Nothing new is started once the caller stops
+    def test_thread_map_stops(self):
+        started = []
+
+        def items():
+            for x in range(100):
+                started.append(x)
+                yield x
+
+        results = nacl.helper.thread_map(lambda x: time.sleep(0.01) or x,
+                                         items(), 2)
+        self.assertEqual(0, next(results))
+        results.close()
+        count = len(started)
+        self.assertLess(count, 100)
+        time.sleep(0.05)
+        self.assertEqual(count, len(started))
+
+    # run_parallel()
+
+    def test_run_parallel(self):
+        self.assertEqual(['a', 'b'],
+                         nacl.helper.run_parallel(lambda: 'a', lambda: 'b'))
+        self.assertEqual([], nacl.helper.run_parallel())
+
+    def test_run_parallel_raises(self):
+        def fail():
+            raise ValueError('foo')
+        self.assertRaises(ValueError, nacl.helper.run_parallel,
+                          lambda: 'a', fail)
+
+    # default_jobs()
+
+    @mock.patch('nacl.helper.cpu_count', return_value=4)
+    def test_default_jobs(self, mock):
+        self.assertEqual(8, nacl.helper.default_jobs())
+
+    # split_lines()
+
+    def test_split_lines(self):
+        self.assertEqual(['a\n', 'b\n', 'c'],
+                         list(nacl.helper.split_lines(['a\nb\n', 'c'])))
+
+    # page()
+
+    # No terminal: just write it out
+    @mock.patch('sys.stdout')
+    def test_page_no_tty(self, mock_stdout):
+        mock_stdout.isatty.return_value = False
+        nacl.helper.page(iter([u'f\xf6\n', 'bar\n']))
+        self.assertEqual([mock.call('f\xc3\xb6\n'), mock.call('bar\n')],
+                         mock_stdout.write.call_args_list)
+
+    @mock.patch.dict('os.environ', {'PAGER': 'cat > /dev/null'})
+    @mock.patch('sys.stdout')
+    def test_page(self, mock_stdout):
+        mock_stdout.isatty.return_value = True
+        lines = iter(['foo\n'] * 1000)
+        nacl.helper.page(lines)
+        # everything went to the pager
+        self.assertEqual([], list(lines))
+        self.assertFalse(mock_stdout.write.called)
+
+    # The pager quits before all lines are written
+    @mock.patch.dict('os.environ', {'PAGER': 'true'})
+    @mock.patch('sys.stdout')
+    def test_page_pager_quits(self, mock_stdout):
+        mock_stdout.isatty.return_value = True
+        consumed = []
+
+        def lines():
+            for x in range(10000):
+                consumed.append(x)
+                yield 'foo\n' * 100
+
+        try:
+            nacl.helper.page(lines())
+        except IOError as e:
+            self.fail('page() raised {0}'.format(e))
+        # The output stopped once the pager was gone: at most a pipe
+        # buffer full of lines was handed over, not all 4MB
+        self.assertLess(len(consumed), 10000)
+        self.assertFalse(mock_stdout.write.called)
+
+
 if __name__ == '__main__':
     unittest.main()
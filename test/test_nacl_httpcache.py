@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+import mock
+import requests
+from nacl.httpcache import CachingSession
+
+
+class TestNaclHttpCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        self.session = CachingSession(os.path.join(self.cache_dir, 'http'))
+
+    def response(self, status_code, content='', headers={}):
+        response = requests.Response()
+        response.status_code = status_code
+        response._content = content
+        response.headers.update(headers)
+        return response
+
+    # request()
+
+    @mock.patch('requests.Session.request')
+    def test_request_revalidated(self, mock_request):
+        mock_request.return_value = self.response(
+            200, '[{"id": 1}]', {'ETag': '"abc"', 'X-Total-Pages': '1'})
+        self.session.get('https://git/api/v3/projects', params={'page': 1},
+                         headers={'PRIVATE-TOKEN': 'foo'})
+        self.assertNotIn('If-None-Match', mock_request.call_args[1]['headers'])
+
+        mock_request.return_value = self.response(304)
+        response = self.session.get('https://git/api/v3/projects',
+                                    params={'page': 1},
+                                    headers={'PRIVATE-TOKEN': 'foo'})
+        self.assertEqual('"abc"',
+                         mock_request.call_args[1]['headers']['If-None-Match'])
+        self.assertEqual(200, response.status_code)
+        self.assertEqual([{'id': 1}], response.json())
+        self.assertEqual('1', response.headers['x-total-pages'])
+
+    @mock.patch('requests.Session.request')
+    def test_request_changed(self, mock_request):
+        mock_request.return_value = self.response(
+            200, '1', {'Last-Modified': 'Mon, 01 Jan 2018 00:00:00 GMT'})
+        self.session.get('https://git/api/v3/user')
+
+        mock_request.return_value = self.response(200, '2', {'ETag': '"2"'})
+        self.assertEqual('2', self.session.get('https://git/api/v3/user').content)
+        self.assertEqual('Mon, 01 Jan 2018 00:00:00 GMT',
+                         mock_request.call_args[1]['headers']['If-Modified-Since'])
+
+        mock_request.return_value = self.response(304)
+        self.assertEqual('2', self.session.get('https://git/api/v3/user').content)
+
+    # Other users and other urls don't share responses
+    @mock.patch('requests.Session.request')
+    def test_request_keys(self, mock_request):
+        mock_request.return_value = self.response(200, '1', {'ETag': '"1"'})
+        self.session.get('https://git/api/v3/user',
+                         headers={'PRIVATE-TOKEN': 'foo'})
+
+        for url, token in [('https://git/api/v3/user', 'bar'),
+                           ('https://git/api/v3/users', 'foo')]:
+            self.session.get(url, headers={'PRIVATE-TOKEN': token})
+            self.assertNotIn('If-None-Match',
+                             mock_request.call_args[1]['headers'])
+
+    @mock.patch('requests.Session.request')
+    def test_request_not_cached(self, mock_request):
+        # no validators
+        mock_request.return_value = self.response(200, '1')
+        self.session.get('https://git/api/v3/user')
+        # not a GET
+        mock_request.return_value = self.response(200, '1', {'ETag': '"1"'})
+        self.session.put('https://git/api/v3/user')
+        self.assertFalse(os.path.exists(self.session.cache_dir))
+
+    @mock.patch('requests.Session.request')
+    def test_request_file_mode(self, mock_request):
+        mock_request.return_value = self.response(200, '1', {'ETag': '"1"'})
+        self.session.get('https://git/api/v3/user')
+        for name in os.listdir(self.session.cache_dir):
+            mode = os.stat(os.path.join(self.session.cache_dir, name)).st_mode
+            self.assertEqual(0o600, stat.S_IMODE(mode))
+
+    # evict()
+
+    @mock.patch('requests.Session.request')
+    def test_evict(self, mock_request):
+        mock_request.return_value = self.response(200, 'x' * 1000, {'ETag': '"1"'})
+        self.session.max_size = 2500
+        for i, url in enumerate(['a', 'b', 'c']):
+            self.session.get('https://git/' + url)
+            path = self.session.get_path(self.session.get_key(
+                'https://git/' + url, None, {}))
+            os.utime(path, (i, i))
+
+        mock_request.return_value = self.response(200, 'x' * 1000, {'ETag': '"1"'})
+        self.session.get('https://git/d')
+
+        cached = [url for url in 'abcd'
+                  if self.session.load(self.session.get_key('https://git/' + url, None, {}))]
+        self.assertEqual(['c', 'd'], cached)
+
+
+if __name__ == '__main__':
+    unittest.main()
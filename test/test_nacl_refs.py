@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+import mock
+import nacl.refs
+from nacl.refs import resolve
+from nacl.refs import current_branch
+from nacl.refs import list_branches
+from nacl.refs import parse_packed_refs
+from nacl.exceptions import RefReadError
+
+
+class TestNaclRefs(unittest.TestCase):
+
+    def setUp(self):
+        self.work_tree = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.work_tree)
+        self.git_dir = os.path.join(self.work_tree, '.git')
+        nacl.refs._packed_refs_cache.clear()
+
+        self.git('init', '-q')
+        self.git('checkout', '-q', '-b', 'master')
+        self.git('commit', '-q', '--allow-empty', '-m', 'one')
+        self.git('branch', 'feature/foo')
+        self.git('commit', '-q', '--allow-empty', '-m', 'two')
+        self.git('update-ref', 'refs/remotes/origin/master', 'HEAD~1')
+
+    def git(self, *args):
+        env = dict(os.environ,
+                   GIT_AUTHOR_NAME='nacl', GIT_AUTHOR_EMAIL='nacl@example.com',
+                   GIT_COMMITTER_NAME='nacl', GIT_COMMITTER_EMAIL='nacl@example.com')
+        return subprocess.Popen(['git', '-C', self.work_tree] + list(args),
+                                stdout=subprocess.PIPE,
+                                env=env).communicate()[0].strip()
+
+    # resolve()
+
+    def test_resolve_loose(self):
+        for name in ['HEAD', '@', 'master', 'refs/heads/master',
+                     'feature/foo', 'origin/master']:
+            self.assertEqual(self.git('rev-parse', name),
+                             resolve(self.git_dir, name))
+
+    def test_resolve_packed(self):
+        self.git('pack-refs', '--all')
+        for name in ['HEAD', 'master', 'feature/foo', 'origin/master']:
+            self.assertEqual(self.git('rev-parse', name),
+                             resolve(self.git_dir, name))
+
+    @mock.patch('nacl.refs.PACKED_REFS_MMAP_SIZE', 0)
+    def test_resolve_packed_mmap(self):
+        self.git('pack-refs', '--all')
+        for name in ['master', 'feature/foo', 'origin/master']:
+            self.assertEqual(self.git('rev-parse', name),
+                             resolve(self.git_dir, name))
+        # master must not match refs/heads/feature/master or the like
+        self.assertRaises(RefReadError, resolve, self.git_dir, 'foo')
+
+    def test_resolve_unknown(self):
+        self.assertRaises(RefReadError, resolve, self.git_dir, 'not_there')
+
+    def test_resolve_revision_syntax(self):
+        for name in ['master~1', 'HEAD^', 'master@{1}', 'a..b']:
+            self.assertRaises(RefReadError, resolve, self.git_dir, name)
+
+    def test_resolve_worktree(self):
+        open(os.path.join(self.git_dir, 'commondir'), 'w').close()
+        self.assertRaises(RefReadError, resolve, self.git_dir, 'HEAD')
+
+    def test_resolve_reftable(self):
+        os.mkdir(os.path.join(self.git_dir, 'reftable'))
+        self.assertRaises(RefReadError, resolve, self.git_dir, 'HEAD')
+
+    # current_branch()
+
+    def test_current_branch(self):
+        self.assertEqual('master', current_branch(self.git_dir))
+        self.git('checkout', '-q', 'feature/foo')
+        self.assertEqual('feature/foo', current_branch(self.git_dir))
+
+    def test_current_branch_detached(self):
+        self.git('checkout', '-q', '--detach')
+        self.assertEqual('HEAD', current_branch(self.git_dir))
+
+    # list_branches()
+
+    def test_list_branches(self):
+        self.git('branch', 'bar')
+        self.git('pack-refs', '--all')
+        self.git('branch', 'zoo')
+        self.assertEqual(['bar', 'feature/foo', 'master', 'zoo'],
+                         list_branches(self.git_dir))
+
+    # parse_packed_refs()
+
+    def test_parse_packed_refs(self):
+        content = ('# pack-refs with: peeled fully-peeled sorted \n'
+                   'aaaa refs/heads/master\n'
+                   'bbbb refs/tags/v1\n'
+                   '^cccc\n')
+        self.assertEqual({'refs/heads/master': 'aaaa', 'refs/tags/v1': 'bbbb'},
+                         parse_packed_refs(content))
+
+
+if __name__ == '__main__':
+    unittest.main()